@@ -3,13 +3,29 @@ import re
 import time
 import threading
 import sys
-import PySpin
+import json
+import multiprocessing
 import yaml
 import ruamel.yaml
 from pathlib import Path
-from numpy import mean, std, diff, round, argmax, histogram, arange, append
+from numpy import histogram, full, percentile, concatenate
 import termplotlib as tpl
 from colorama import just_fix_windows_console
+from frame_writer import WriterPool
+from frame_pool import FramePool, SharedFramePool, pixel_format_dtype, unpacked_format
+from frame_sinks import check_sink, make_sink
+from camera_backend import CameraError, get_backend
+from frame_timing import interframe_stats, cross_camera_stats, frame_id_drops, ClockModel, OnlineTiming
+from live_monitor import LiveMonitor
+from timestamp_log import TimestampLog
+from capture_loop import capture_frames
+from node_cache import CameraNodes, StartupTimes, apply_parallel
+from camera_settings import settings_for, order_cameras
+from usb_bandwidth import allocate_bandwidth
+from camera_config import (apply_config, read_snapshot, save_user_set, write_snapshots, sensor_settings,
+                           roi_settings, check_image, check_value, pacing_state, restore_pacing)
+from trigger_scheduler import TriggerScheduler
+from process_capture import PRIORITIES, CaptureResult, assign_cores, peak_rss_mb, run_capture_processes
 
 # Version for general use
 def read_config(configname):
@@ -37,390 +53,759 @@ abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
 os.chdir(dname)
 
-# Read cfg yaml file
-cfg = read_config('params.yaml')
+# Read cfg yaml file (params.yaml, unless another config file is given after the capture flag)
+cfg = read_config(sys.argv[2] if len(sys.argv) > 2 else 'params.yaml')
 num_images = cfg['num_images']
-exp_time = cfg['exp_time']
 framerate = cfg['framerate']
-trigger_line = cfg['trigger_line']
-bin_val = int(1)  # bin mode (WIP)
-
-# will now create folder to store images, which keeps track of date and updates recording session number
-if cfg['file_path'] == 0:
-    file_path = dname # write into repo root directory
+# With a numeric framerate, frames are paced by software triggers from Python (software), or by the
+# cameras' own AcquisitionFrameRate (camera). With camera pacing, primary_camera (a serial number) can
+# run free and trigger all other cameras through its primary_output_line.
+pacing = cfg.get('pacing', 'software')
+if pacing not in ('software', 'camera'):
+    raise ValueError("pacing must be software or camera, got %r" % pacing)
+software_trigger = framerate != 'hardware' and pacing == 'software'
+primary_camera = str(cfg['primary_camera']) if cfg.get('primary_camera') else None
+primary_output_line = cfg.get('primary_output_line', 'Line1')
+# Exposure, gain, trigger line, image size and format, output format and writer threads can be set per
+# camera under `cameras:` (see camera_settings.py); cam_settings[camnum] holds them once cameras are ordered
+cam_settings = []
+# Camera-paced cameras change their own frame rate limit (and the primary its output line); what these
+# were before configuring is kept here by camera number and put back after the run (see reset_trigger)
+pacing_before = {}
+writer_threads = cfg.get('writer_threads', 4)
+writer_queue_size = cfg.get('writer_queue_size', 256)
+drop_policy = cfg.get('drop_policy', 'block')
+frame_pool_size = cfg.get('frame_pool_size', 64)
+# frame period used to count dropped frames; for hardware triggering set expected_framerate, or it is
+# estimated from the recorded frame times
+if framerate != 'hardware':
+    expected_period_ns = 1e9 / framerate
+elif cfg.get('expected_framerate'):
+    expected_period_ns = 1e9 / cfg['expected_framerate']
 else:
-    file_path = os.path.expanduser(cfg['file_path'])
-dir_list = os.listdir(file_path)
-timestamp = time.localtime()
-timestamp = str(timestamp[0])+str(timestamp[1]).zfill(2)+str(timestamp[2]).zfill(2) # get year, month, day
-new_base_folder_name = 'images'+timestamp
-largest_recording_number = -1
-# get largest recording folder number out of all matching subdirs 
-for folder in dir_list:
-    if new_base_folder_name in folder:
-        if int(folder.split('-')[-1]) > largest_recording_number:
-            largest_recording_number = int(folder.split('-')[-1])
-im_savepath = os.path.join(file_path, new_base_folder_name+"-"+str(largest_recording_number+1)) # increment from largest value
-# Create save folder
-if not os.path.exists(im_savepath):
-    os.makedirs(im_savepath)
-os.chdir(im_savepath)
-
-# insert session number into the filename date
-orig_filename = cfg['file_name']
-assert '_' in orig_filename, "Filename should begin with the date and an underscore, e.g., 'yyyymmdd_'"
-filename = re.sub('_',f'-{largest_recording_number+1}_',orig_filename,count=1)
-
-
-# Thread process for saving images. This is super important, as the writing process takes time inline,
-# so offloading it to separate CPU threads allows continuation of image capture
-class ThreadWrite(threading.Thread):
-    def __init__(self, data, out):
-        threading.Thread.__init__(self)
-        self.data = data
-        self.out = out
+    expected_period_ns = None
+# software trigger: the scheduler spins for the last trigger_spin_ms before each tick instead of sleeping
+trigger_spin_ms = cfg.get('trigger_spin_ms', 1.0)
+monitor_interval = cfg.get('monitor_interval', 0.25)  # seconds between live status refreshes, 0 to disable
+timestamp_export = cfg.get('timestamp_export', 'txt')  # txt, mat or none, next to the _t<n>.npy log
+# UserSet to load before configuring (e.g. UserSet1), and whether `FLIR_Multicam.py 0` saves the configuration into it
+user_set = cfg.get('user_set')
+save_to_user_set = cfg.get('save_user_set', False)
+# USB3 bandwidth per host controller shared out between the cameras on it (see usb_bandwidth.py)
+usb_budget = cfg.get('usb_budget_MBps', 0) * 1e6
+usb_headroom = cfg.get('usb_headroom', 1.1)
+usb_over_budget = cfg.get('usb_over_budget', 'warn')
+startup_report = cfg.get('startup_report', False)  # print the time taken by every camera setup step
+report_file = cfg.get('report_file')  # optional JSON summary of the run, used by benchmark.py
+# One capture process and one writer process per camera instead of threads (see process_capture.py),
+# capture processes pinned to a core each (pin_cores) and run at process_priority (normal, high or realtime)
+capture_processes = cfg.get('capture_processes', False)
+pin_cores = cfg.get('pin_cores', True)
+process_priority = cfg.get('process_priority', 'normal')
+if process_priority not in PRIORITIES:
+    raise ValueError("process_priority must be one of %s, got %r" % (', '.join(PRIORITIES), process_priority))
+sink_options = {
+    'frames_per_chunk': cfg.get('frames_per_chunk', 1000),
+    'video_codec': cfg.get('video_codec', 'ffv1'),
+    'video_crf': cfg.get('video_crf', 18),
+    # nominal container rate; real frame times are saved in the _t.npy file next to each video
+    'video_fps': framerate if framerate != 'hardware' else cfg.get('video_fps', 30),
+    'ffmpeg_path': cfg.get('ffmpeg_path', 'ffmpeg'),
+    'camera_backend': cfg.get('camera_backend', 'spinnaker'),  # jpg frames are encoded by PySpin with real cameras
+}
+
+# Capture processes (capture_processes: true) import this script again; only the main process opens the
+# cameras and creates the session folder
+if __name__ == '__main__':
+    # spinnaker for real cameras (PySpin), or synthetic to exercise the pipeline without hardware
+    backend = get_backend(cfg.get('camera_backend', 'spinnaker'), cfg.get('synthetic'))
+    camera_errors = backend.errors
 
-    def run(self):
-        # These commands are legacy, and not needed (kept for documentation)
-        # image_result = self.data
-        # image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
-        self.data.Save(self.out)
+    # will now create folder to store images, which keeps track of date and updates recording session number
+    if cfg['file_path'] == 0:
+        file_path = dname # write into repo root directory
+    else:
+        file_path = os.path.expanduser(cfg['file_path'])
+    dir_list = os.listdir(file_path)
+    timestamp = time.localtime()
+    timestamp = str(timestamp[0])+str(timestamp[1]).zfill(2)+str(timestamp[2]).zfill(2) # get year, month, day
+    new_base_folder_name = 'images'+timestamp
+    largest_recording_number = -1
+    # get largest recording folder number out of all matching subdirs 
+    for folder in dir_list:
+        if new_base_folder_name in folder:
+            if int(folder.split('-')[-1]) > largest_recording_number:
+                largest_recording_number = int(folder.split('-')[-1])
+    im_savepath = os.path.join(file_path, new_base_folder_name+"-"+str(largest_recording_number+1)) # increment from largest value
+    # Create save folder
+    if not os.path.exists(im_savepath):
+        os.makedirs(im_savepath)
+    os.chdir(im_savepath)
+
+    # insert session number into the filename date
+    orig_filename = cfg['file_name']
+    assert '_' in orig_filename, "Filename should begin with the date and an underscore, e.g., 'yyyymmdd_'"
+    filename = re.sub('_',f'-{largest_recording_number+1}_',orig_filename,count=1)
+
+
+# Saving images is offloaded to a fixed pool of writer threads (see frame_writer.py), as the
+# writing process takes time inline. Each camera gets a bounded queue, so a slow disk applies
+# backpressure (or drops frames, depending on drop_policy) instead of spawning unbounded threads.
+# Frames are copied out of the SDK buffer into a FramePool slot first, so the camera buffer is
+# returned to the stream immediately and the writer never touches memory the driver has taken back.
+# Where the frame ends up (one .jpg per frame, or chunk files) is decided by the sink, see frame_sinks.py
+# Time from frame arrival until sink.write returns is kept per frame, for the run report. By then the
+# frame may only be in the page cache or a memory map, so this is not the time to a durable write.
+def save_frame(item):
+    sink, pool, slot, idx, timestamp, write_return = item
+    try:
+        sink.write(pool.buffers[slot], idx, timestamp)
+        write_return[idx] = time.perf_counter_ns() - timestamp
+    finally:
+        pool.release(slot)
+
+
+def release_slot(item):
+    pool, slot = item[1], item[2]
+    pool.release(slot)
+
+
+# Read frame size and pixel format from the camera, to size the frame pool
+def frame_geometry(cam):
+    return cam.get_node('Width'), cam.get_node('Height'), cam.get_node('PixelFormat')
 
 
 # Capturing is also threaded, to increase performance
 class ThreadCapture(threading.Thread):
-    def __init__(self, cam, camnum, nodemap):
+    def __init__(self, cam, camnum, writer, scheduler=None):
         threading.Thread.__init__(self)
         self.cam = cam
         self.camnum = camnum
+        self.writer = writer
+        # With software triggering, frames are triggered by the shared scheduler; this thread only collects them
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.add_trigger(CameraNodes(cam).software_trigger())
+            # s to wait for a triggered frame before giving up on it
+            self.trigger_timeout = 1 + 10 / framerate + cam_settings[camnum]['exp_time']
+        width, height, cam_format = frame_geometry(cam)
+        dtype = pixel_format_dtype(cam_format)
+        # packed formats (Mono12p) are unpacked into the pool and saved as 16 bit
+        self.pool = FramePool(frame_pool_size, height, width, dtype, cam_format)
+        self.sink = make_sink(cam_settings[camnum]['output_format'], filename, camnum, num_images, height, width,
+                              unpacked_format(cam_format), dtype, **sink_options)
+        # host time, camera (exposure) timestamp and frame ID of every frame, written straight to disk
+        self.log = TimestampLog(filename + '_t' + str(camnum) + '.npy', num_images)
+        self.timing = OnlineTiming(expected_period_ns)
+        self.write_return = full(num_images, -1, dtype='int64')
+
+    # Views of the frames recorded so far
+    @property
+    def times(self):
+        return self.log.host
+
+    @property
+    def cam_times(self):
+        return self.log.camera
+
+    @property
+    def frame_ids(self):
+        return self.log.frame_id
+
+    # Frames the writers never got (queue full or no free pool slot), and frames that failed to write
+    @property
+    def dropped(self):
+        return self.writer.dropped(self.camnum) + self.pool.exhausted
+
+    @property
+    def failed(self):
+        return self.writer.failed(self.camnum)
+
+    def on_frame(self, i, t_frame):
+        self.timing.update(t_frame)
+        # Progress is shown by the live monitor; without it, just announce the start
+        if i == 0 and self.camnum == 0 and not monitor_interval:
+            print('*** ACQUISITION STARTED ***\n')
+
+    def submit(self, slot, i, t_frame):
+        self.writer.submit(self.camnum, (self.sink, self.pool, slot, i, t_frame, self.write_return))
 
     def run(self):
-        times = []
-        t1 = []
-        if framerate != 'hardware':
-            nodemap = self.cam.GetNodeMap()
-
-        if self.camnum == 0:
-            primary = 1
-        else:
-            primary = 0
-
-        for i in range(num_images):
-            fstart = time.perf_counter_ns()
-            try:
-                #  Retrieve next received image
-                if framerate == 'hardware':
-                    image_result = self.cam.GetNextImage()
-                else:
-                    node_softwaretrigger_cmd = PySpin.CCommandPtr(nodemap.GetNode('TriggerSoftware'))
-                    if not PySpin.IsAvailable(node_softwaretrigger_cmd) or not PySpin.IsWritable(
-                            node_softwaretrigger_cmd):
-                        print('Unable to execute trigger. Aborting...')
-                        return False
-                    node_softwaretrigger_cmd.Execute()
-                    image_result = self.cam.GetNextImage()
-
-                times.append(time.perf_counter_ns())
-                if i == 0 and primary == 1:
-                    t1 = time.perf_counter_ns()
-                    print('*** ACQUISITION STARTED ***\n')
-
-                if i == int(num_images - 1) and primary == 1:
-                    t2 = time.perf_counter_ns()
-                if primary:
-                    # using .zfill to add leading zeros to frame idx, for better compatibility with ffmpeg commands
-                    print('COLLECTING IMAGE ' + str(i + 1).zfill(len(str(num_images))) + ' of ' + str(num_images), end='\r')
-                    sys.stdout.flush()
-                    
-                # using .zfill to add leading zeros to frame idx, for better compatibility with ffmpeg commands
-                fullfilename = filename + '_' + str(i + 1).zfill(len(str(num_images))) + '_cam' + str(self.camnum) + '.jpg'
-                background = ThreadWrite(image_result, fullfilename)
-                background.start()
-                image_result.Release()
-                ftime = 1e-9 * (time.perf_counter_ns() - fstart)
-                if framerate != 'hardware':
-                    if ftime < 1 / framerate:
-                        time.sleep(1 / framerate - ftime)
-
-            except PySpin.SpinnakerException as ex:
-                print('Error (577): %s' % ex)
-                return False
+        try:
+            missing = capture_frames(self.cam, num_images, self.log, self.pool, self.submit, camera_errors,
+                                     block=(drop_policy == 'block'), scheduler=self.scheduler,
+                                     timeout=self.trigger_timeout if self.scheduler is not None else None,
+                                     on_frame=self.on_frame)
+        except camera_errors as ex:
+            print('Error (577): %s' % ex)
+            return False
+        if missing:
+            print('cam%i: %i frame(s) never arrived' % (self.camnum, missing))
 
         self.cam.EndAcquisition()
-        if primary:
-            frame_diff_times = diff(times)*1e-6 #append(diff(times)*1e-6,15)
-            interframe_mean = mean(frame_diff_times) # ms
-            round_interframe_mean = int(round(interframe_mean))
-            interframe_devs = frame_diff_times-round_interframe_mean # ms
-            largest_interframe_dev = max(interframe_devs, key=abs)
-            number_of_dropped_frames = sum(interframe_devs>=round_interframe_mean-1)
-            interframe_std = std(frame_diff_times) # ms
-            # interframe_max = max(frame_diff_times) # ms
-            # interframe_min = min(frame_diff_times) # ms
-            print("Number of frames captured: ",num_images)
-            print(f"Images saved to: {im_savepath}")
-            print(f'Software-computed average frame rate: {str(round(num_images/((t2 - t1)*1e-9),decimals=4))} Hz')
-            print(f"Software-computed interframe statistics: {interframe_mean.round(decimals=4)} +/- {interframe_std.round(decimals=4)} ms")
-            print(f"Largest interframe deviation: {largest_interframe_dev.round(decimals=4)} ms")
-            print(f"Largest deviation was for frame #{argmax(abs(interframe_devs))}")
-            print(f"Number of deviations more than 0.1ms: {sum(interframe_devs>0.1)}")
-            print(f"Number of deviations more than 1ms: {sum(interframe_devs>1)}")
-            print(f"Number of deviations more than {round_interframe_mean-1}ms (likely dropped frames): {number_of_dropped_frames}")
-            counts, bin_edges = histogram(frame_diff_times)#bins=arange(interframe_min-0.2,interframe_max+0.2,0.2)) # keep bin size flexible
-            fig = tpl.figure()
-            fig.hist(counts, bin_edges,force_ascii=False, orientation="horizontal")
-            fig.show()
-            # use colorama to allow Windows systems to interpret ANSI color codes
-            just_fix_windows_console()
-            if number_of_dropped_frames > 0:
-                # color red with \033 stop and color codes
-                print(f'\033[1;31m Weird recording! {number_of_dropped_frames} dropped frame(s) detected. D: \033[0;0m')
-            else:
-                print('\033[1;32m Good recording! No dropped frames detected. :D \033[0;0m')
         # Save frametime data
-        with open(filename + '_t' + str(self.camnum) + '.txt', 'a') as t:
-            for item in times:
-                t.write(str(item) + ',\n')
+        self.log.close()
+        self.log.export(timestamp_export, 't' + str(self.camnum))
 
-def configure_cam(cam, camnum):
+def configure_cam(cam, camnum, timer=None, load_user_set=True):
     result = True
     if camnum == 0:
         print('*** CONFIGURING CAMERA(S) ***\n')
     try:
-        nodemap = cam.GetNodeMap()
-        # Ensure trigger mode off
-        # The trigger must be disabled in order to configure whether the source
-        # is software or hardware.
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
-            print('Unable to disable trigger mode 129 (node retrieval). Aborting...')
-            return False
-
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
-            print('Unable to disable trigger mode (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
-
-        node_trigger_source = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerSource'))
-        if not PySpin.IsAvailable(node_trigger_source) or not PySpin.IsWritable(node_trigger_source):
-            print('Unable to get trigger source 163 (node retrieval). Aborting...')
-            return False
-
-        # Set primary camera trigger source to cfg['trigger_line'] (hardware trigger)
-        if framerate == 'hardware':
-            node_trigger_source_set = node_trigger_source.GetEntryByName(trigger_line)
+        s = cam_settings[camnum]
+        nodes = CameraNodes(cam)
+        settings = []
+        # Every image setting is checked before anything is written, so a bad value leaves the camera as it was
+        check_image(cam, s['pixel_format'], s['binning'], s['binning_selector'], s['decimation'], s['roi'])
+
+        role = camera_role(camnum)
+        if role in ('free', 'primary'):
+            pacing_before[camnum] = pacing_state(cam, primary_output_line if role == 'primary' else None,
+                                                 camera_errors)
+
+        # Set primary camera trigger source to the camera's trigger_line (hardware trigger)
+        if role in ('hardware', 'secondary'):
+            settings.append(('TriggerSource', s['trigger_line'], False))
             if camnum == 0:
                 print('Trigger source set to hardware...\n')
-        else:
-            node_trigger_source_set = node_trigger_source.GetEntryByName('Software')
+        elif role == 'software':
+            settings.append(('TriggerSource', 'Software', False))
             if camnum == 0:
                 print('Trigger source set to software, framerate = %i...\n' % framerate)
+        if role == 'primary' or (role == 'free' and camnum == 0):
+            print('Trigger off, camera runs at framerate = %s...\n' % framerate)
 
-        if not PySpin.IsAvailable(node_trigger_source_set) or not PySpin.IsReadable(
-                node_trigger_source_set):
-            print('Unable to set trigger source (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_source.SetIntValue(node_trigger_source_set.GetValue())
-        node_trigger_mode_on = node_trigger_mode.GetEntryByName('On')
-
-        if not PySpin.IsAvailable(node_trigger_mode_on) or not PySpin.IsReadable(node_trigger_mode_on):
-            print('Unable to enable trigger mode (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_mode.SetIntValue(node_trigger_mode_on.GetValue())
+        # Set trigger overlap to "Read Out" for hardware triggering
+        if role in ('hardware', 'secondary'):
+            settings.append(('TriggerOverlap', 'ReadOut', False))
+        elif role == 'software':
+            settings.append(('TriggerOverlap', 'Off', False))
 
         # Set acquisition mode to continuous
-        node_acquisition_mode = PySpin.CEnumerationPtr(nodemap.GetNode('AcquisitionMode'))
-        if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
-            print('Unable to set acquisition mode to continuous (enum retrieval). Aborting...')
-            return False
-
-        # Retrieve entry node from enumeration node
-        node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName('Continuous')
-        if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(
-                node_acquisition_mode_continuous):
-            print('Unable to set acquisition mode to continuous (entry retrieval). Aborting...')
-            return False
-
-        # Retrieve integer value from entry node
-        acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
-
-        # Set integer value from entry node as new value of enumeration node
-        node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
-
-        # Retrieve Stream Parameters device nodemap
-        s_node_map = cam.GetTLStreamNodeMap()
-
-        # Retrieve Buffer Handling Mode Information
-        handling_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferHandlingMode'))
-        if not PySpin.IsAvailable(handling_mode) or not PySpin.IsWritable(handling_mode):
-            print('Unable to set Buffer Handling mode (node retrieval). Aborting...\n')
-            return False
-
-        handling_mode_entry = PySpin.CEnumEntryPtr(handling_mode.GetCurrentEntry())
-        if not PySpin.IsAvailable(handling_mode_entry) or not PySpin.IsReadable(handling_mode_entry):
-            print('Unable to set Buffer Handling mode (Entry retrieval). Aborting...\n')
-            return False
+        settings.append(('AcquisitionMode', 'Continuous', False))
 
         # Set stream buffer Count Mode to manual
-        stream_buffer_count_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferCountMode'))
-        if not PySpin.IsAvailable(stream_buffer_count_mode) or not PySpin.IsWritable(stream_buffer_count_mode):
-            print('Unable to set Buffer Count Mode (node retrieval). Aborting...\n')
-            return False
-
-        stream_buffer_count_mode_manual = PySpin.CEnumEntryPtr(stream_buffer_count_mode.GetEntryByName('Manual'))
-        if not PySpin.IsAvailable(stream_buffer_count_mode_manual) or not PySpin.IsReadable(
-                stream_buffer_count_mode_manual):
-            print('Unable to set Buffer Count Mode entry (Entry retrieval). Aborting...\n')
-            return False
-
-        stream_buffer_count_mode.SetIntValue(stream_buffer_count_mode_manual.GetValue())
-
-        # Retrieve and modify Stream Buffer Count
-        buffer_count = PySpin.CIntegerPtr(s_node_map.GetNode('StreamBufferCountManual'))
-        if not PySpin.IsAvailable(buffer_count) or not PySpin.IsWritable(buffer_count):
-            print('Unable to set Buffer Count (Integer node retrieval). Aborting...\n')
-            return False
+        settings.append(('StreamBufferCountMode', 'Manual', True))
 
         # Set new buffer value to the max
-        max_buffer_count = buffer_count.GetMax()
+        max_buffer_count = nodes.buffer_count_max()
         if camnum==0:
             print(f"Setting buffer count to: {max_buffer_count}")
-        buffer_count.SetValue(max_buffer_count)
-
-        # max_packet_size = cam.DiscoverMaxPacketSize()
-        # from pdb import set_trace; set_trace()
-        # Retrieve and modify resolution (WIP)
-        # node_width = PySpin.CIntegerPtr(nodemap.GetNode('Width'))
-        # if PySpin.IsAvailable(node_width) and PySpin.IsWritable(node_width):
-        #     width_to_set = int(1440 / bin_val)
-        #     node_width.SetValue(width_to_set)
-        #     if camnum == 0:
-        #         print('Width set to %i...' % node_width.GetValue())
-        # else:
-        #     if camnum == 0:
-        #         print('Width not available, width is %i...' % node_width.GetValue())
-        #
-        # node_height = PySpin.CIntegerPtr(nodemap.GetNode('Height'))
-        # if PySpin.IsAvailable(node_height) and PySpin.IsWritable(node_height):
-        #     height_to_set = int(1080 / bin_val)
-        #     node_height.SetValue(height_to_set)
-        #     if camnum == 0:
-        #         print('Height set to %i...' % node_height.GetValue())
-        # else:
-        #     if camnum == 0:
-        #         print('Width not available, height is %i...' % node_height.GetValue())
-
-        # Access trigger overlap info
-        node_trigger_overlap = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerOverlap'))
-        if not PySpin.IsAvailable(node_trigger_overlap) or not PySpin.IsWritable(node_trigger_overlap):
-            print('Unable to set trigger overlap to "Read Out". Aborting...')
-            return False
-
-        # Retrieve enumeration for trigger overlap Read Out
-        if framerate == 'hardware':
-            node_trigger_overlap_ro = node_trigger_overlap.GetEntryByName('ReadOut')
-        else:
-            node_trigger_overlap_ro = node_trigger_overlap.GetEntryByName('Off')
+        settings.append(('StreamBufferCountManual', max_buffer_count, True))
 
-        if not PySpin.IsAvailable(node_trigger_overlap_ro) or not PySpin.IsReadable(
-                node_trigger_overlap_ro):
-            print('Unable to set trigger overlap (entry retrieval). Aborting...')
-            return False
-
-        # Retrieve integer value from enumeration
-        trigger_overlap_ro = node_trigger_overlap_ro.GetValue()
-
-        # Set trigger overlap using retrieved integer from enumeration
-        node_trigger_overlap.SetIntValue(trigger_overlap_ro)
-
-        # Access exposure auto info
-        node_exposure_auto = PySpin.CEnumerationPtr(nodemap.GetNode('ExposureAuto'))
-        if not PySpin.IsAvailable(node_exposure_auto) or not PySpin.IsWritable(node_exposure_auto):
-            print('Unable to get exposure auto. Aborting...')
-            return False
-
-        # Retrieve enumeration for trigger overlap Read Out
-        node_exposure_auto_off = node_exposure_auto.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_exposure_auto_off) or not PySpin.IsReadable(
-                node_exposure_auto_off):
-            print('Unable to get exposure auto "Off" (entry retrieval). Aborting...')
-            return False
-
-        # Set exposure auto to off
-        node_exposure_auto.SetIntValue(node_exposure_auto_off.GetValue())
-
-        # Access exposure info
-        node_exposure_time = PySpin.CFloatPtr(nodemap.GetNode('ExposureTime'))
-        if not PySpin.IsAvailable(node_exposure_time) or not PySpin.IsWritable(node_exposure_time):
-            print('Unable to get exposure time. Aborting...')
-            return False
-
-        # Set exposure float value
-        node_exposure_time.SetValue(exp_time * 1000000)
+        # Set exposure auto to off, then the exposure time
+        settings.append(('ExposureAuto', 'Off', False))
+        settings.append(('ExposureTime', s['exp_time'] * 1000000, False))
+        if camnum == 0:
+            print('Exposure time set to ' + str(s['exp_time'] * 1000) + 'ms...')
+
+        # Gain in dB, left as is if not set
+        if s['gain'] is not None:
+            settings.append(('GainAuto', 'Off', False))
+            settings.append(('Gain', float(s['gain']), False))
+
+        # Trigger mode last; the trigger is turned off while the trigger settings above change.
+        # Cameras pacing themselves run with the trigger off.
+        settings.append(('TriggerMode', 'Off' if role in ('free', 'primary') else 'On', False))
+
+        # Only nodes that don't already hold these values are written. Pixel format, binning and
+        # decimation go first, since the valid ROI depends on them.
+        sensor = sensor_settings(cam, s['pixel_format'], s['binning'], s['binning_selector'], s['decimation'])
+        changed = apply_config(cam, sensor, camera_errors, user_set=user_set if load_user_set else None,
+                               timer=timer, camnum=camnum)
+        roi = s['roi'] or {}
+        image = roi_settings(cam, roi.get('width', 0), roi.get('height', 0), roi.get('offset_x', 0),
+                             roi.get('offset_y', 0))
+        settings = image + settings
+        changed += apply_config(cam, settings, camera_errors, timer=timer, camnum=camnum)
+        settings = sensor + settings
+
+        # On-camera frame rate. Its range depends on the exposure and image size, so it is set last.
+        if role in ('free', 'primary'):
+            changed += apply_config(cam, [('AcquisitionFrameRateEnable', True, False)], camera_errors,
+                                    timer=timer, camnum=camnum)
+            check_value('AcquisitionFrameRate', float(framerate), *cam.node_range('AcquisitionFrameRate'))
+            rate = [('AcquisitionFrameRateEnable', True, False), ('AcquisitionFrameRate', float(framerate), False)]
+            changed += apply_config(cam, rate[1:], camera_errors, timer=timer, camnum=camnum)
+            settings += rate
+        elif not cam.resolve(['AcquisitionFrameRateEnable']):
+            # triggered cameras are paced by their trigger alone, also after a camera-paced run
+            rate = [('AcquisitionFrameRateEnable', False, False)]
+            changed += apply_config(cam, rate, camera_errors, timer=timer, camnum=camnum)
+            settings += rate
+        # The primary signals each exposure on its output line, which triggers the other cameras
+        if role == 'primary':
+            line = [('LineSelector', primary_output_line, False)]
+            changed += apply_config(cam, line, camera_errors, timer=timer, camnum=camnum)
+            output = [('LineMode', 'Output', False), ('LineSource', 'ExposureActive', False)]
+            changed += apply_config(cam, output, camera_errors, timer=timer, camnum=camnum)
+            settings += line + output
+            print('cam%i is the primary camera, triggering the others on %s' % (camnum, primary_output_line))
         if camnum == 0:
-            print('Exposure time set to ' + str(exp_time * 1000) + 'ms...')
+            print('Image size set to %ix%i, %s...\n' % frame_geometry(cam))
+        serial = str(cam.get_node('DeviceSerialNumber'))
+        print('cam%i (%s): %i of %i setting(s) changed%s' % (camnum, serial, len(changed), len(settings),
+              ''.join('\n    %s = %s' % (name, value) for name, value, _ in changed) if startup_report else ''))
 
     # General exception
-    except PySpin.SpinnakerException as ex:
+    except camera_errors as ex:
         print('Error (237): %s' % ex)
         return False
 
     return result
 
 
+# How a camera's frames are paced: hardware (external trigger), software (TriggerSoftware from the
+# scheduler), free (own AcquisitionFrameRate), primary (free, and triggers the others) or secondary
+# (hardware triggered by the primary)
+def camera_role(camnum):
+    if framerate == 'hardware':
+        return 'hardware'
+    if pacing == 'software':
+        return 'software'
+    if primary_camera is None:
+        return 'free'
+    return 'primary' if cam_settings[camnum]['serial'] == primary_camera else 'secondary'
+
+
+# Frame rate for the timing report; unavailable when the frame times don't advance (a stalled camera)
+def format_rate(rate):
+    return f"{rate:.4f} Hz" if rate is not None else "unavailable (frame times don't advance)"
+
+
+# Frame timing statistics for every camera, plus how well the cameras line up with each other
+def print_timing_report(thread, scheduler=None):
+    stats = [interframe_stats(t.times, expected_period_ns) for t in thread]
+    if stats[0] is None:
+        return
+    drops = [frame_id_drops(t.frame_ids) for t in thread]
+    s = stats[0]
+    hw = interframe_stats(thread[0].cam_times, expected_period_ns)
+    print("Number of frames captured: ",num_images)
+    print(f"Images saved to: {im_savepath}")
+    print(f"Software-computed average frame rate: {format_rate(s['rate'])}")
+    print(f"Software-computed interframe statistics: {s['mean']:.4f} +/- {s['std']:.4f} ms")
+    print(f"Camera-timestamp interframe statistics: {hw['mean']:.4f} +/- {hw['std']:.4f} ms")
+    print(f"Largest interframe deviation: {s['largest_dev']:.4f} ms")
+    print(f"Largest deviation was for frame #{s['largest_dev_idx']}")
+    print(f"Number of deviations more than 0.1ms: {s['over_0_1ms']}")
+    print(f"Number of deviations more than 1ms: {s['over_1ms']}")
+    print(f"Number of intervals of {1.5 * s['period']:.2f}ms or more (likely dropped frames): {s['drop_events']}, "
+          f"{s['dropped']} frame(s) missing")
+    print(f"Dropped frames from frame ID gaps: {drops[0]['dropped']}")
+    if scheduler is not None and scheduler.ticks:
+        late = scheduler.lateness_stats()
+        print(f"Software trigger lateness: {late['p50']:.1f} us median, {late['p99']:.1f} us p99, "
+              f"{late['max']:.1f} us max over {scheduler.ticks} ticks")
+        if any(scheduler.missed):
+            print(f"Software triggers that failed to fire, per camera: {scheduler.missed}")
+    counts, bin_edges = histogram(s['intervals']) # keep bin size flexible
+    fig = tpl.figure()
+    fig.hist(counts, bin_edges,force_ascii=False, orientation="horizontal")
+    fig.show()
+    for i, t in enumerate(thread):
+        st = stats[i]
+        if i > 0 and st is not None:
+            print(f"cam{i}: {st['num_frames']} frames, {format_rate(st['rate'])}, {st['mean']:.4f} +/- {st['std']:.4f} ms, "
+                  f"{drops[i]['dropped']} dropped frame(s)")
+        if len(t.cam_times) > 1:
+            clock = ClockModel(t.cam_times, t.times)
+            print(f"cam{i} clock: drift {clock.drift_ppm:.2f} ppm vs host, residual {clock.residual_ms:.4f} ms")
+    cross = cross_camera_stats([t.times for t in thread], [t.frame_ids for t in thread])
+    if cross is not None:
+        print(f"Cross-camera frame spread: {cross['spread_mean']:.4f} ms mean, {cross['spread_max']:.4f} ms max "
+              f"(frame #{cross['spread_max_idx']})")
+    number_of_dropped_frames = sum(d['dropped'] for d in drops)
+    # use colorama to allow Windows systems to interpret ANSI color codes
+    just_fix_windows_console()
+    if number_of_dropped_frames > 0:
+        # color red with \033 stop and color codes
+        print(f'\033[1;31m Weird recording! {number_of_dropped_frames} dropped frame(s) detected. D: \033[0;0m')
+    else:
+        print('\033[1;32m Good recording! No dropped frames detected. :D \033[0;0m')
+
+
+# Summary of a finished run: frames, drops, arrival-to-write-return time, sustained rate, CPU and memory use
+# process_rss: peak memory (MB) of every capture and writer process, in processes mode. Peak memory is
+# then the sum over all processes, main included; shared frame pools count once per process using them.
+def write_run_report(path, thread, t_start, t_end, cpu_time, trigger_lateness=None, process_rss=None):
+    peak = peak_rss_mb()
+    per_process = None
+    if process_rss is not None:
+        per_process = dict({'main': peak}, **process_rss)
+        known = [mb for mb in per_process.values() if mb is not None]
+        peak = sum(known) if known else None
+    cameras = []
+    for i, t in enumerate(thread):
+        written = t.write_return[t.write_return >= 0]
+        span = 1e-9 * (t.times[-1] - t.times[0]) if len(t.times) > 1 else 0
+        cameras.append({
+            'camera': i,
+            'captured': len(t.times),
+            'written': int(written.size),
+            'dropped': t.dropped,
+            'failed': t.failed,
+            'fps': (len(t.times) - 1) / span if span else None,
+        })
+    write_return = concatenate([t.write_return[t.write_return >= 0] for t in thread]) * 1e-6
+    wall_time = 1e-9 * (t_end - t_start)
+    # sustained rate: everything written, from the first frame arriving until the writers are drained
+    first_frame = min((t.times[0] for t in thread if len(t.times)), default=t_start)
+    report = {
+        'cameras': cameras,
+        'frames_written': int(write_return.size),
+        'wall_time_s': wall_time,
+        'sustained_fps': write_return.size / (1e-9 * (t_end - first_frame)),
+        # frame arrival until sink.write returned, not until the frame was durably on disk
+        'write_return_ms': {
+            'p50': float(percentile(write_return, 50)) if write_return.size else None,
+            'p99': float(percentile(write_return, 99)) if write_return.size else None,
+            'max': float(write_return.max()) if write_return.size else None,
+        },
+        'cpu_percent': 100 * cpu_time / wall_time,
+        'peak_rss_mb': peak,
+        'peak_rss_mb_per_process': per_process,
+        'trigger_lateness_us': trigger_lateness,
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def print_write_problems(t):
+    if t.dropped or t.failed:
+        print(f'cam{t.camnum}: {t.dropped} frame(s) dropped by writer queue, {t.failed} failed to write')
+
+
+# Writer pool for every camera: cameras share one pool of writer_threads threads, except cameras with
+# their own writer_threads setting, which get a pool to themselves. Returns the per-camera pools and
+# the distinct pools.
+def make_writers(num_cameras):
+    shared = None
+    writers = []
+    for i in range(num_cameras):
+        n = cam_settings[i]['writer_threads']
+        if n == writer_threads and shared is not None:
+            pool = shared
+        else:
+            pool = WriterPool(save_frame, num_workers=n, queue_size=writer_queue_size, drop_policy=drop_policy,
+                              on_drop=release_slot)
+            if n == writer_threads:
+                shared = pool
+        pool.add_camera(i)
+        writers.append(pool)
+    pools = list({id(pool): pool for pool in writers}.values())
+    for pool in pools:
+        pool.start()
+    return writers, pools
+
+
 def config_and_acquire(camlist):
     thread = []
-    for i, cam in enumerate(camlist):
-        cam.Init()
-        configure_cam(cam, i)
-        nodemap = cam.GetNodeMap()
-        cam.BeginAcquisition()
-        thread.append(ThreadCapture(cam, i, nodemap))
-        thread[i].start()
+    t_start = time.perf_counter_ns()
+    cpu_start = time.process_time()
+    writers, pools = make_writers(len(camlist))
+    # one timing source for all cameras in software trigger mode, started once every camera is acquiring
+    scheduler = None
+    if software_trigger:
+        scheduler = TriggerScheduler(framerate, num_images, spin_ms=trigger_spin_ms, errors=camera_errors)
+    # Init and configure all cameras at once, then start acquiring on all of them together
+    timer = StartupTimes()
+    # Once every camera is configured, USB bandwidth is allocated between them and the capture threads
+    # and their sinks are made (by one thread). A sink that fails (e.g. no ffmpeg) then stops the run
+    # before any camera is acquiring.
+    usb_ok = []
+    acquiring = set()
+    failures = []
+
+    def prepare():
+        usb_ok.append(allocate_usb(camlist))
+        if usb_ok[0]:
+            thread.extend(ThreadCapture(cam, i, writers[i], scheduler) for i, cam in enumerate(camlist))
+
+    barrier = threading.Barrier(len(camlist), action=prepare)
+    started = threading.Barrier(len(camlist))
+
+    def arm(cam, camnum):
+        try:
+            if not init_and_configure(cam, camnum, timer):
+                raise CameraError('cam%i could not be configured' % camnum)
+            barrier.wait()
+            # a primary camera starts last, so the others don't miss its first pulses
+            primary = camera_role(camnum) == 'primary'
+            if usb_ok[0] and not primary:
+                with timer.step(camnum, 'BeginAcquisition'):
+                    cam.BeginAcquisition()
+                acquiring.add(camnum)
+            started.wait()
+            if usb_ok[0] and primary:
+                with timer.step(camnum, 'BeginAcquisition'):
+                    cam.BeginAcquisition()
+                acquiring.add(camnum)
+        except BaseException as ex:
+            if not isinstance(ex, threading.BrokenBarrierError):
+                failures.append(ex)
+            barrier.abort()  # don't leave the other cameras waiting for this one
+            started.abort()
+            raise
+
+    try:
+        apply_parallel(camlist, arm)
+    except BaseException as ex:
+        release_cameras(camlist, pools, thread, acquiring)
+        if not isinstance(ex, Exception):
+            raise
+        print('Error (540): %s' % (failures[0] if failures else ex))
+        return
+    timer.print_summary(startup_report)
+    if not usb_ok[0]:
+        print('\033[1;31m Not acquiring: the cameras would need more USB bandwidth than available '
+              '(usb_over_budget: refuse). \033[0;0m')
+        release_cameras(camlist, pools)
+        return
+    save_snapshots(camlist)
+    for t in thread:
+        t.start()
 
     if framerate == 'hardware':
         print('*** WAITING FOR FIRST TRIGGER... ***\n')
+    elif scheduler is not None:
+        scheduler.start()
 
+    if monitor_interval:
+        monitor = LiveMonitor(thread, num_images, monitor_interval)
+        monitor.start()
     for t in thread:
         t.join()
+    if monitor_interval:
+        monitor.stop()
+    if scheduler is not None:
+        scheduler.stop()
+    print_timing_report(thread, scheduler)
+
+    # Wait for all queued frames to be written before releasing the cameras
+    print('*** WRITING REMAINING IMAGES... ***\n')
+    for pool in pools:
+        pool.drain()
+    for i, t in enumerate(thread):
+        t.sink.close()
+        print_write_problems(t)
+    if report_file:
+        write_run_report(report_file, thread, t_start, time.perf_counter_ns(), time.process_time() - cpu_start,
+                         scheduler.lateness_stats() if scheduler is not None else None)
 
     for i, cam in enumerate(camlist):
-        reset_trigger(cam)
+        reset_trigger(cam, i)
         cam.DeInit()
 
 
-# Config camera params, but don't begin acquisition
-def config_and_return(camlist):
+# Undo a setup that stopped before capturing: stop the writers, close the sinks made so far, and stop,
+# reset and release every camera
+def release_cameras(camlist, pools, thread=(), acquiring=()):
+    for pool in pools:
+        pool.drain()
+    for t in thread:
+        try:
+            t.sink.close()
+        except OSError as ex:
+            print('Error (560): %s' % ex)
+    for i, cam in enumerate(camlist):
+        try:
+            if i in acquiring:
+                cam.EndAcquisition()
+            reset_trigger(cam, i)
+            cam.DeInit()
+        except camera_errors as ex:
+            print('Error (663): %s' % ex)
+
+
+# With capture_processes, cameras are configured here as usual and then handed to a capture process and a
+# writer process each (see process_capture.py), which share a frame pool in shared memory. The live
+# monitor runs on the capture threads, so it isn't available in this mode.
+def config_and_acquire_processes(camlist):
+    t_start = time.perf_counter_ns()
+    cpu_start = cpu_time_with_children()
+    timer = StartupTimes()
+    try:
+        configured = all(apply_parallel(camlist, lambda cam, camnum: init_and_configure(cam, camnum, timer)))
+    except camera_errors as ex:
+        print('Error (540): %s' % ex)
+        configured = False
+    if not configured:
+        print('Not acquiring: not every camera could be configured')
+        release_cameras(camlist, [])
+        return
+    timer.print_summary(startup_report)
+    if not allocate_usb(camlist):
+        print('\033[1;31m Not acquiring: the cameras would need more USB bandwidth than available '
+              '(usb_over_budget: refuse). \033[0;0m')
+        for i, cam in enumerate(camlist):
+            reset_trigger(cam, i)
+            cam.DeInit()
+        return
+    try:
+        for s in cam_settings[:len(camlist)]:
+            check_sink(s['output_format'], **sink_options)
+    except FileNotFoundError as ex:
+        print('Error (540): %s' % ex)
+        release_cameras(camlist, [])
+        return
+    snapshots = save_snapshots(camlist)
+
+    ctx = multiprocessing.get_context('spawn')
+    if pin_cores:
+        capture_cores, writer_cores = assign_cores(len(camlist))
+    else:
+        capture_cores, writer_cores = [None] * len(camlist), None
+    jobs = []
+    pools = []
     for i, cam in enumerate(camlist):
+        width, height, cam_format = frame_geometry(cam)
+        pools.append(SharedFramePool(frame_pool_size, height, width, pixel_format_dtype(cam_format), cam_format, ctx))
+        s = cam_settings[i]
+        jobs.append({
+            'camnum': i,
+            'serial': s['serial'],
+            'role': camera_role(i),
+            'pacing_before': pacing_before.get(i, []),
+            'snapshot': snapshots[i],
+            'backend': cfg.get('camera_backend', 'spinnaker'),
+            'backend_options': dict(cfg.get('synthetic') or {}),
+            'num_images': num_images,
+            'framerate': framerate,
+            'exp_time': s['exp_time'],
+            'spin_ms': trigger_spin_ms,
+            'drop_policy': drop_policy,
+            'pixel_format': cam_format,
+            'output_format': s['output_format'],
+            'writer_threads': s['writer_threads'],
+            'sink_options': sink_options,
+            # the processes don't share this process's working directory
+            'basename': os.path.abspath(filename),
+            'log_path': os.path.abspath(filename + '_t' + str(i) + '.npy'),
+            'timestamp_export': timestamp_export,
+            'cores': capture_cores[i],
+            'writer_cores': writer_cores,
+            'priority': process_priority,
+        })
+        # the capture process opens the camera again; it keeps its configuration
+        cam.DeInit()
+
+    if framerate == 'hardware':
+        print('*** WAITING FOR FIRST TRIGGER... ***\n')
+    results = run_capture_processes(jobs, pools, ctx)
+    for pool in pools:
+        pool.close()
+
+    captures = []
+    for job in jobs:
+        i = job['camnum']
+        capture, writer = results[i].get('capture', {}), results[i].get('writer', {})
+        for name, result in (('capture', capture), ('writer', writer)):
+            for problem in result.get('problems', []):
+                print('cam%i %s process: %s' % (i, name, problem))
+            if result.get('error'):
+                print('Error (577): cam%i %s process: %s' % (i, name, result['error']))
+        if capture.get('missing'):
+            print('cam%i: %i frame(s) never arrived' % (i, capture['missing']))
+        captures.append(CaptureResult(i, job['log_path'], capture, writer))
+    print_timing_report(captures)
+    lateness = [c.capture['trigger_lateness_us'] for c in captures if c.capture.get('trigger_lateness_us')]
+    for c in captures:
+        late = c.capture.get('trigger_lateness_us')
+        if late:
+            print(f"cam{c.camnum} software trigger lateness: {late['p50']:.1f} us median, {late['p99']:.1f} us p99, "
+                  f"{late['max']:.1f} us max")
+        if c.capture.get('missed_triggers'):
+            print(f"cam{c.camnum}: {c.capture['missed_triggers']} software trigger(s) failed to fire")
+        print_write_problems(c)
+    if report_file:
+        process_rss = {'%s%i' % (kind, c.camnum): result.get('peak_rss_mb')
+                       for c in captures for kind, result in (('capture', c.capture), ('writer', c.writer))}
+        write_run_report(report_file, captures, t_start, time.perf_counter_ns(), cpu_time_with_children() - cpu_start,
+                         max(lateness, key=lambda late: late['p99']) if lateness else None, process_rss)
+
+
+# CPU time of this process and its finished child processes (children are only counted on Unix)
+def cpu_time_with_children():
+    t = os.times()
+    return time.process_time() + t.children_user + t.children_system
+
+
+# Set the USB throughput limit of every camera so they fit their controller's budget. Returns False
+# if the cameras need more than the budget and usb_over_budget is refuse.
+def allocate_usb(camlist):
+    if not usb_budget:
+        return True
+    if framerate != 'hardware':
+        fps = framerate
+    else:
+        fps = cfg.get('expected_framerate') or None
+        if fps is None:
+            print('Set expected_framerate to check the USB bandwidth needed; throughput limits left as they are')
+    try:
+        problems = allocate_bandwidth(camlist, [s['usb_controller'] for s in cam_settings], fps, usb_budget,
+                                      usb_headroom, camera_errors)
+    except camera_errors as ex:
+        print('Error (601): %s' % ex)
+        return True
+    if problems:
+        # use colorama to allow Windows systems to interpret ANSI color codes
+        just_fix_windows_console()
+        for problem in problems:
+            print('\033[1;33m USB bandwidth: %s \033[0;0m' % problem)
+        return usb_over_budget != 'refuse'
+    return True
+
+
+# Camera settings of the session, keyed by serial number
+def save_snapshots(camlist):
+    snapshots = apply_parallel(camlist, lambda cam, camnum: read_snapshot(cam, camera_errors))
+    write_snapshots(filename + '_cameras.yaml', {str(snap['device'].get('DeviceSerialNumber', i)): snap
+                                                 for i, snap in enumerate(snapshots)})
+    return snapshots
+
+
+def init_and_configure(cam, camnum, timer=None, load_user_set=True):
+    if timer is None:
+        cam.Init()
+        return configure_cam(cam, camnum, load_user_set=load_user_set)
+    with timer.step(camnum, 'Init'):
         cam.Init()
-        configure_cam(cam, i)
+    with timer.step(camnum, 'configure'):
+        return configure_cam(cam, camnum, timer, load_user_set)
+
+
+# Config camera params, but don't begin acquisition. Cameras are configured in parallel.
+def config_and_return(camlist):
+    timer = StartupTimes()
+    # when saving the configuration to the UserSet, build it from params.yaml rather than the old UserSet
+    load = not save_to_user_set
+    configured = all(apply_parallel(camlist, lambda cam, camnum: init_and_configure(cam, camnum, timer, load)))
+    timer.print_summary(startup_report)
+    allocate_usb(camlist)
+    save_snapshots(camlist)
+    if user_set and save_to_user_set and not configured:
+        print('Not every camera could be configured; nothing saved to %s' % user_set)
+    elif user_set and save_to_user_set:
+        for i, cam in enumerate(camlist):
+            try:
+                save_user_set(cam, user_set)
+            except camera_errors as ex:
+                print('Error (648): %s' % ex)
+        print('Configuration saved to %s on all cameras' % user_set)
 
     for i, cam in enumerate(camlist):
-        reset_trigger(cam)
+        reset_trigger(cam, i)
         cam.DeInit()
 
-# Trigger reset
-def reset_trigger(cam):
-    nodemap = cam.GetNodeMap()
+# Trigger reset, and the frame rate limit and output line of a camera-paced camera as they were before the run
+def reset_trigger(cam, camnum):
     try:
         result = True
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
-            print('Unable to disable trigger mode 630 (node retrieval). Aborting...')
-            return False
-
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
-            print('Unable to disable trigger mode (enum entry retrieval). Aborting...')
-            return False
+        CameraNodes(cam).trigger_mode = 'Off'
+        restore_pacing(cam, pacing_before.get(camnum, []), camera_errors)
 
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
-
-    except PySpin.SpinnakerException as ex:
+    except camera_errors as ex:
         print('Error (663): %s' % ex)
         result = False
 
@@ -438,26 +823,40 @@ def main():
     test_file.close()
     os.remove(test_file.name)
     result = True
-    system = PySpin.System.GetInstance()
-    cam_list = system.GetCameras()
-    num_cameras = cam_list.GetSize()
+    cam_list = backend.get_cameras()
+    num_cameras = len(cam_list)
 
     print('Number of cameras detected: %d' % num_cameras)
 
+    # Number cameras in a fixed order (see camera_settings.py) and look up each camera's settings
+    serials = [str(cam.serial_number()) for cam in cam_list]
+    cam_list, serials, missing = order_cameras(cam_list, serials, cfg)
+    for serial in missing:
+        print('Camera %s is listed in the config but not connected' % serial)
+    if primary_camera is not None and pacing == 'camera' and primary_camera not in serials:
+        cam_list.clear()  # the camera objects must be gone before the system is released
+        backend.release()
+        print('Primary camera %s is not connected! Goodbye.' % primary_camera)
+        return False
+    cam_settings[:] = [settings_for(cfg, serial) for serial in serials]
+    for i, serial in enumerate(serials):
+        print('cam%i: %s' % (i, serial))
+
     # Multicamera handling
     if num_cameras == 0:
-        cam_list.Clear()
-        system.ReleaseInstance()
+        backend.release()
         print('Not enough cameras! Goodbye.')
         return False
+    elif num_cameras > 0 and int(sys.argv[1]) == 1 and capture_processes:
+        config_and_acquire_processes(cam_list)
     elif num_cameras > 0 and int(sys.argv[1]) == 1:
         config_and_acquire(cam_list)
     else:
         config_and_return(cam_list)
 
     # Clear cameras and release system instance
-    cam_list.Clear()
-    system.ReleaseInstance()
+    cam_list.clear()
+    backend.release()
 
     print('DONE')
     time.sleep(.5)
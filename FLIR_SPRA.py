@@ -1,15 +1,20 @@
 import os
 import time
 import threading
-import PySpin
-import serial
 import sys
-import nidaqmx
 import numpy as np
-import scipy.io as sio
-import matplotlib.pyplot as plt
 import ruamel.yaml
 from pathlib import Path
+from camera_backend import get_backend
+from frame_pool import FramePool, pixel_format_dtype, unpacked_format
+from frame_sinks import make_sink
+from frame_writer import WriterPool
+from timestamp_log import TimestampLog, load_timestamps
+from daq_recorder import DAQSystem, daq_settings, save_mat
+from daq_summary import start_summary
+from serial_reader import SerialReader, open_serial, parse_lines
+from session_clock import SessionClock, AlignmentIndex
+from stimulus import load_stim
 
 
 # Personal verison for Hillman lab
@@ -44,6 +49,19 @@ im_savepath = cfg['file_path'].replace('CCD', 'webcam') + '\\'
 aux_savepath = cfg['file_path'].replace('CCD', 'auxillary') + '\\'
 filename = cfg['file_name'] + str(cfg['stim_run'])
 framerate = cfg['framerate']
+backend = get_backend(cfg.get('camera_backend', 'spinnaker'), cfg.get('synthetic'))
+camera_errors = backend.errors
+# DAQ channels, sample rate and start trigger, from the daq: section (see daq_recorder.daq_settings)
+daq_cfg = daq_settings(cfg)
+fs = daq_cfg['fs']
+stim_path = cfg.get('stim_path', r'C:\FLIR_Multi_Cam_HWTrig\stimfiles')
+# Frames are copied into frame_pool_size reusable buffers per camera and saved by writer_threads threads
+writer_threads = cfg.get('writer_threads', 4)
+frame_pool_size = cfg.get('frame_pool_size', 64)
+buffer_count = cfg.get('buffer_count', 1000)  # camera stream buffers (StreamBufferCountManual)
+
+# Frames, DAQ blocks, serial lines and stim events are all stamped from this clock (see session_clock.py)
+clock = SessionClock()
 
 # This makes the terminal nicely sized
 if cfg['small_console'] == 1:
@@ -56,86 +74,77 @@ if not os.path.exists(aux_savepath):
     os.makedirs(aux_savepath)
 os.chdir(im_savepath)
 
-# Com port for Arduino communication
-COM_port = 'COM10'
+# Com port for Arduino communication, or fake for a simulated rotary encoder
+COM_port = cfg.get('serial_port', 'COM10')
 COM_baud = 115200
 
-# Set up auxiliary behavior collection
+# Set up auxiliary behavior collection. The port is read on its own thread from the start of
+# acquisition (see serial_reader.py), so frame capture never waits on it.
 try:
-    ser = serial.Serial(COM_port, COM_baud)
+    ser = open_serial(COM_port, COM_baud)
+    ser_reader = SerialReader(ser, capacity=cfg.get('serial_buffer_lines', 2**20), clock=clock.now)
     ser_avail = 1
     print('Serial available.')
-except serial.SerialException:
+except (OSError, ImportError):
     print('Serial port ' + COM_port + ' not available. No auxiliary behavior will be recorded.')
     ser_avail = 0
 
-# Set up DAQ
+# Set up DAQ. AI and DI channels run continuously and are written to disk in chunks while recording
+# (see daq_recorder.py); AO channels play the stim or a constant value as a finite waveform.
 DAQ_online = 0
+stim_schedule = None
 if int(sys.argv[1]) == 1:
     try:
-        fs = 10**4
-        DAQ_ns = int(fs * run_length)
-        ai_task = nidaqmx.Task()
-        ao_task = nidaqmx.Task()
-        ai_task.ai_channels.add_ai_voltage_chan(physical_channel='/Dev2/ai0', min_val=0, max_val=5)
-        ai_task.ai_channels.add_ai_voltage_chan(physical_channel='/Dev2/ai1', min_val=0, max_val=5)
-        ai_task.ai_channels.add_ai_voltage_chan(physical_channel='/Dev2/ai2', min_val=0, max_val=5)
-        ai_task.ai_channels.add_ai_voltage_chan(physical_channel='/Dev2/ai4', min_val=0, max_val=5)
-        ai_task.ai_channels.add_ai_voltage_chan(physical_channel='/Dev2/ai5', min_val=0, max_val=5)
-
-        ao_task.ao_channels.add_ao_voltage_chan('/Dev2/ao0')
-        ao_task.timing.cfg_samp_clk_timing(fs,
-                                           sample_mode=nidaqmx.constants.AcquisitionType.FINITE,
-                                           samps_per_chan=DAQ_ns)
-        ai_task.timing.cfg_samp_clk_timing(fs,
-                                           sample_mode=nidaqmx.constants.AcquisitionType.FINITE,
-                                           samps_per_chan=DAQ_ns)
-        # Load stim file
+        # Load stim file. The capture loop only looks at its on/off intervals (see stimulus.py), which
+        # are also saved as _stim.csv (onset_s, offset_s, amplitude)
+        stim = None
         if cfg['stim'] != 'off':
-            mat_contents = sio.loadmat(r'C:\FLIR_Multi_Cam_HWTrig\stimfiles\stim'+str(cfg['stim'])+'.mat')
-            stim = np.squeeze(mat_contents['DAQout'])
-            ao_task.write(stim, auto_start=False)
-            print('DAQ setup successful. Stim is ENABLED')
-
-        else:
-            ao_task.write(np.linspace(0, 0, DAQ_ns), auto_start=False)
-            print('DAQ setup successful. Stim is DISABLED')
-
+            stim, stim_schedule = load_stim(os.path.join(stim_path, 'stim'+str(cfg['stim'])+'.mat'), fs)
+            stim_schedule.save(os.path.join(aux_savepath, filename + '_stim.csv'))
+        daq = DAQSystem(daq_cfg, os.path.join(aux_savepath, filename), clock=clock.now, stim=stim,
+                        num_samples=fs * run_length)
+        del stim
+        print('DAQ setup successful. Stim is ' + ('ENABLED' if stim_schedule is not None else 'DISABLED'))
         DAQ_online = 1
-    except:
+    except Exception as ex:
+        print('Error (96): %s' % ex)
         print('DAQ setup unsuccessful. No DAQ data will be recorded')
 
 
-# Thread process for saving images. This is super important, as the writing process takes time inline,
-# so offloading it to separate CPU threads allows continuation of image capture
-class ThreadWrite(threading.Thread):
-    def __init__(self, data, out):
-        threading.Thread.__init__(self)  
-        self.data = data
-        self.out = out
+# Saving images is offloaded to a fixed pool of writer threads (see frame_writer.py), as the writing
+# process takes time inline. Each frame is copied out of the SDK buffer into a FramePool slot first,
+# so the camera buffer is released right away and the writer never touches memory the SDK has taken back.
+def save_frame(item):
+    sink, pool, slot, idx, timestamp = item
+    try:
+        sink.write(pool.buffers[slot], idx, timestamp)
+    finally:
+        pool.release(slot)
 
-    def run(self):
-        #image_result = self.data
-        #image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
-        self.data.Save(self.out)
 
 # Capturing is also threaded, to increase performance
 class ThreadCapture(threading.Thread):
-    def __init__(self, cam, camnum, nodemap):
+    def __init__(self, cam, camnum, writer):
         threading.Thread.__init__(self)
         self.cam = cam
         self.camnum = camnum
+        self.writer = writer
+        width, height, cam_format = cam.get_node('Width'), cam.get_node('Height'), cam.get_node('PixelFormat')
+        dtype = pixel_format_dtype(cam_format)
+        self.pool = FramePool(frame_pool_size, height, width, dtype, cam_format)
+        # <file_name><stim_run>_<frame>_cam<1 for the first camera, else 0>.jpg, as always
+        self.sink = make_sink('jpg', filename, 1 if camnum == 0 else 0, num_images, height, width,
+                              unpacked_format(cam_format), dtype, jpg_pad=0,
+                              camera_backend=cfg.get('camera_backend', 'spinnaker'))
 
     def run(self):
-        times = []
+        # frame times go straight into a preallocated log on disk, exported to .mat at the end
+        times = TimestampLog(os.path.join(aux_savepath, filename + '_t' + str(self.camnum) + '.npy'), num_images)
         t1 = []
         stimstate = 'OFF'
-        if framerate != 'hardware':
-            nodemap = self.cam.GetNodeMap()
 
         if self.camnum == 0:
             primary = 1
-            rotary_data = []
         else:
             primary = 0
 
@@ -146,53 +155,44 @@ class ThreadCapture(threading.Thread):
                 if framerate == 'hardware':
                     image_result = self.cam.GetNextImage()
                 else:
-                    node_softwaretrigger_cmd = PySpin.CCommandPtr(nodemap.GetNode('TriggerSoftware'))
-                    if not PySpin.IsAvailable(node_softwaretrigger_cmd) or not PySpin.IsWritable(
-                            node_softwaretrigger_cmd):
-                        print('Unable to execute trigger. Aborting...')
-                        return False
-                    node_softwaretrigger_cmd.Execute()
+                    self.cam.execute('TriggerSoftware')
                     image_result = self.cam.GetNextImage()
 
-                times.append(time.time())
+                t_frame = clock.now()
+                times.record(t_frame, image_result.GetTimeStamp(), image_result.GetFrameID())
                 if i == 0 and primary == 1:
-                    t1 = time.time()
+                    t1 = clock.seconds()
+                    clock.mark('acquisition_start')
                     print('*** ACQUISITION STARTED ***\n')
+                    # With a start trigger the DAQ already started on this frame's trigger pulse
                     if DAQ_online:
-                        ao_task.start()
-                        ai_task.start()
+                        daq.start()
+                        if daq.output is not None:
+                            clock.mark('stim_start')
+                    if ser_avail:
+                        ser.reset_input_buffer()
+                        ser_reader.start()
                 if i == int(num_images - 1) and primary:
-                    t2 = time.time()
+                    t2 = clock.seconds()
                 if primary:
-                    # Read serial values (primary cam only)
-                    if ser_avail:
-                        ser.readline()  # have to do this twice to get a full line
-                        rotary_data.append(ser.readline())
-                        ser.flushInput()
-
                     # Determine if stim is on or off
-                    try:
-                        if stim[int((time.time()-t1)*fs)] > 0:
-                            stimstate = 'ON '
-                        else:
-                            stimstate = 'OFF'
-                    except:
-                        pass
+                    if stim_schedule is not None:
+                        stimstate = 'ON ' if stim_schedule.state_at(clock.seconds() - t1) else 'OFF'
 
                     # Display progress
-                    print('COLLECTING {} of {}, time = {} sec, stim is {}'.format(str(i+1), str(num_images), str(int(time.time()-t1)), stimstate), end='\r')
+                    print('COLLECTING {} of {}, time = {} sec, stim is {}'.format(str(i+1), str(num_images), str(int(clock.seconds()-t1)), stimstate), end='\r')
                     sys.stdout.flush()
 
-                fullfilename = filename + '_' + str(i+1) + '_cam' + str(primary) + '.jpg'
-                background = ThreadWrite(image_result, fullfilename)
-                background.start()
+                slot = self.pool.acquire()
+                self.pool.copy_in(slot, image_result.GetData() if self.pool.packed else image_result.GetNDArray())
                 image_result.Release()
+                self.writer.submit(self.camnum, (self.sink, self.pool, slot, i, t_frame))
                 ftime = time.time() - fstart
                 if framerate != 'hardware':
                     if ftime < 1/framerate:
                         time.sleep(1/framerate - ftime)
 
-            except PySpin.SpinnakerException as ex:
+            except camera_errors as ex:
                 print('Error (577): %s' % ex)
                 return False
 
@@ -201,18 +201,17 @@ class ThreadCapture(threading.Thread):
             print('Effective frame rate: ' + str(num_images / (t2 - t1)))
 
         # Save frametime data
-        sio.savemat(os.path.join(aux_savepath,'t'+str(self.camnum)+'.mat'), {'t'+str(self.camnum): np.asarray(times)})
+        times.close()
+        times.to_mat(os.path.join(aux_savepath,'t'+str(self.camnum)+'.mat'), 't'+str(self.camnum))
         if primary and ser_avail:
-                # Save rotary data
-                aux_data = []
-                for item in rotary_data:
-                    try:
-                        d_item = item[0:len(item) - 2].decode("utf-8")
-                    except UnicodeDecodeError:
-                        d_item = '0 0 0'
-                    aux_data.append(list(map(int, d_item.split(' '))))
-                aux_data = np.asarray(aux_data)
-                sio.savemat(os.path.join(aux_savepath, filename+'_b.mat'), {'aux': aux_data})
+                # Save rotary data, every line the Arduino sent during acquisition with its host time (s)
+                ser_reader.stop()
+                if ser_reader.overrun:
+                    print('Serial buffer full: the first %i line(s) were overwritten' % ser_reader.overrun)
+                aux_t, aux_lines = ser_reader.data()
+                import scipy.io as sio
+                sio.savemat(os.path.join(aux_savepath, filename+'_b.mat'), {'aux': parse_lines(aux_lines),
+                                                                            'aux_t': aux_t * 1e-9})
 
 
 def configure_cam(cam, camnum):
@@ -224,179 +223,51 @@ def configure_cam(cam, camnum):
     if verbose:
         print('*** CONFIGURING CAMERA(S) ***\n')
     try:
-        nodemap = cam.GetNodeMap()
         # Ensure trigger mode off
         # The trigger must be disabled in order to configure whether the source
         # is software or hardware.
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
-            print('Unable to disable trigger mode 129 (node retrieval). Aborting...')
-            return False
-
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
-            print('Unable to disable trigger mode (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
-
-        node_trigger_source = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerSource'))
-        if not PySpin.IsAvailable(node_trigger_source) or not PySpin.IsWritable(node_trigger_source):
-            print('Unable to get trigger source 163 (node retrieval). Aborting...')
-            return False
+        cam.set_node('TriggerMode', 'Off')
 
         # Set primary camera trigger source to line0 (hardware trigger)
         if framerate == 'hardware':
-            node_trigger_source_set = node_trigger_source.GetEntryByName('Line0')
+            cam.set_node('TriggerSource', 'Line0')
             if verbose:
                 print('Trigger source set to hardware...\n')
         else:
-            node_trigger_source_set = node_trigger_source.GetEntryByName('Software')
+            cam.set_node('TriggerSource', 'Software')
             if verbose:
                 print('Trigger source set to software, framerate = %i...\n' % framerate)
 
-        if not PySpin.IsAvailable(node_trigger_source_set) or not PySpin.IsReadable(
-                node_trigger_source_set):
-            print('Unable to set trigger source (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_source.SetIntValue(node_trigger_source_set.GetValue())
-        node_trigger_mode_on = node_trigger_mode.GetEntryByName('On')
-
-        if not PySpin.IsAvailable(node_trigger_mode_on) or not PySpin.IsReadable(node_trigger_mode_on):
-            print('Unable to enable trigger mode (enum entry retrieval). Aborting...')
-            return False
-
-        node_trigger_mode.SetIntValue(node_trigger_mode_on.GetValue())
+        cam.set_node('TriggerMode', 'On')
 
         # Set acquisition mode to continuous
-        node_acquisition_mode = PySpin.CEnumerationPtr(nodemap.GetNode('AcquisitionMode'))
-        if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
-            print('Unable to set acquisition mode to continuous (enum retrieval). Aborting...')
-            return False
-
-        # Retrieve entry node from enumeration node
-        node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName('Continuous')
-        if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(
-                node_acquisition_mode_continuous):
-            print('Unable to set acquisition mode to continuous (entry retrieval). Aborting...')
-            return False
-
-        # Retrieve integer value from entry node
-        acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
-
-        # Set integer value from entry node as new value of enumeration node
-        node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
-
-        # Retrieve Stream Parameters device nodemap
-        s_node_map = cam.GetTLStreamNodeMap()
-
-        # Retrieve Buffer Handling Mode Information
-        handling_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferHandlingMode'))
-        if not PySpin.IsAvailable(handling_mode) or not PySpin.IsWritable(handling_mode):
-            print('Unable to set Buffer Handling mode (node retrieval). Aborting...\n')
-            return False
-
-        handling_mode_entry = PySpin.CEnumEntryPtr(handling_mode.GetCurrentEntry())
-        if not PySpin.IsAvailable(handling_mode_entry) or not PySpin.IsReadable(handling_mode_entry):
-            print('Unable to set Buffer Handling mode (Entry retrieval). Aborting...\n')
-            return False
+        cam.set_node('AcquisitionMode', 'Continuous')
 
         # Set stream buffer Count Mode to manual
-        stream_buffer_count_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferCountMode'))
-        if not PySpin.IsAvailable(stream_buffer_count_mode) or not PySpin.IsWritable(stream_buffer_count_mode):
-            print('Unable to set Buffer Count Mode (node retrieval). Aborting...\n')
-            return False
+        cam.set_node('StreamBufferCountMode', 'Manual', stream=True)
 
-        stream_buffer_count_mode_manual = PySpin.CEnumEntryPtr(stream_buffer_count_mode.GetEntryByName('Manual'))
-        if not PySpin.IsAvailable(stream_buffer_count_mode_manual) or not PySpin.IsReadable(
-                stream_buffer_count_mode_manual):
-            print('Unable to set Buffer Count Mode entry (Entry retrieval). Aborting...\n')
-            return False
-
-        stream_buffer_count_mode.SetIntValue(stream_buffer_count_mode_manual.GetValue())
+        # Set new buffer value
+        cam.set_node('StreamBufferCountManual', buffer_count, stream=True)
 
-        # Retrieve and modify Stream Buffer Count
-        buffer_count = PySpin.CIntegerPtr(s_node_map.GetNode('StreamBufferCountManual'))
-        if not PySpin.IsAvailable(buffer_count) or not PySpin.IsWritable(buffer_count):
-            print('Unable to set Buffer Count (Integer node retrieval). Aborting...\n')
-            return False
+        # Retrieve and modify resolution (WIP)
+        # cam.set_node('Width', int(1440 / bin_val))
+        # cam.set_node('Height', int(1080 / bin_val))
 
-        # Set new buffer value
-        buffer_count.SetValue(1000)
-
-        # # Retrieve and modify resolution
-        # node_width = PySpin.CIntegerPtr(nodemap.GetNode('Width'))
-        # if PySpin.IsAvailable(node_width) and PySpin.IsWritable(node_width):
-        #     width_to_set = int(1440/bin_val)
-        #     node_width.SetValue(width_to_set)
-        #     if verbose:
-        #         print('Width set to %i...' % node_width.GetValue())
-        # else:
-        #     if verbose:
-        #         print('Width not available, width is %i...' % node_width.GetValue())
-
-        # node_height = PySpin.CIntegerPtr(nodemap.GetNode('Height'))
-        # if PySpin.IsAvailable(node_height) and PySpin.IsWritable(node_height):
-        #     height_to_set = int(1080/bin_val)
-        #     node_height.SetValue(height_to_set)
-        #     if verbose:
-        #         print('Height set to %i...' % node_height.GetValue())
-        # else:
-        #     if verbose:
-        #         print('Width not available, height is %i...' % node_height.GetValue())
-
-        # Access trigger overlap info
-        node_trigger_overlap = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerOverlap'))
-        if not PySpin.IsAvailable(node_trigger_overlap) or not PySpin.IsWritable(node_trigger_overlap):
-            print('Unable to set trigger overlap to "Read Out". Aborting...')
-            return False
-
-        # Retrieve enumeration for trigger overlap Read Out
+        # Set trigger overlap to "Read Out" for hardware triggering
         if framerate == 'hardware':
-            node_trigger_overlap_ro = node_trigger_overlap.GetEntryByName('ReadOut')
+            cam.set_node('TriggerOverlap', 'ReadOut')
         else:
-            node_trigger_overlap_ro = node_trigger_overlap.GetEntryByName('Off')
-
-        if not PySpin.IsAvailable(node_trigger_overlap_ro) or not PySpin.IsReadable(
-                node_trigger_overlap_ro):
-            print('Unable to set trigger overlap (entry retrieval). Aborting...')
-            return False
-
-        # Retrieve integer value from enumeration
-        trigger_overlap_ro = node_trigger_overlap_ro.GetValue()
-
-        # Set trigger overlap using retrieved integer from enumeration
-        node_trigger_overlap.SetIntValue(trigger_overlap_ro)
-
-        # Access exposure auto info
-        node_exposure_auto = PySpin.CEnumerationPtr(nodemap.GetNode('ExposureAuto'))
-        if not PySpin.IsAvailable(node_exposure_auto) or not PySpin.IsWritable(node_exposure_auto):
-            print('Unable to get exposure auto. Aborting...')
-            return False
-
-        # Retrieve enumeration for trigger overlap Read Out
-        node_exposure_auto_off = node_exposure_auto.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_exposure_auto_off) or not PySpin.IsReadable(
-                node_exposure_auto_off):
-            print('Unable to get exposure auto "Off" (entry retrieval). Aborting...')
-            return False
+            cam.set_node('TriggerOverlap', 'Off')
 
         # Set exposure auto to off
-        node_exposure_auto.SetIntValue(node_exposure_auto_off.GetValue())
-
-        # Access exposure info
-        node_exposure_time = PySpin.CFloatPtr(nodemap.GetNode('ExposureTime'))
-        if not PySpin.IsAvailable(node_exposure_time) or not PySpin.IsWritable(node_exposure_time):
-            print('Unable to get exposure time. Aborting...')
-            return False
+        cam.set_node('ExposureAuto', 'Off')
 
         # Set exposure float value
-        node_exposure_time.SetValue(exp_time * 1000000)
+        cam.set_node('ExposureTime', exp_time * 1000000)
         if verbose:
             print('Exposure time set to ' + str(exp_time*1000) + 'ms...')
 
-    except PySpin.SpinnakerException as ex:
+    except camera_errors as ex:
         print('Error (237): %s' % ex)
         return False
 
@@ -408,9 +279,19 @@ def config_and_acquire(camlist):
     for i, cam in enumerate(camlist):
         cam.Init()
         configure_cam(cam, i)
-        nodemap = cam.GetNodeMap()
+
+    # A hardware-triggered DAQ waits for the first camera trigger, so it has to be armed first
+    if DAQ_online:
+        daq.arm()
+
+    writer = WriterPool(save_frame, num_workers=writer_threads)
+    for i, cam in enumerate(camlist):
+        writer.add_camera(i)
+    writer.start()
+    # Frame pools and sinks are set up before any camera starts acquiring
+    thread.extend(ThreadCapture(cam, i, writer) for i, cam in enumerate(camlist))
+    for i, cam in enumerate(camlist):
         cam.BeginAcquisition()
-        thread.append(ThreadCapture(cam, i, nodemap))
         thread[i].start()
 
     if framerate == 'hardware':
@@ -419,6 +300,13 @@ def config_and_acquire(camlist):
     for t in thread:
         t.join()
 
+    # Wait for all queued frames to be written before releasing the cameras
+    writer.drain()
+    for i, t in enumerate(thread):
+        t.sink.close()
+        if writer.failed(i):
+            print('cam%i: %i frame(s) failed to write' % (i, writer.failed(i)))
+
     for i, cam in enumerate(camlist):
         reset_trigger(cam)
         cam.DeInit()
@@ -435,28 +323,40 @@ def config_and_return(camlist):
 
 
 def reset_trigger(cam):
-    nodemap = cam.GetNodeMap()
     try:
         result = True
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
-            print('Unable to disable trigger mode 630 (node retrieval). Aborting...')
-            return False
-
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
-            print('Unable to disable trigger mode (enum entry retrieval). Aborting...')
-            return False
-        
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
+        cam.set_node('TriggerMode', 'Off')
 
-    except PySpin.SpinnakerException as ex:
+    except camera_errors as ex:
         print('Error (663): %s' % ex)
         result = False
         
     return result
 
 
+# Session times of every stream, for joining them after the run (see session_clock.AlignmentIndex):
+# camN (frames), daq and di (samples), serial (lines), stim_on/stim_off (stim intervals), and the
+# acquisition and stim start events
+def save_alignment(num_cameras):
+    index = AlignmentIndex(clock.wall0)
+    for camnum in range(num_cameras):
+        path = os.path.join(aux_savepath, filename + '_t' + str(camnum) + '.npy')
+        if os.path.exists(path):
+            data = load_timestamps(path)
+            index.add_clocked('cam' + str(camnum), data[:, 1], data[:, 0])
+    if DAQ_online:
+        for kind, recorder in daq.recorders.items():
+            blocks = np.array(recorder.blocks, dtype=np.int64).reshape(-1, 2)
+            index.add_sampled('daq' if kind == 'ai' else kind, blocks[:, 0], blocks[:, 1], fs, recorder.count)
+    if ser_avail:
+        index.add_times('serial', ser_reader.data()[0])
+    index.add_events(clock.events)
+    if stim_schedule is not None and 'stim_start' in index.events:
+        index.streams['stim_on'] = index.events['stim_start'] + stim_schedule.onsets
+        index.streams['stim_off'] = index.events['stim_start'] + stim_schedule.offsets
+    index.save(os.path.join(aux_savepath, filename + '_alignment.npz'))
+
+
 def main():
     # Check write permissions
     try:
@@ -468,15 +368,13 @@ def main():
     test_file.close()
     os.remove(test_file.name)
     result = True
-    system = PySpin.System.GetInstance()
-    cam_list = system.GetCameras()
-    num_cameras = cam_list.GetSize()
+    cam_list = backend.get_cameras()
+    num_cameras = len(cam_list)
 
     print('Number of cameras detected: %d' % num_cameras)
 
     if num_cameras == 0:
-        cam_list.Clear()
-        system.ReleaseInstance()
+        backend.release()
         print('Not enough cameras! Goodbye.')
         return False
     elif num_cameras > 0 and int(sys.argv[1]) == 1:
@@ -485,30 +383,37 @@ def main():
         config_and_return(cam_list)
 
     # Clear cameras and release system instance
-    cam_list.Clear()
-    system.ReleaseInstance()
+    cam_list.clear()
+    backend.release()
 
     # Close serial connection
     if ser_avail:
+        ser_reader.stop()
         ser.close()
 
-    # Save DAQ data
+    # Stop the DAQ; its samples are already on disk, in _DAQ_XXXX.npy (and _DI_XXXX.npy) chunk files
     if DAQ_online and int(sys.argv[1]) == 1:
-        data = ai_task.read(number_of_samples_per_channel=DAQ_ns)
-        DAQdata = np.asarray(data)
-
-        # Create plot of DAQ data
-        t = np.linspace(0, .5, num=fs//2)
-        plt.plot(t, np.transpose(DAQdata[:, 0:fs//2]))
-        plt.savefig(aux_savepath+filename+'_DAQ.png')
-
-        # Write DAQ data to .mat file
-        sio.savemat(aux_savepath+filename+'_DAQ.mat', {'DAQdata': DAQdata})
-
-        # Close DAQ tasks
-        ai_task.close()
-        ao_task.close()
-        print('DAQ data saved. \n')
+        daq.stop()
+        daq.close()
+        if daq.error is not None:
+            print('Error writing DAQ data: %s' % daq.error)
+        logs = {'ai': os.path.join(aux_savepath, filename + '_DAQ'), 'di': os.path.join(aux_savepath, filename + '_DI')}
+        logs = {kind: logs[kind] for kind in daq.recorders}
+
+        # Write DAQ data to .mat file, channels x samples as before, streamed from the chunk files
+        mat = {name: logs[kind] for kind, name in (('ai', 'DAQdata'), ('di', 'DIdata')) if kind in logs}
+        if mat:
+            save_mat(aux_savepath+filename+'_DAQ.mat', mat)
+        print('DAQ data saved (%s samples). \n' % ', '.join('%s: %i' % (kind, r.count)
+                                                            for kind, r in daq.recorders.items()))
+
+        # Plots (_DAQ.png, _DAQ_overview.png) and _DAQ_summary.json are made from the files on disk,
+        # in a process of their own (see daq_summary.py)
+        if logs:
+            start_summary(logs.values(), fs)
+
+    if int(sys.argv[1]) == 1:
+        save_alignment(num_cameras)
 
     print('DONE')
     time.sleep(.5)
@@ -0,0 +1,109 @@
+"""
+Throughput benchmark for the capture-to-disk pipeline.
+
+Runs FLIR_Multicam.py against the synthetic camera backend for every combination of camera
+count, resolution, framerate, output format, writer count and capture mode (threads or
+processes), and collects the run report of
+each into one JSON file. Each configuration runs in its own process, so CPU and peak memory
+are measured per configuration.
+
+Example:
+    python benchmark.py --cameras 1 4 --resolution 1440x1080 720x540 --fps 125 --formats raw jpg
+    python benchmark.py --cameras 4 --modes threads processes
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import yaml
+
+dname = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_config(workdir, cameras, resolution, fps, output_format, writers, mode, seconds, base, timeout):
+    width, height = (int(v) for v in resolution.lower().split('x'))
+    num_images = max(2, int(round(fps * seconds)))
+    outdir = tempfile.mkdtemp(dir=workdir)
+    report_file = os.path.join(outdir, 'report.json')
+    params = dict(base)
+    params.update({
+        'num_images': num_images,
+        'file_path': outdir,
+        'file_name': 'yyyymmdd_bench',
+        'framerate': 'hardware',  # frames are paced by the synthetic camera, like a function generator
+        'output_format': output_format,
+        'writer_threads': writers,
+        'capture_processes': mode == 'processes',
+        'camera_backend': 'synthetic',
+        'report_file': report_file,
+    })
+    params['synthetic'] = dict(base.get('synthetic') or {}, num_cameras=cameras, width=width, height=height,
+                               fps=fps)
+    params_file = os.path.join(outdir, 'params.yaml')
+    with open(params_file, 'w') as f:
+        yaml.safe_dump(params, f)
+
+    config = {'cameras': cameras, 'resolution': resolution, 'fps': fps, 'output_format': output_format,
+              'writers': writers, 'mode': mode, 'num_images': num_images}
+    try:
+        proc = subprocess.run([sys.executable, os.path.join(dname, 'FLIR_Multicam.py'), '1', params_file],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+        if os.path.exists(report_file):
+            with open(report_file) as f:
+                result = json.load(f)
+        else:
+            result = {'error': proc.stderr.decode(errors='replace').strip().splitlines()[-1:]}
+    except subprocess.TimeoutExpired:
+        result = {'error': 'timed out after %i s' % timeout}
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+    result['config'] = config
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--resolution', nargs='+', default=['1440x1080'], help='WIDTHxHEIGHT')
+    parser.add_argument('--fps', type=float, nargs='+', default=[125])
+    parser.add_argument('--formats', nargs='+', default=['raw', 'npy_chunks'])
+    parser.add_argument('--writers', type=int, nargs='+', default=[4])
+    parser.add_argument('--modes', nargs='+', default=['threads'], choices=['threads', 'processes'],
+                        help='capture threads in one process, or a capture and a writer process per camera')
+    parser.add_argument('--seconds', type=float, default=10, help='length of each run')
+    parser.add_argument('--params', default=os.path.join(dname, 'params.yaml'),
+                        help='base config; all other settings (e.g. drop_policy) are taken from here')
+    parser.add_argument('--workdir', default=None, help='where to write frames (default: system temp dir)')
+    parser.add_argument('--out', default='benchmark.json')
+    args = parser.parse_args()
+
+    with open(args.params) as f:
+        base = yaml.safe_load(f)
+    workdir = args.workdir or tempfile.gettempdir()
+
+    results = []
+    for cameras, resolution, fps, output_format, writers, mode in itertools.product(
+            args.cameras, args.resolution, args.fps, args.formats, args.writers, args.modes):
+        result = run_config(workdir, cameras, resolution, fps, output_format, writers, mode, args.seconds, base,
+                            timeout=60 + 10 * args.seconds)
+        results.append(result)
+        label = '%i cam, %s @ %g fps, %s, %i writers, %s' % (cameras, resolution, fps, output_format, writers, mode)
+        if 'error' in result:
+            print('%s: FAILED %s' % (label, result['error']))
+        else:
+            lat = result['write_return_ms']
+            dropped = sum(c['dropped'] for c in result['cameras'])
+            print('%s: %.1f fps, arrival to write return p50/p99/max %.1f/%.1f/%.1f ms, %i dropped, CPU %.0f%%' % (
+                label, result['sustained_fps'], lat['p50'], lat['p99'], lat['max'], dropped, result['cpu_percent']))
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    print('Report written to %s' % os.path.abspath(args.out))
+
+
+if __name__ == '__main__':
+    main()
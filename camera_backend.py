@@ -0,0 +1,445 @@
+import random
+import threading
+import time
+from collections import deque
+import numpy as np
+from frame_pool import pixel_format_dtype
+
+BACKENDS = ('spinnaker', 'synthetic')
+SYNTHETIC_PIXEL_FORMATS = ('Mono8', 'Mono12p', 'Mono16')
+SYNTHETIC_ENTRIES = {'PixelFormat': SYNTHETIC_PIXEL_FORMATS, 'BinningSelector': ('All',)}
+
+
+class CameraError(Exception):
+    pass
+
+
+def get_backend(name, options=None):
+    """
+    Return a camera backend by name. options is the backend's section of params.yaml (if any)
+    """
+    if name == 'spinnaker':
+        return SpinnakerBackend()
+    elif name == 'synthetic':
+        return SyntheticBackend(**dict(options or {}))
+    raise ValueError('camera_backend must be one of %s, got %r' % (BACKENDS, name))
+
+
+# ----------------------------------------------------------------------------------------------
+# Spinnaker (PySpin) backend
+# Cameras keep PySpin's method names (Init, BeginAcquisition, GetNextImage, ...), and images are
+# the PySpin images themselves, so the hot loop pays nothing for the wrapper. GenICam nodes are
+# read/written by name through get_node/set_node, which check availability and dispatch on type.
+# Node handles are looked up and cast once per camera and cached until DeInit, so repeated access
+# (e.g. TriggerSoftware every frame) skips the GenICam string lookup.
+# ----------------------------------------------------------------------------------------------
+class SpinnakerBackend:
+    def __init__(self):
+        import PySpin
+        self.PySpin = PySpin
+        self.errors = (CameraError, PySpin.SpinnakerException)
+        self.system = None
+        self._cam_list = None
+
+    def get_cameras(self):
+        self.system = self.PySpin.System.GetInstance()
+        self._cam_list = self.system.GetCameras()
+        return [SpinnakerCamera(self._cam_list.GetByIndex(i), self.PySpin) for i in range(self._cam_list.GetSize())]
+
+    def release(self):
+        # Camera objects must be dropped by the caller before this is called
+        self._cam_list.Clear()
+        self.system.ReleaseInstance()
+
+
+class SpinnakerCamera:
+    def __init__(self, cam, PySpin):
+        self.cam = cam
+        self.PySpin = PySpin
+        self._cache = {}
+
+    def serial_number(self):
+        """
+        Read from the transport layer nodemap, so it is available before Init
+        """
+        node = self.PySpin.CStringPtr(self.cam.GetTLDeviceNodeMap().GetNode('DeviceSerialNumber'))
+        return node.GetValue()
+
+    def Init(self):
+        self.cam.Init()
+
+    def DeInit(self):
+        self._cache.clear()  # handles are invalid once the nodemap is gone
+        self.cam.DeInit()
+
+    def BeginAcquisition(self):
+        self.cam.BeginAcquisition()
+
+    def EndAcquisition(self):
+        self.cam.EndAcquisition()
+
+    def GetNextImage(self, timeout=None):
+        if timeout is None:
+            return self.cam.GetNextImage()
+        return self.cam.GetNextImage(int(timeout * 1000))
+
+    def _node(self, name, stream=False):
+        try:
+            return self._cache[name, stream]
+        except KeyError:
+            pass
+        nodemap = self.cam.GetTLStreamNodeMap() if stream else self.cam.GetNodeMap()
+        node = nodemap.GetNode(name)
+        if node is None or not self.PySpin.IsAvailable(node):
+            raise CameraError('Node %s not available' % name)
+        iface = node.GetPrincipalInterfaceType()
+        P = self.PySpin
+        if iface == P.intfIEnumeration:
+            node = P.CEnumerationPtr(node)
+        elif iface == P.intfIInteger:
+            node = P.CIntegerPtr(node)
+        elif iface == P.intfIFloat:
+            node = P.CFloatPtr(node)
+        elif iface == P.intfIBoolean:
+            node = P.CBooleanPtr(node)
+        elif iface == P.intfICommand:
+            node = P.CCommandPtr(node)
+        elif iface == P.intfIString:
+            node = P.CStringPtr(node)
+        else:
+            raise CameraError('Node %s has unsupported type' % name)
+        self._cache[name, stream] = node
+        return node
+
+    def resolve(self, names, stream=False):
+        """
+        Look up and cache the given nodes. Returns the names of any that are not available.
+        """
+        missing = []
+        for name in names:
+            try:
+                self._node(name, stream)
+            except CameraError:
+                missing.append(name)
+        return missing
+
+    def get_node(self, name, stream=False):
+        node = self._node(name, stream)
+        if not self.PySpin.IsReadable(node):
+            raise CameraError('Node %s not readable' % name)
+        if isinstance(node, self.PySpin.CEnumerationPtr):
+            return node.GetCurrentEntry().GetSymbolic()
+        return node.GetValue()
+
+    def set_node(self, name, value, stream=False):
+        node = self._node(name, stream)
+        if not self.PySpin.IsWritable(node):
+            raise CameraError('Unable to set %s to %r (node not writable)' % (name, value))
+        if isinstance(node, self.PySpin.CEnumerationPtr):
+            entry = node.GetEntryByName(value)
+            if entry is None or not self.PySpin.IsAvailable(entry) or not self.PySpin.IsReadable(entry):
+                raise CameraError('Unable to set %s to %r (entry not available)' % (name, value))
+            node.SetIntValue(entry.GetValue())
+        else:
+            node.SetValue(value)
+
+    def node_range(self, name, stream=False):
+        """
+        (min, max, increment) of an integer or float node. Increment is None for float nodes.
+        """
+        node = self._node(name, stream)
+        inc = node.GetInc() if isinstance(node, self.PySpin.CIntegerPtr) else None
+        return node.GetMin(), node.GetMax(), inc
+
+    def node_entries(self, name):
+        """
+        Names of the entries of an enumeration node that can currently be selected
+        """
+        P = self.PySpin
+        entries = [P.CEnumEntryPtr(entry) for entry in self._node(name).GetEntries()]
+        return [entry.GetSymbolic() for entry in entries if P.IsAvailable(entry) and P.IsReadable(entry)]
+
+    def execute(self, name):
+        node = self._node(name)
+        if not self.PySpin.IsWritable(node):
+            raise CameraError('Unable to execute %s' % name)
+        node.Execute()
+
+    def command(self, name):
+        """
+        Return a callable that executes a command node, checked once up front
+        """
+        node = self._node(name)
+        if not self.PySpin.IsWritable(node):
+            raise CameraError('Unable to execute %s' % name)
+        return node.Execute
+
+
+# ----------------------------------------------------------------------------------------------
+# Synthetic backend, for benchmarking and testing without hardware
+# Generates frames of a configurable size and pixel format. With a hardware trigger (or no
+# trigger), frames arrive at `fps` from BeginAcquisition, like a function generator on Line0;
+# free-running with AcquisitionFrameRateEnable, they arrive at AcquisitionFrameRate instead.
+# With a software trigger, each TriggerSoftware produces one frame after the exposure time.
+# jitter_ms adds gaussian jitter to frame arrival; drop_prob drops frames (hardware/free-run only),
+# which shows up as a gap in frame IDs exactly like on a real camera. software_trigger: false gives
+# cameras without a TriggerSoftware node, as some models are.
+# ----------------------------------------------------------------------------------------------
+class SyntheticBackend:
+    def __init__(self, num_cameras=1, width=1440, height=1080, pixel_format='Mono8', fps=30.0,
+                 jitter_ms=0.0, drop_prob=0.0, clock_drift_ppm=0.0, software_trigger=True, seed=None):
+        self.errors = (CameraError,)
+        self.options = dict(width=width, height=height, pixel_format=pixel_format, fps=fps,
+                            jitter_ms=jitter_ms, drop_prob=drop_prob, clock_drift_ppm=clock_drift_ppm,
+                            software_trigger=software_trigger)
+        self.num_cameras = int(num_cameras)
+        self.seed = seed
+
+    def get_cameras(self):
+        return [SyntheticCamera(i, seed=None if self.seed is None else self.seed + i, **self.options)
+                for i in range(self.num_cameras)]
+
+    def release(self):
+        pass
+
+
+# Nodes that are locked while acquiring
+ROI_NODES = ('Width', 'Height', 'OffsetX', 'OffsetY', 'PixelFormat', 'BinningSelector', 'BinningHorizontal',
+             'BinningVertical', 'DecimationHorizontal', 'DecimationVertical')
+
+
+def pack_mono12p(frame):
+    """
+    Pack 12 bit pixels two to three bytes, as a camera sends Mono12p
+    """
+    p = frame.reshape(-1, 2).astype(np.uint16)
+    out = np.empty((p.shape[0], 3), dtype=np.uint8)
+    out[:, 0] = p[:, 0] & 0xFF
+    out[:, 1] = (p[:, 0] >> 8) | ((p[:, 1] & 0x0F) << 4)
+    out[:, 2] = p[:, 1] >> 4
+    return out.reshape(-1)
+
+
+class SyntheticImage:
+    __slots__ = ('data', 'raw', 'frame_id', 'timestamp')
+
+    def __init__(self, data, frame_id, timestamp, raw=None):
+        self.data = data
+        self.raw = raw  # buffer as sent by the camera, for packed pixel formats
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+
+    def GetNDArray(self):
+        return self.data
+
+    def GetData(self):
+        return self.raw if self.raw is not None else self.data.reshape(-1).view(np.uint8)
+
+    def GetFrameID(self):
+        return self.frame_id
+
+    def GetTimeStamp(self):
+        return self.timestamp
+
+    def IsIncomplete(self):
+        return False
+
+    def Save(self, path):
+        # No encoding, just the raw pixel bytes, so disk load is comparable but CPU cost is not
+        self.data.tofile(path)
+
+    def Release(self):
+        pass
+
+
+class SyntheticCamera:
+    def __init__(self, idx, width, height, pixel_format, fps, jitter_ms, drop_prob, clock_drift_ppm,
+                 software_trigger=True, seed=None):
+        self.idx = idx
+        self.commands = ('UserSetLoad', 'UserSetSave') + (('TriggerSoftware',) if software_trigger else ())
+        self.fps = float(fps)
+        self.jitter = jitter_ms * 1e-3
+        self.drop_prob = drop_prob
+        self.clock_scale = 1e9 * (1 + clock_drift_ppm * 1e-6)
+        self.rng = random.Random(seed)
+        self._max_size = (int(width), int(height))
+        self.nodes = {
+            'DeviceSerialNumber': str(20000000 + idx),
+            'DeviceModelName': 'Synthetic',
+            'TriggerMode': 'Off', 'TriggerSource': 'Line0', 'TriggerOverlap': 'Off',
+            'AcquisitionMode': 'Continuous', 'ExposureAuto': 'Off', 'ExposureTime': 10000.0,
+            'GainAuto': 'Off', 'Gain': 0.0, 'AcquisitionFrameRateEnable': False, 'AcquisitionFrameRate': 30.0,
+            'LineSelector': 'Line0', 'LineMode': 'Input', 'LineSource': 'Off',
+            'DeviceLinkSpeed': 500000000, 'DeviceLinkThroughputLimit': 380000000,
+            'Width': int(width), 'Height': int(height), 'OffsetX': 0, 'OffsetY': 0,
+            'WidthMax': int(width), 'HeightMax': int(height), 'SensorWidth': int(width), 'SensorHeight': int(height),
+            'PixelFormat': pixel_format,
+            'BinningSelector': 'All', 'BinningHorizontal': 1, 'BinningVertical': 1,
+            'DecimationHorizontal': 1, 'DecimationVertical': 1, 'UserSetSelector': 'Default',
+        }
+        self.stream_nodes = {
+            'StreamBufferHandlingMode': 'OldestFirst', 'StreamBufferCountMode': 'Auto',
+            'StreamBufferCountManual': 10, 'StreamDroppedFrameCount': 0, 'StreamLostFrameCount': 0,
+        }
+        self.ranges = {
+            'Width': (16, int(width), 16), 'Height': (8, int(height), 8),
+            'OffsetX': (0, 0, 4), 'OffsetY': (0, 0, 2),
+            'ExposureTime': (10.0, 30e6, None), 'Gain': (0.0, 47.99, None), 'StreamBufferCountManual': (1, 1000, 1),
+            'DeviceLinkThroughputLimit': (10000000, 500000000, 16000), 'AcquisitionFrameRate': (1.0, 1000.0, None),
+            'BinningHorizontal': (1, 4, 1), 'BinningVertical': (1, 4, 1),
+            'DecimationHorizontal': (1, 4, 1), 'DecimationVertical': (1, 4, 1),
+        }
+        self.user_sets = {'Default': dict(self.nodes)}
+        self._initialized = False
+        self._acquiring = False
+        self._triggers = deque()
+        self._trigger_ready = threading.Condition()
+
+    def _check_init(self):
+        if not self._initialized:
+            raise CameraError('Camera %i not initialized' % self.idx)
+
+    def serial_number(self):
+        return self.nodes['DeviceSerialNumber']
+
+    def Init(self):
+        self._initialized = True
+
+    def DeInit(self):
+        self._initialized = False
+
+    def BeginAcquisition(self):
+        self._check_init()
+        width, height = self.nodes['Width'], self.nodes['Height']
+        dtype = pixel_format_dtype(self.nodes['PixelFormat'])
+        # A handful of noise frames, handed out in turn; consumers copy them like an SDK buffer
+        gen = np.random.default_rng(self.rng.randrange(2 ** 32))
+        top = 4095 if self.nodes['PixelFormat'] == 'Mono12p' else np.iinfo(dtype).max
+        self._frames = [gen.integers(0, top, size=(height, width), dtype=dtype) for _ in range(4)]
+        self._raw = [pack_mono12p(f) for f in self._frames] if self.nodes['PixelFormat'] == 'Mono12p' else None
+        self._next_id = 0
+        # Free-running at its own AcquisitionFrameRate, or at `fps` like a hardware trigger
+        free_run = self.nodes['TriggerMode'] == 'Off' and self.nodes['AcquisitionFrameRateEnable']
+        self._rate = self.nodes['AcquisitionFrameRate'] if free_run else self.fps
+        self._t0 = time.perf_counter()
+        self._clock_epoch = self._t0 - self.rng.uniform(0, 1000)  # camera clock started before the host's
+        self._triggers.clear()
+        self.stream_nodes['StreamDroppedFrameCount'] = 0
+        self._acquiring = True
+
+    def EndAcquisition(self):
+        self._acquiring = False
+
+    def GetNextImage(self, timeout=None):
+        if not self._acquiring:
+            raise CameraError('Camera %i is not acquiring' % self.idx)
+        frame_id = self._next_id
+        if self.nodes['TriggerMode'] == 'On' and self.nodes['TriggerSource'] == 'Software':
+            with self._trigger_ready:
+                if not self._trigger_ready.wait_for(lambda: self._triggers, timeout):
+                    raise CameraError('Timed out waiting for image')
+                due = self._triggers.popleft() + self.nodes['ExposureTime'] * 1e-6
+        else:
+            while self.drop_prob and self.rng.random() < self.drop_prob:
+                frame_id += 1
+            due = self._t0 + frame_id / self._rate
+        if self.jitter:
+            due += abs(self.rng.gauss(0, self.jitter))
+        wait = due - time.perf_counter()
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            raise CameraError('Timed out waiting for image')
+        if wait > 0:
+            time.sleep(wait)
+        self.stream_nodes['StreamDroppedFrameCount'] += frame_id - self._next_id
+        self._next_id = frame_id + 1
+        k = frame_id % len(self._frames)
+        return SyntheticImage(self._frames[k], frame_id, int((due - self._clock_epoch) * self.clock_scale),
+                              self._raw[k] if self._raw is not None else None)
+
+    def _nodes_for(self, name, stream):
+        nodes = self.stream_nodes if stream else self.nodes
+        if name not in nodes:
+            raise CameraError('Node %s not available' % name)
+        return nodes
+
+    def resolve(self, names, stream=False):
+        nodes = self.stream_nodes if stream else self.nodes
+        return [name for name in names if name not in nodes and (stream or name not in self.commands)]
+
+    def get_node(self, name, stream=False):
+        return self._nodes_for(name, stream)[name]
+
+    def set_node(self, name, value, stream=False):
+        nodes = self._nodes_for(name, stream)
+        if name in ('WidthMax', 'HeightMax', 'SensorWidth', 'SensorHeight') or (self._acquiring and name in ROI_NODES):
+            raise CameraError('Unable to set %s to %r (node not writable)' % (name, value))
+        if name in SYNTHETIC_ENTRIES and value not in SYNTHETIC_ENTRIES[name]:
+            raise CameraError('Unable to set %s to %r (entry not available)' % (name, value))
+        if name in self.ranges or name in ('Width', 'Height', 'OffsetX', 'OffsetY'):
+            lo, hi, inc = self.node_range(name, stream)
+            if not lo <= value <= hi:
+                raise CameraError('Unable to set %s to %r (out of range %s-%s)' % (name, value, lo, hi))
+            if inc and (value - lo) % inc:
+                raise CameraError('Unable to set %s to %r (not a multiple of %s)' % (name, value, inc))
+        nodes[name] = value
+        if name.startswith(('Binning', 'Decimation')) and name != 'BinningSelector':
+            self._update_max_size()
+
+    def _update_max_size(self):
+        # Binning and decimation shrink the image; the ROI is clamped to fit, like on the camera
+        for axis, full, size, offset in (('Horizontal', self._max_size[0], 'Width', 'OffsetX'),
+                                         ('Vertical', self._max_size[1], 'Height', 'OffsetY')):
+            n = self.nodes['Binning' + axis] * self.nodes['Decimation' + axis]
+            inc = self.ranges[size][2]
+            top = full // n // inc * inc
+            self.nodes[size + 'Max'] = top
+            self.nodes[size] = min(self.nodes[size], top)
+            self.nodes[offset] = min(self.nodes[offset], top - self.nodes[size])
+
+    def node_range(self, name, stream=False):
+        self._nodes_for(name, stream)
+        if name in ('Width', 'Height'):
+            # Size can grow up to the edge of the sensor from the current offset
+            lo, _, inc = self.ranges[name]
+            offset = self.nodes['OffsetX' if name == 'Width' else 'OffsetY']
+            return lo, self.nodes[name + 'Max'] - offset, inc
+        if name in ('OffsetX', 'OffsetY'):
+            # Offsets can move the ROI anywhere on the sensor that it still fits
+            inc = self.ranges[name][2]
+            size = 'Width' if name == 'OffsetX' else 'Height'
+            return 0, self.nodes[size + 'Max'] - self.nodes[size], inc
+        if name == 'AcquisitionFrameRate':
+            # frames can't come faster than the exposure allows
+            lo, hi, inc = self.ranges[name]
+            return lo, min(hi, 1e6 / self.nodes['ExposureTime']), inc
+        if name not in self.ranges:
+            raise CameraError('Node %s has no range' % name)
+        return self.ranges[name]
+
+    def node_entries(self, name):
+        self._nodes_for(name, False)
+        if name not in SYNTHETIC_ENTRIES:
+            raise CameraError('Node %s is not an enumeration' % name)
+        return list(SYNTHETIC_ENTRIES[name])
+
+    def execute(self, name):
+        if name in ('UserSetLoad', 'UserSetSave'):
+            selected = self.nodes['UserSetSelector']
+            if name == 'UserSetSave' and selected != 'Default':
+                self.user_sets[selected] = dict(self.nodes)
+            elif name == 'UserSetLoad' and selected in self.user_sets and not self._acquiring:
+                self.nodes.update(self.user_sets[selected], UserSetSelector=selected)
+            else:
+                raise CameraError('Unable to execute %s' % name)
+            return
+        if name not in self.commands:
+            raise CameraError('Unable to execute %s' % name)
+        with self._trigger_ready:
+            self._triggers.append(time.perf_counter())
+            self._trigger_ready.notify()
+
+    def command(self, name):
+        if name not in self.commands:
+            raise CameraError('Unable to execute %s' % name)
+        return lambda: self.execute(name)
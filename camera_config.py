@@ -0,0 +1,238 @@
+from contextlib import nullcontext
+import yaml
+from camera_backend import CameraError
+
+# Nodes recorded in the per-session camera snapshot. Nodes a camera doesn't have are left out.
+SNAPSHOT_NODES = ('DeviceSerialNumber', 'DeviceModelName', 'DeviceFirmwareVersion',
+                  'TriggerMode', 'TriggerSelector', 'TriggerSource', 'TriggerActivation', 'TriggerOverlap',
+                  'AcquisitionMode', 'ExposureAuto', 'ExposureTime', 'GainAuto', 'Gain',
+                  'BinningSelector', 'BinningHorizontal', 'BinningVertical', 'DecimationHorizontal',
+                  'DecimationVertical', 'Width', 'Height', 'OffsetX', 'OffsetY', 'PixelFormat',
+                  'DeviceLinkSpeed', 'DeviceLinkThroughputLimit', 'AcquisitionFrameRateEnable',
+                  'AcquisitionFrameRate')
+SNAPSHOT_STREAM_NODES = ('StreamBufferHandlingMode', 'StreamBufferCountMode', 'StreamBufferCountManual')
+
+# These can only be changed while TriggerMode is Off
+TRIGGER_LOCKED = ('TriggerSelector', 'TriggerSource', 'TriggerActivation', 'TriggerOverlap')
+
+# Float nodes are rounded by the camera (e.g. ExposureTime to whole sensor lines), so a value read
+# back rarely equals the one written. Within this relative tolerance they count as unchanged.
+FLOAT_TOLERANCE = 1e-3
+
+
+def read_snapshot(cam, errors, device_nodes=SNAPSHOT_NODES, stream_nodes=SNAPSHOT_STREAM_NODES):
+    """
+    Current values of the given nodes, as {'device': {...}, 'stream': {...}}
+    """
+    snapshot = {'device': {}, 'stream': {}}
+    for key, names, stream in (('device', device_nodes, False), ('stream', stream_nodes, True)):
+        for name in names:
+            try:
+                snapshot[key][name] = cam.get_node(name, stream)
+            except errors:
+                continue
+    return snapshot
+
+
+def same_value(current, desired):
+    if isinstance(desired, float) or isinstance(current, float):
+        return abs(current - desired) <= FLOAT_TOLERANCE * max(abs(desired), 1.0)
+    return current == desired
+
+
+def config_diff(cam, settings, errors):
+    """
+    The (name, value, stream) settings whose node doesn't already hold the value, in order
+    """
+    changed = []
+    for name, value, stream in settings:
+        try:
+            current = cam.get_node(name, stream)
+        except errors:
+            current = None
+        if current is None or not same_value(current, value):
+            changed.append((name, value, stream))
+    return changed
+
+
+def apply_config(cam, settings, errors, user_set=None, timer=None, camnum=0):
+    """
+    Bring a camera to the desired settings, a list of (name, value, stream) in the order they have to
+    be written (e.g. ExposureAuto before ExposureTime), writing only the nodes that differ.
+    If user_set is given, that UserSet is loaded first, so usually nothing is left to write.
+    Returns the settings that were written.
+    """
+    if user_set:
+        with _step(timer, camnum, 'UserSetLoad'):
+            cam.set_node('UserSetSelector', user_set)
+            cam.execute('UserSetLoad')
+    changed = config_diff(cam, settings, errors)
+    if any(name in TRIGGER_LOCKED for name, _, _ in changed):
+        mode = cam.get_node('TriggerMode')
+        if mode != 'Off':
+            # Turn the trigger off while its settings change, then set the mode again last
+            with _step(timer, camnum, 'TriggerMode'):
+                cam.set_node('TriggerMode', 'Off')
+            mode = next((value for name, value, _ in changed if name == 'TriggerMode'), mode)
+            changed = [c for c in changed if c[0] != 'TriggerMode']
+            if mode != 'Off':
+                changed.append(('TriggerMode', mode, False))
+    for name, value, stream in changed:
+        with _step(timer, camnum, name):
+            cam.set_node(name, value, stream)
+    return changed
+
+
+def pacing_state(cam, output_line, errors):
+    """
+    Current values of what camera pacing changes on a camera, as settings for restore_pacing: the
+    on-camera frame rate limit and, if output_line is given, that line's LineSource and LineMode.
+    Read before configuring, so a run can put them back as they were. Nodes the camera doesn't have
+    are left out.
+    """
+    state = []
+    if not cam.resolve(['AcquisitionFrameRateEnable']):
+        state.append(('AcquisitionFrameRateEnable', cam.get_node('AcquisitionFrameRateEnable'), False))
+    if output_line and not cam.resolve(['LineSelector', 'LineMode', 'LineSource']):
+        selected = cam.get_node('LineSelector')
+        if selected != output_line:
+            cam.set_node('LineSelector', output_line)
+        state += [('LineSelector', output_line, False), ('LineSource', cam.get_node('LineSource'), False),
+                  ('LineMode', cam.get_node('LineMode'), False)]
+        if selected != output_line:
+            cam.set_node('LineSelector', selected)
+            state.append(('LineSelector', selected, False))
+    return state
+
+
+def restore_pacing(cam, state, errors):
+    """
+    Put back the settings saved by pacing_state, writing only those that differ. They are written one
+    at a time, since LineSource and LineMode belong to whichever line was selected just before.
+    Returns the settings that were written.
+    """
+    changed = []
+    for setting in state:
+        changed += apply_config(cam, [setting], errors)
+    return changed
+
+
+def check_value(name, value, lo, hi, inc=None):
+    """
+    Raise CameraError, with the nearest valid values, if value is outside lo-hi or off the increment
+    """
+    if not lo <= value <= hi:
+        raise CameraError('%s = %s is out of range (%s-%s)' % (name, value, lo, hi))
+    if inc and (value - lo) % inc:
+        below = value - (value - lo) % inc
+        raise CameraError('%s = %s is not a valid step of %s (nearest: %s or %s)' % (
+            name, value, inc, below, min(below + inc, hi)))
+
+
+def sensor_settings(cam, pixel_format=None, binning=1, binning_selector=None, decimation=1):
+    """
+    Settings for pixel format, binning and decimation, checked against the camera's nodes. They change
+    the image size, so apply them before roi_settings. Binning/decimation of 1 is skipped on cameras
+    that don't have the nodes.
+    """
+    settings = []
+    if pixel_format:
+        settings.append(('PixelFormat', pixel_format, False))
+    if binning_selector and binning > 1:
+        settings.append(('BinningSelector', binning_selector, False))
+    for name, value in (('BinningHorizontal', binning), ('BinningVertical', binning),
+                        ('DecimationHorizontal', decimation), ('DecimationVertical', decimation)):
+        if cam.resolve([name]):
+            if value != 1:
+                raise CameraError('%s = %s, but the camera has no %s node' % (name, value, name))
+            continue
+        check_value(name, value, *cam.node_range(name))
+        settings.append((name, value, False))
+    return settings
+
+
+def roi_settings(cam, width=0, height=0, offset_x=0, offset_y=0):
+    """
+    Settings for a region of interest, in pixels after binning/decimation, checked against the
+    camera's sensor size and node increments. A width/height of 0 extends to the edge of the sensor.
+    Size and offset of each axis are ordered so every intermediate ROI still fits on the sensor.
+    """
+    settings = []
+    for size_name, offset_name, size, offset in (('Width', 'OffsetX', width, offset_x),
+                                                 ('Height', 'OffsetY', height, offset_y)):
+        size = _check_roi(cam, size_name, offset_name, size, offset, cam.get_node(size_name + 'Max'))
+        if offset <= cam.get_node(offset_name):
+            settings += [(offset_name, offset, False), (size_name, size, False)]
+        else:
+            settings += [(size_name, size, False), (offset_name, offset, False)]
+    return settings
+
+
+def check_image(cam, pixel_format=None, binning=1, binning_selector=None, decimation=1, roi=None):
+    """
+    Check pixel format, binning, decimation and ROI against the camera's nodes before any of them is
+    written, so a bad value is reported with the camera left as it was. The ROI is checked against
+    the image size the new binning and decimation will give. Raises CameraError.
+    """
+    for name, value in (('PixelFormat', pixel_format), ('BinningSelector', binning_selector if binning > 1 else None)):
+        if value:
+            entries = cam.node_entries(name)
+            if value not in entries:
+                raise CameraError('%s = %s is not available (%s)' % (name, value, ', '.join(entries)))
+    sensor_settings(cam, None, binning, None, decimation)
+    roi = roi or {}
+    for axis, size_name, offset_name, size_key, offset_key in (
+            ('Horizontal', 'Width', 'OffsetX', 'width', 'offset_x'),
+            ('Vertical', 'Height', 'OffsetY', 'height', 'offset_y')):
+        _check_roi(cam, size_name, offset_name, roi.get(size_key, 0), roi.get(offset_key, 0),
+                   _size_max(cam, axis, size_name, binning * decimation))
+
+
+def _size_max(cam, axis, size_name, factor):
+    # Full image width/height once binning x decimation is `factor`: the sensor size (SensorWidth/Height,
+    # or WidthMax/HeightMax times the current binning and decimation) divided down, on the node's increment
+    if not cam.resolve(['Sensor' + size_name]):
+        sensor = cam.get_node('Sensor' + size_name)
+    else:
+        sensor = cam.get_node(size_name + 'Max')
+        for name in ('Binning' + axis, 'Decimation' + axis):
+            if not cam.resolve([name]):
+                sensor *= cam.get_node(name)
+    inc = cam.node_range(size_name)[2] or 1
+    return sensor // factor // inc * inc
+
+
+def _check_roi(cam, size_name, offset_name, size, offset, full):
+    # Size (0: to the edge of the image) and offset of one axis, checked against an image `full` pixels
+    # across; returns the size
+    size = size or full - offset
+    lo, _, inc = cam.node_range(size_name)
+    check_value(size_name, size, lo, full, inc)
+    check_value(offset_name, offset, 0, full - size, cam.node_range(offset_name)[2])
+    return size
+
+
+def save_user_set(cam, user_set):
+    """
+    Store the camera's current settings in a UserSet, to be loaded with apply_config(user_set=...).
+    Stream (host-side) nodes such as the buffer count are not part of a UserSet.
+    """
+    cam.set_node('UserSetSelector', user_set)
+    cam.execute('UserSetSave')
+
+
+def write_snapshots(path, snapshots):
+    """
+    Save {serial number: snapshot} for a session, ordered by serial number
+    """
+    with open(path, 'w') as f:
+        yaml.safe_dump(dict(sorted(snapshots.items())), f, sort_keys=False)
+
+
+def load_snapshots(path):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def _step(timer, camnum, name):
+    return timer.step(camnum, name) if timer is not None else nullcontext()
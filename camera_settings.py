@@ -0,0 +1,46 @@
+# Settings that can be given per camera in params.yaml, under `cameras:` keyed by serial number.
+# Anything a camera's section doesn't set falls back to the top-level key of the same name.
+PER_CAMERA_KEYS = ('exp_time', 'gain', 'trigger_line', 'pixel_format', 'binning', 'binning_selector',
+                   'decimation', 'roi', 'output_format', 'writer_threads', 'usb_controller')
+DEFAULTS = {'gain': None, 'pixel_format': None, 'binning': 1, 'binning_selector': None, 'decimation': 1,
+            'roi': {}, 'output_format': 'jpg', 'writer_threads': 4, 'usb_controller': 0}
+
+
+def camera_sections(cfg):
+    """
+    {serial number: section} from the `cameras:` block, in the order they are listed
+    """
+    sections = cfg.get('cameras') or {}
+    return {str(serial): dict(section or {}) for serial, section in sections.items()}
+
+
+def settings_for(cfg, serial):
+    """
+    Settings for one camera: its own section over the top-level keys. roi is merged key by key, so
+    a camera can e.g. only move the offset.
+    """
+    section = camera_sections(cfg).get(str(serial), {})
+    unknown = sorted(set(section) - set(PER_CAMERA_KEYS))
+    if unknown:
+        raise ValueError('Unknown setting(s) for camera %s: %s (allowed: %s)' % (
+            serial, ', '.join(unknown), ', '.join(PER_CAMERA_KEYS)))
+    settings = {key: cfg.get(key, DEFAULTS.get(key)) for key in PER_CAMERA_KEYS}
+    settings['serial'] = str(serial)
+    for key, value in section.items():
+        if key == 'roi':
+            value = dict(settings['roi'] or {}, **(value or {}))
+        settings[key] = value
+    return settings
+
+
+def order_cameras(cams, serials, cfg):
+    """
+    Put cameras in a fixed order, independent of USB enumeration: cameras listed under `cameras:`
+    first, in the order listed, then any others by serial number.
+    Returns the ordered cameras, their serial numbers, and listed serials that weren't found.
+    """
+    listed = list(camera_sections(cfg))
+    rank = {serial: k for k, serial in enumerate(listed)}
+    order = sorted(range(len(cams)), key=lambda i: (rank.get(serials[i], len(listed)), serials[i]))
+    missing = [serial for serial in listed if serial not in serials]
+    return [cams[i] for i in order], [serials[i] for i in order], missing
@@ -0,0 +1,35 @@
+import time
+
+
+def capture_frames(cam, num_images, log, pool, submit, errors, block=True, timeout=None, scheduler=None,
+                   on_frame=None):
+    """
+    The capture loop shared by capture threads (FLIR_Multicam.ThreadCapture) and capture processes
+    (process_capture.capture_camera). Takes num_images frames from an acquiring camera. Each frame's
+    times go into the TimestampLog and its pixels into a free slot of the pool, and submit(slot, idx,
+    t_frame) hands the slot on to be written. on_frame(idx, t_frame), if given, is called for every
+    frame as it arrives. Camera errors are raised.
+    Returns the number of frames that never arrived: with a scheduler (software trigger), a frame
+    that doesn't come within timeout s ends capture once the scheduler has fired every trigger.
+    """
+    for i in range(num_images):
+        try:
+            image_result = cam.GetNextImage() if timeout is None else cam.GetNextImage(timeout)
+        except errors:
+            # A trigger the camera missed leaves no frame; stop once the scheduler has fired them all
+            if scheduler is not None and scheduler.done.is_set():
+                return num_images - i
+            raise
+        t_frame = time.perf_counter_ns()
+        log.record(t_frame, image_result.GetTimeStamp(), image_result.GetFrameID())
+        if on_frame is not None:
+            on_frame(i, t_frame)
+
+        # With backpressure, wait for a free buffer; otherwise drop the frame if none are left
+        slot = pool.acquire(block=block)
+        if slot is not None:
+            pool.copy_in(slot, image_result.GetData() if pool.packed else image_result.GetNDArray())
+        image_result.Release()
+        if slot is not None:
+            submit(slot, i, t_frame)
+    return 0
@@ -0,0 +1,449 @@
+import glob
+import struct
+import threading
+import time
+import numpy as np
+
+DAQ_BACKENDS = ('nidaqmx', 'simulated')
+
+# The daq: section of the config. Channels are lists of {channel: ...} entries; names without a leading
+# slash are on `device`. ai entries take min/max (V) and optionally terminal (RSE, NRSE, DIFF, ...), ao
+# entries stim: true (plays the stim file) or value (constant V). With start_trigger (e.g. PFI0, wired to
+# the camera trigger) every task is armed before the cameras start and begins on its first edge.
+DAQ_KEYS = ('backend', 'device', 'fs', 'chunk_seconds', 'samples_per_block', 'start_trigger', 'start_edge',
+            'ai', 'ao', 'di')
+CHANNEL_KEYS = {'ai': ('channel', 'min', 'max', 'terminal'), 'ao': ('channel', 'min', 'max', 'stim', 'value'),
+                'di': ('channel',)}
+DAQ_DEFAULTS = {
+    'backend': 'nidaqmx',
+    'device': 'Dev2',
+    'fs': 10000,
+    'chunk_seconds': 60,
+    'samples_per_block': 1000,
+    'start_trigger': None,
+    'start_edge': 'rising',
+    'ai': [{'channel': 'ai%i' % k, 'min': 0, 'max': 5} for k in (0, 1, 2, 4, 5)],
+    'ao': [{'channel': 'ao0', 'stim': True}],
+    'di': [],
+}
+CHANNEL_DEFAULTS = {'min': -10.0, 'max': 10.0, 'terminal': None, 'stim': False, 'value': 0.0}
+
+
+class SampleLog:
+    """
+    Continuous samples of num_channels channels, appended into chunk files <basename>_XXXX.npy of
+    samples_per_chunk rows (one row per sample). Chunks are preallocated and memory-mapped, so memory
+    use is bounded by one chunk however long the run is, and every block appended is on disk if the
+    run crashes; rows never reached stay NaN (-1 for integer samples). close() trims the last chunk
+    to the samples recorded.
+    """
+    def __init__(self, basename, num_channels, samples_per_chunk=600000, dtype=np.float64):
+        self.basename = basename
+        self.num_channels = int(num_channels)
+        self.samples_per_chunk = int(samples_per_chunk)
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self._chunk = None
+        self._k = -1
+
+    def _chunk_name(self, k):
+        return self.basename + '_' + str(k).zfill(4) + '.npy'
+
+    def _open_chunk(self, k):
+        if self._chunk is not None:
+            self._chunk.flush()
+        self._chunk = np.lib.format.open_memmap(self._chunk_name(k), mode='w+', dtype=self.dtype,
+                                                shape=(self.samples_per_chunk, self.num_channels))
+        self._chunk[:] = unfilled(self.dtype)
+        self._k = k
+
+    def append(self, block):
+        """
+        Append a (channels, samples) block, as DAQmx reads it
+        """
+        n = block.shape[1]
+        done = 0
+        while done < n:
+            k, pos = divmod(self.count, self.samples_per_chunk)
+            if k != self._k:
+                self._open_chunk(k)
+            m = min(n - done, self.samples_per_chunk - pos)
+            self._chunk[pos:pos + m] = block[:, done:done + m].T
+            done += m
+            self.count += m
+
+    def close(self):
+        if self._chunk is None:
+            return
+        filled = self.count - self._k * self.samples_per_chunk
+        self._chunk.flush()
+        part = np.array(self._chunk[:filled]) if filled < self.samples_per_chunk else None
+        self._chunk = None
+        if part is not None:
+            np.save(self._chunk_name(self._k), part)
+
+
+def unfilled(dtype):
+    return np.nan if np.dtype(dtype).kind == 'f' else -1
+
+
+def load_samples(basename, mmap_mode=None):
+    """
+    All samples of a SampleLog as one (samples, channels) array, without rows that were never filled
+    """
+    chunks = [np.load(path, mmap_mode=mmap_mode) for path in sorted(glob.glob(basename + '_[0-9][0-9][0-9][0-9].npy'))]
+    if not chunks:
+        return np.zeros((0, 0))
+    data = np.concatenate(chunks)
+    return data[_filled_rows(data)]
+
+
+def _filled_rows(chunk):
+    if chunk.dtype.kind == 'f':
+        return ~np.isnan(chunk).all(axis=1)
+    return ~(chunk == -1).all(axis=1)
+
+
+# MAT-file (version 5) data and array class of the sample dtypes, for save_mat
+MAT_TYPES = {np.dtype(np.float64): (9, 6), np.dtype(np.int8): (1, 8)}  # miDOUBLE/mxDOUBLE, miINT8/mxINT8
+
+
+def _pad8(n):
+    return -n % 8
+
+
+def save_mat(path, logs):
+    """
+    Write SampleLogs to a MATLAB (v5) .mat file, as {variable name: basename}, each one channels x
+    samples without rows that were never filled, as scipy.io.savemat(path, {name: load_samples(...).T})
+    would. The chunk files are streamed into the file one at a time, so memory use stays at one chunk
+    however long the run was. (A channels x samples matrix is stored column by column, which is the
+    sample-by-sample row order of the chunks.)
+    """
+    with open(path, 'wb') as f:
+        text = 'MATLAB 5.0 MAT-file, Created on: %s' % time.asctime()
+        f.write(text.encode().ljust(116) + b'\0' * 8 + struct.pack('<H', 0x0100) + b'IM')
+        for name, basename in logs.items():
+            files = sorted(glob.glob(basename + '_[0-9][0-9][0-9][0-9].npy'))
+            chunks = [np.load(chunk_path, mmap_mode='r') for chunk_path in files]
+            dtype = chunks[0].dtype if chunks else np.dtype(np.float64)
+            num_channels = chunks[0].shape[1] if chunks else 0
+            num_samples = sum(int(_filled_rows(chunk).sum()) for chunk in chunks)
+            mi_type, mx_class = MAT_TYPES[dtype]
+            data_bytes = num_samples * num_channels * dtype.itemsize
+            size = 16 + 16 + 8 + len(name) + _pad8(len(name)) + 8 + data_bytes + _pad8(data_bytes)
+            if size >= 2**32:
+                raise ValueError('%s is too large for a v5 .mat file (%i bytes)' % (name, data_bytes))
+            f.write(struct.pack('<II', 14, size))  # miMATRIX
+            f.write(struct.pack('<IIII', 6, 8, mx_class, 0))  # array flags
+            f.write(struct.pack('<IIii', 5, 8, num_channels, num_samples))  # dimensions
+            f.write(struct.pack('<II', 1, len(name)) + name.encode() + b'\0' * _pad8(len(name)))
+            f.write(struct.pack('<II', mi_type, data_bytes))
+            for chunk in chunks:
+                f.write(np.ascontiguousarray(chunk[_filled_rows(chunk)], dtype=dtype.newbyteorder('<')))
+            f.write(b'\0' * _pad8(data_bytes))
+            del chunks
+
+
+def _physical(device, name):
+    return name if name.startswith('/') else '/%s/%s' % (device, name)
+
+
+def daq_settings(cfg):
+    """
+    The daq: section with defaults filled in and channel names made full (/Dev2/ai0). Raises
+    ValueError for unknown keys.
+    """
+    section = dict(cfg.get('daq') or {})
+    unknown = sorted(set(section) - set(DAQ_KEYS))
+    if unknown:
+        raise ValueError('Unknown daq setting(s): %s (allowed: %s)' % (', '.join(unknown), ', '.join(DAQ_KEYS)))
+    settings = dict(DAQ_DEFAULTS, **section)
+    if settings['backend'] not in DAQ_BACKENDS:
+        raise ValueError('daq backend must be one of %s, got %r' % (DAQ_BACKENDS, settings['backend']))
+    if settings['start_edge'] not in ('rising', 'falling'):
+        raise ValueError('daq start_edge must be rising or falling, got %r' % settings['start_edge'])
+    for kind, keys in CHANNEL_KEYS.items():
+        channels = []
+        for entry in settings[kind] or []:
+            entry = dict(entry)
+            unknown = sorted(set(entry) - set(keys))
+            if unknown or 'channel' not in entry:
+                raise ValueError('daq %s channel %r: needs channel, allowed keys are %s' % (
+                    kind, entry, ', '.join(keys)))
+            channel = {key: entry.get(key, CHANNEL_DEFAULTS.get(key)) for key in keys}
+            channel['channel'] = _physical(settings['device'], str(entry['channel']))
+            channels.append(channel)
+        settings[kind] = channels
+    if settings['start_trigger']:
+        settings['start_trigger'] = _physical(settings['device'], str(settings['start_trigger']))
+    return settings
+
+
+# NI-DAQmx input task (ai: voltages, di: lines) in continuous mode. DAQmx fills its own circular buffer
+# and calls back every samples_per_block samples; the callback reads just those, all channels in one
+# call into a preallocated buffer, so memory use doesn't grow with run length. sample_clock runs the
+# task from another task's clock (DI from /Dev/ai/SampleClock), which also makes it start with that task.
+class NidaqmxSource:
+    def __init__(self, kind, channels, fs, samples_per_block=1000, start_trigger=None, start_edge='rising',
+                 sample_clock=None, buffer_seconds=10):
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, Edge, TerminalConfiguration
+        from nidaqmx.stream_readers import AnalogMultiChannelReader, DigitalMultiChannelReader
+        self.num_channels = len(channels)
+        self.fs = fs
+        self.task = nidaqmx.Task()
+        if kind == 'ai':
+            for c in channels:
+                options = {'terminal_config': TerminalConfiguration[c['terminal'].upper()]} if c['terminal'] else {}
+                self.task.ai_channels.add_ai_voltage_chan(c['channel'], min_val=c['min'], max_val=c['max'], **options)
+            self.dtype = np.dtype(np.float64)
+            self._read_many = AnalogMultiChannelReader(self.task.in_stream).read_many_sample
+        else:
+            for c in channels:
+                self.task.di_channels.add_di_chan(c['channel'])
+            self.dtype = np.dtype(np.int8)
+            self._read_many = DigitalMultiChannelReader(self.task.in_stream).read_many_sample_port_uint32
+        self.kind = kind
+        self.task.timing.cfg_samp_clk_timing(fs, source=sample_clock or '',
+                                             sample_mode=AcquisitionType.CONTINUOUS,
+                                             samps_per_chan=int(fs * buffer_seconds))
+        if start_trigger:
+            self.task.triggers.start_trigger.cfg_dig_edge_start_trig(
+                start_trigger, trigger_edge=Edge.RISING if start_edge == 'rising' else Edge.FALLING)
+        self._buffer = np.zeros((self.num_channels, samples_per_block),
+                                dtype=np.float64 if kind == 'ai' else np.uint32)
+        self._lock = threading.Lock()
+        self._on_block = None
+        self.task.register_every_n_samples_acquired_into_buffer_event(samples_per_block, self._callback)
+
+    def _callback(self, task_handle, event_type, num_samples, callback_data):
+        with self._lock:
+            self._read(num_samples)
+        return 0
+
+    def _read(self, num_samples):
+        self._read_many(self._buffer, number_of_samples_per_channel=num_samples, timeout=0)
+        block = self._buffer[:, :num_samples]
+        self._on_block(block if self.kind == 'ai' else (block != 0).astype(np.int8))
+
+    def start(self, on_block):
+        self._on_block = on_block
+        self.task.start()
+
+    def stop(self):
+        # hand over what is left in the buffer, short of a full block
+        with self._lock:
+            remaining = self.task.in_stream.avail_samp_per_chan
+            if remaining:
+                self._buffer = np.zeros((self.num_channels, max(remaining, self._buffer.shape[1])),
+                                        dtype=self._buffer.dtype)
+                self._read(remaining)
+            self.task.stop()
+
+    def close(self):
+        self.task.close()
+
+
+# NI-DAQmx output task playing one finite waveform per channel (channels x samples) at fs
+class NidaqmxOutput:
+    def __init__(self, channels, fs, waveforms, start_trigger=None, start_edge='rising'):
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, Edge
+        self.task = nidaqmx.Task()
+        for c in channels:
+            self.task.ao_channels.add_ao_voltage_chan(c['channel'], min_val=c['min'], max_val=c['max'])
+        self.task.timing.cfg_samp_clk_timing(fs, sample_mode=AcquisitionType.FINITE,
+                                             samps_per_chan=waveforms.shape[1])
+        if start_trigger:
+            self.task.triggers.start_trigger.cfg_dig_edge_start_trig(
+                start_trigger, trigger_edge=Edge.RISING if start_edge == 'rising' else Edge.FALLING)
+        self.task.write(waveforms[0] if len(channels) == 1 else waveforms, auto_start=False)
+
+    def start(self):
+        self.task.start()
+
+    def stop(self):
+        self.task.stop()
+
+    def close(self):
+        self.task.close()
+
+
+def ao_waveforms(channels, stim, num_samples):
+    """
+    One row per AO channel: the stim waveform for stim channels (zeros without a stim), else the
+    channel's constant value. As long as the stim, or num_samples without one.
+    """
+    n = len(stim) if stim is not None else int(num_samples)
+    waveforms = np.zeros((len(channels), n))
+    for row, c in zip(waveforms, channels):
+        if c['stim']:
+            if stim is not None:
+                row[:] = stim
+        else:
+            row[:] = c['value']
+    return waveforms
+
+
+# Stands in for a DAQ input task without hardware, delivering blocks of samples_per_block from a thread
+# at the rate a DAQ would: ai channels are slow sine waves plus noise within their min-max, di channels
+# square waves.
+class SimulatedSource:
+    def __init__(self, kind, channels, fs, samples_per_block=1000, seed=None):
+        self.kind = kind
+        self.num_channels = len(channels)
+        self.fs = fs
+        self.dtype = np.dtype(np.float64 if kind == 'ai' else np.int8)
+        self.lo = np.array([c.get('min', 0) for c in channels], dtype=np.float64)[:, None]
+        self.hi = np.array([c.get('max', 1) for c in channels], dtype=np.float64)[:, None]
+        self.freqs = 1.0 + np.arange(self.num_channels)[:, None]
+        self.samples_per_block = int(samples_per_block)
+        self.rng = np.random.default_rng(seed)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _block(self, first):
+        t = (first + np.arange(self.samples_per_block)) / self.fs
+        phase = np.sin(2 * np.pi * self.freqs * t)
+        if self.kind == 'di':
+            return (phase > 0).astype(np.int8)
+        mid, amp = (self.hi + self.lo) / 2, (self.hi - self.lo) / 2
+        block = mid + 0.8 * amp * phase + 0.01 * amp * self.rng.standard_normal(phase.shape)
+        return np.clip(block, self.lo, self.hi)
+
+    def _run(self, on_block):
+        t0 = time.perf_counter()
+        k = 0
+        while not self._stop_event.is_set():
+            deadline = t0 + (k + 1) * self.samples_per_block / self.fs
+            self._stop_event.wait(max(0.0, deadline - time.perf_counter()))
+            if self._stop_event.is_set():
+                break
+            on_block(self._block(k * self.samples_per_block))
+            k += 1
+
+    def start(self, on_block):
+        self._thread = threading.Thread(target=self._run, args=(on_block,), name='simulated-daq', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        pass
+
+
+def make_source(backend, kind, channels, fs, samples_per_block=1000, start_trigger=None, start_edge='rising',
+                sample_clock=None):
+    if backend == 'nidaqmx':
+        return NidaqmxSource(kind, channels, fs, samples_per_block, start_trigger, start_edge, sample_clock)
+    elif backend == 'simulated':
+        return SimulatedSource(kind, channels, fs, samples_per_block)
+    raise ValueError('daq backend must be one of %s, got %r' % (DAQ_BACKENDS, backend))
+
+
+class DAQRecorder:
+    """
+    Continuous input from a source (NidaqmxSource or SimulatedSource), written block by block
+    into a SampleLog as it arrives. A block that fails to write is kept in `error` rather than raised
+    in the DAQ's callback thread.
+    Each block is stamped with clock() (ns) on arrival, with the number of samples recorded by then;
+    stop() saves these to <basename>_blocks.npy, to place the samples on the session clock.
+    """
+    def __init__(self, source, basename, samples_per_chunk=600000, clock=time.time_ns):
+        self.source = source
+        self.log = SampleLog(basename, source.num_channels, samples_per_chunk, source.dtype)
+        self.clock = clock
+        self.blocks = []  # (samples recorded, host ns)
+        self.error = None
+
+    def _on_block(self, block):
+        t = self.clock()
+        try:
+            self.log.append(block)
+        except OSError as ex:
+            self.error = ex
+        self.blocks.append((self.log.count, t))
+
+    def start(self):
+        self.source.start(self._on_block)
+
+    def stop(self):
+        self.source.stop()
+        self.log.close()
+        np.save(self.log.basename + '_blocks.npy', np.array(self.blocks, dtype=np.int64).reshape(-1, 2))
+
+    def close(self):
+        self.source.close()
+
+    @property
+    def count(self):
+        return self.log.count
+
+
+class DAQSystem:
+    """
+    All DAQ tasks of a session, from daq_settings: ai and di channels recorded continuously to
+    <basename>_DAQ_XXXX.npy and <basename>_DI_XXXX.npy, ao channels playing the stim or constant
+    values. With a start_trigger (nidaqmx only), arm() starts every task waiting for its first edge,
+    before the cameras start; otherwise start() starts them from Python, on the first frame.
+    """
+    def __init__(self, settings, basename, clock=time.time_ns, stim=None, num_samples=0):
+        fs = settings['fs']
+        self.fs = fs
+        self.hardware_start = bool(settings['start_trigger']) and settings['backend'] == 'nidaqmx'
+        trigger, edge = settings['start_trigger'], settings['start_edge']
+        samples_per_chunk = int(fs * settings['chunk_seconds'])
+        self.recorders = {}
+        if settings['ai']:
+            source = make_source(settings['backend'], 'ai', settings['ai'], fs, settings['samples_per_block'],
+                                 trigger, edge)
+            self.recorders['ai'] = DAQRecorder(source, basename + '_DAQ', samples_per_chunk, clock)
+        if settings['di']:
+            # most devices have no DI sample clock of their own; DI then runs on the AI clock, starting with AI
+            sample_clock = '/%s/ai/SampleClock' % settings['device'] if settings['ai'] else None
+            source = make_source(settings['backend'], 'di', settings['di'], fs, settings['samples_per_block'],
+                                 None if sample_clock else trigger, edge, sample_clock)
+            self.recorders['di'] = DAQRecorder(source, basename + '_DI', samples_per_chunk, clock)
+        self.output = None
+        if settings['ao'] and settings['backend'] == 'nidaqmx':
+            self.output = NidaqmxOutput(settings['ao'], fs, ao_waveforms(settings['ao'], stim, num_samples),
+                                        trigger, edge)
+        self._started = False
+
+    def _start(self):
+        if self._started:
+            return
+        self._started = True
+        if self.output is not None:
+            self.output.start()
+        # DI first, so it is running when the AI clock it follows starts
+        for kind in ('di', 'ai'):
+            if kind in self.recorders:
+                self.recorders[kind].start()
+
+    def arm(self):
+        if self.hardware_start:
+            self._start()
+
+    def start(self):
+        self._start()
+
+    def stop(self):
+        for recorder in self.recorders.values():
+            recorder.stop()
+        if self.output is not None:
+            self.output.stop()
+
+    def close(self):
+        for recorder in self.recorders.values():
+            recorder.close()
+        if self.output is not None:
+            self.output.close()
+
+    @property
+    def error(self):
+        return next((r.error for r in self.recorders.values() if r.error is not None), None)
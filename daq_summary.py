@@ -0,0 +1,137 @@
+"""
+Summary plots and report of the DAQ data of a run, made from the chunk files on disk.
+
+For every sample log given (e.g. <file_name>_DAQ in the auxillary folder) this writes:
+    <log>.png           the first --detail seconds of every channel, at full rate
+    <log>_overview.png  the whole run, as the min/max envelope of every channel in --points bins
+    <log>_summary.json  samples, duration, unfilled rows and per-channel min/max/mean
+The chunk files are read one at a time, so a 600 s run costs one chunk of memory and a plot of a
+few thousand points. FLIR_SPRA.py runs this in its own process once the data is saved.
+
+Example:
+    python daq_summary.py --fs 10000 s:/cm161_30/auxillary/runF/runF_stim1_DAQ
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+
+def chunk_files(basename):
+    return sorted(glob.glob(basename + '_[0-9][0-9][0-9][0-9].npy'))
+
+
+def minmax_envelope(chunks, step):
+    """
+    Min and max of every `step` samples of a (samples, channels) stream given as a sequence of
+    chunks, as two (bins, channels) arrays. Bins may span chunks; the last bin may be shorter.
+    NaN (never filled) samples are ignored.
+    """
+    mins, maxs = [], []
+    carry = None
+    for chunk in chunks:
+        data = chunk if carry is None or not len(carry) else np.concatenate((carry, chunk))
+        n = len(data) // step * step
+        if n:
+            bins = np.asarray(data[:n]).reshape(-1, step, data.shape[1])
+            mins.append(np.fmin.reduce(bins, axis=1))
+            maxs.append(np.fmax.reduce(bins, axis=1))
+        carry = np.array(data[n:])
+    if carry is not None and len(carry):
+        mins.append(np.fmin.reduce(carry, axis=0, keepdims=True))
+        maxs.append(np.fmax.reduce(carry, axis=0, keepdims=True))
+    if not mins:
+        return np.zeros((0, 0)), np.zeros((0, 0))
+    return np.concatenate(mins), np.concatenate(maxs)
+
+
+def summarize(basename, fs, points=4000, detail=0.5):
+    """
+    Write the plots and report of one sample log (see module docstring); returns the report
+    """
+    files = chunk_files(basename)
+    if not files:
+        return None
+    shapes = [np.load(path, mmap_mode='r').shape for path in files]
+    total = sum(shape[0] for shape in shapes)
+    num_channels = shapes[0][1]
+    step = max(1, -(-total // points))
+    mins, maxs = minmax_envelope((np.load(path, mmap_mode='r') for path in files), step)
+
+    # one more pass for the means and unfilled rows, a chunk at a time
+    sums = np.zeros(num_channels)
+    counts = np.zeros(num_channels)
+    unfilled = 0
+    for path in files:
+        data = np.load(path, mmap_mode='r')
+        valid = ~np.isnan(data) if data.dtype.kind == 'f' else (np.asarray(data) != -1)
+        sums += np.where(valid, data, 0).sum(axis=0)
+        counts += valid.sum(axis=0)
+        unfilled += int((~valid).all(axis=1).sum())
+
+    report = {
+        'samples': total - unfilled,
+        'unfilled_samples': unfilled,
+        'duration_s': (total - unfilled) / fs,
+        'fs': fs,
+        'channels': [{
+            'channel': c,
+            'min': float(np.nanmin(mins[:, c])) if counts[c] else None,
+            'max': float(np.nanmax(maxs[:, c])) if counts[c] else None,
+            'mean': float(sums[c] / counts[c]) if counts[c] else None,
+        } for c in range(num_channels)],
+    }
+    with open(basename + '_summary.json', 'w') as f:
+        json.dump(report, f, indent=2)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # first seconds at full rate, as the DAQ plot always was
+    first = np.asarray(np.load(files[0], mmap_mode='r')[:int(fs * detail)])
+    plt.figure()
+    plt.plot(np.arange(len(first)) / fs, first)
+    plt.xlabel('time (s)')
+    plt.savefig(basename + '.png')
+    plt.close()
+
+    fig, axes = plt.subplots(num_channels, 1, sharex=True, squeeze=False,
+                             figsize=(10, 1 + 1.2 * num_channels))
+    t = np.arange(len(mins)) * step / fs
+    for c, ax in enumerate(axes[:, 0]):
+        ax.fill_between(t, mins[:, c], maxs[:, c], step='post', linewidth=0.5)
+        ax.set_ylabel('ch%i' % c)
+    axes[-1, 0].set_xlabel('time (s)')
+    fig.savefig(basename + '_overview.png')
+    plt.close(fig)
+    return report
+
+
+def start_summary(basenames, fs, points=4000, detail=0.5):
+    """
+    Run this script on the given sample logs in a process of its own and return at once (Popen).
+    A separate script rather than multiprocessing, which would import the calling script again.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), '--fs', str(fs), '--points', str(points),
+           '--detail', str(detail)] + list(basenames)
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('basenames', nargs='+', help='sample logs, without _XXXX.npy')
+    parser.add_argument('--fs', type=float, required=True, help='sample rate (Hz)')
+    parser.add_argument('--points', type=int, default=4000, help='envelope bins of the overview plot')
+    parser.add_argument('--detail', type=float, default=0.5, help='seconds plotted at full rate')
+    args = parser.parse_args()
+    for basename in args.basenames:
+        if summarize(basename, args.fs, args.points, args.detail) is None:
+            print('No DAQ data found at %s' % basename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+import numpy as np
+
+# Packed pixel formats are unpacked on the host, into frames of this format
+PACKED_FORMATS = {'Mono12p': 'Mono16'}
+
+
+def pixel_format_dtype(pixel_format):
+    """
+    NumPy dtype used to hold a frame of the given PixelFormat name (e.g. 'Mono8')
+    """
+    if pixel_format.endswith('8'):
+        return np.uint8
+    return np.uint16
+
+
+def unpacked_format(pixel_format):
+    """
+    PixelFormat of the frames as stored: packed formats are saved unpacked
+    """
+    return PACKED_FORMATS.get(pixel_format, pixel_format)
+
+
+def unpack_mono12p(data, out):
+    """
+    Unpack a Mono12p buffer (two pixels in three bytes, low bits first) into a uint16 frame
+    """
+    b = np.asarray(data, dtype=np.uint8).reshape(-1, 3)[:out.size // 2].astype(np.uint16)
+    pairs = out.reshape(-1, 2)
+    np.bitwise_or(b[:, 0], (b[:, 1] & 0x0F) << 8, out=pairs[:, 0])
+    np.bitwise_or(b[:, 1] >> 4, b[:, 2] << 4, out=pairs[:, 1])
+    return out
+
+
+# Preallocated, reusable frame buffers. The capture thread copies each frame out of the SDK
+# buffer into a free slot and releases the SDK buffer right away; the writer hands the slot
+# back once the frame is on disk. With a packed pixel format, frames are unpacked into the slot
+# straight from the SDK buffer (pass image.GetData() rather than GetNDArray() to copy_in).
+class FramePool:
+    def __init__(self, count, height, width, dtype=np.uint8, pixel_format=None):
+        self.count = int(count)
+        self.packed = pixel_format in PACKED_FORMATS
+        self.shape = (int(height), int(width))
+        self.dtype = np.dtype(dtype)
+        self.buffers = np.empty((self.count,) + self.shape, dtype=self.dtype)
+        self.buffers.fill(0)  # touch every page now rather than mid-acquisition
+        self._free = queue.LifoQueue(maxsize=self.count)
+        for slot in range(self.count):
+            self._free.put_nowait(slot)
+        self.exhausted = 0
+
+    def acquire(self, block=True):
+        """
+        Return a free slot index, or None if block is False and the pool is empty.
+        """
+        try:
+            return self._free.get(block=block)
+        except queue.Empty:
+            self.exhausted += 1
+            return None
+
+    def release(self, slot):
+        self._free.put_nowait(slot)
+
+    def copy_in(self, slot, frame):
+        if self.packed:
+            return unpack_mono12p(frame, self.buffers[slot])
+        np.copyto(self.buffers[slot], frame.reshape(self.shape), casting='unsafe')
+        return self.buffers[slot]
+
+    def in_use(self):
+        return self.count - self._free.qsize()
+
+
+# The same pool in shared memory, for handing frames from a capture process to a writer process.
+# Slots travel between processes as indices: free ones on a queue, filled ones on `filled` as
+# (slot, frame index, timestamp). Create it in the coordinating process and pass it to both
+# processes; each attaches to the same memory.
+class SharedFramePool(FramePool):
+    def __init__(self, count, height, width, dtype=np.uint8, pixel_format=None, ctx=None):
+        ctx = ctx or multiprocessing.get_context('spawn')
+        self.count = int(count)
+        self.packed = pixel_format in PACKED_FORMATS
+        self.shape = (int(height), int(width))
+        self.dtype = np.dtype(dtype)
+        size = self.count * self.shape[0] * self.shape[1] * self.dtype.itemsize
+        self._shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self._owner = True
+        self._attach()
+        self.buffers.fill(0)
+        self._free = ctx.Queue()
+        for slot in range(self.count):
+            self._free.put_nowait(slot)
+        self.filled = ctx.Queue()
+        self.exhausted = 0
+
+    def _attach(self):
+        self.buffers = np.ndarray((self.count,) + self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        state = dict(self.__dict__, _shm=self._shm.name, _owner=False)
+        del state['buffers']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = shared_memory.SharedMemory(name=state['_shm'])
+        self._attach()
+
+    def close(self):
+        """
+        Detach from the shared memory; the creating process also frees it
+        """
+        del self.buffers
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
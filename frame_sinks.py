@@ -0,0 +1,246 @@
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import threading
+import numpy as np
+from camera_backend import SyntheticImage
+
+OUTPUT_FORMATS = ('jpg', 'raw', 'npy_chunks', 'video')
+VIDEO_CODECS = ('ffv1', 'x264')
+
+# Header for .raw chunk files, followed by an int64 timestamp per frame and then the frames.
+# Frame data starts on a 4096 byte boundary so the whole block can be np.memmap'd directly.
+RAW_MAGIC = b'FLIRRAW1'
+RAW_HEADER = struct.Struct('<8sIIIq8sqq')  # magic, data offset, height, width, capacity, dtype, first frame, count
+RAW_ALIGN = 4096
+
+
+# One JPEG file per frame (original behaviour), encoded by PySpin. Frames of the synthetic backend
+# are saved the way its images save themselves (SyntheticImage.Save), so no Spinnaker SDK is needed.
+class JpegSink:
+    def __init__(self, basename, camnum, num_images, height, width, pixel_format, camera_backend='spinnaker', pad=None):
+        self.PySpin = None
+        if camera_backend == 'spinnaker':
+            import PySpin
+            self.PySpin = PySpin
+            self.pixel_format = getattr(PySpin, 'PixelFormat_' + pixel_format)
+        self.basename = basename
+        self.camnum = camnum
+        self.pad = len(str(num_images)) if pad is None else pad  # digits of the frame number
+        self.height = height
+        self.width = width
+
+    def write(self, frame, idx, timestamp):
+        # using .zfill to add leading zeros to frame idx, for better compatibility with ffmpeg commands
+        out = self.basename + '_' + str(idx + 1).zfill(self.pad) + '_cam' + str(self.camnum) + '.jpg'
+        if self.PySpin is not None:
+            image = self.PySpin.Image.Create(self.width, self.height, 0, 0, self.pixel_format, frame)
+        else:
+            image = SyntheticImage(frame, idx, timestamp)
+        image.Save(out)
+
+    def close(self):
+        pass
+
+
+# Appends frames into large preallocated chunk files, frames_per_chunk frames each.
+#   raw        - <name>_camN_XXXX.raw, self-describing header + timestamps + frames (see open_raw_chunk)
+#   npy_chunks - <name>_camN_XXXX.npy holding the frames, and <name>_camN_XXXX_t.npy with timestamps
+# Frame idx always lands at the same place, so writer threads can fill a chunk out of order.
+# Full chunks are finished (unmapped, frame count written, fsync'd) on a closer thread of their own,
+# so writer threads never wait for a chunk's pages to reach the disk.
+class ChunkSink:
+    def __init__(self, basename, camnum, num_images, height, width, dtype, frames_per_chunk=1000, fmt='raw'):
+        self.basename = basename + '_cam' + str(camnum)
+        self.num_images = int(num_images)
+        self.shape = (int(height), int(width))
+        self.dtype = np.dtype(dtype)
+        self.frames_per_chunk = int(frames_per_chunk)
+        self.fmt = fmt
+        self._chunks = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._closing = queue.Queue()
+        self._close_error = None
+        self._closer = threading.Thread(target=self._run_closer, name=self.basename + '-closer', daemon=True)
+        self._closer.start()
+
+    def _capacity(self, k):
+        return min(self.frames_per_chunk, self.num_images - k * self.frames_per_chunk)
+
+    def _chunk_name(self, k):
+        return self.basename + '_' + str(k).zfill(4) + ('.raw' if self.fmt == 'raw' else '.npy')
+
+    def _open_chunk(self, k):
+        capacity = self._capacity(k)
+        path = self._chunk_name(k)
+        if self.fmt == 'raw':
+            offset = -(-(RAW_HEADER.size + 8 * capacity) // RAW_ALIGN) * RAW_ALIGN
+            with open(path, 'wb') as f:
+                f.write(RAW_HEADER.pack(RAW_MAGIC, offset, self.shape[0], self.shape[1], capacity,
+                                        self.dtype.str.encode(), k * self.frames_per_chunk, 0))
+                f.truncate(offset + capacity * self.shape[0] * self.shape[1] * self.dtype.itemsize)
+            times = np.memmap(path, dtype='<i8', mode='r+', offset=RAW_HEADER.size, shape=(capacity,))
+            frames = np.memmap(path, dtype=self.dtype, mode='r+', offset=offset, shape=(capacity,) + self.shape)
+        else:
+            frames = np.lib.format.open_memmap(path, mode='w+', dtype=self.dtype, shape=(capacity,) + self.shape)
+            times = np.lib.format.open_memmap(path[:-4] + '_t.npy', mode='w+', dtype='<i8', shape=(capacity,))
+        times[:] = -1  # frames that never arrive keep a timestamp of -1
+        return frames, times
+
+    def write(self, frame, idx, timestamp):
+        k, pos = divmod(idx, self.frames_per_chunk)
+        with self._lock:
+            if k not in self._chunks:
+                self._chunks[k] = self._open_chunk(k)
+                self._counts[k] = 0
+            frames, times = self._chunks[k]
+        frames[pos] = frame
+        times[pos] = timestamp
+        del frames, times  # the closer thread must hold the last reference, so it is the one to unmap
+        with self._lock:
+            self._counts[k] += 1
+            done = self._counts[k] == self._capacity(k)
+        if done:
+            self._closing.put(self._retire(k))
+
+    def _retire(self, k):
+        with self._lock:
+            frames, times = self._chunks.pop(k)
+            return k, frames, times, self._counts.pop(k)
+
+    def _run_closer(self):
+        while True:
+            item = self._closing.get()
+            if item is None:
+                break
+            k, frames, times, count = item
+            del item, frames, times
+            try:
+                self._finish_chunk(k, count)
+            except OSError as ex:
+                self._close_error = ex
+
+    def _finish_chunk(self, k, count):
+        path = self._chunk_name(k)
+        with open(path, 'r+b') as f:
+            if self.fmt == 'raw':
+                f.seek(RAW_HEADER.size - 8)
+                f.write(struct.pack('<q', count))
+                f.flush()
+            os.fsync(f.fileno())
+        if self.fmt != 'raw':
+            with open(path[:-4] + '_t.npy', 'r+b') as f:
+                os.fsync(f.fileno())
+
+    def close(self):
+        for k in list(self._chunks):
+            self._closing.put(self._retire(k))
+        self._closing.put(None)
+        self._closer.join()
+        if self._close_error is not None:
+            raise self._close_error
+
+
+def open_raw_chunk(path, mode='r'):
+    """
+    Memory-map a .raw chunk file. Returns (header dict, timestamps, frames)
+    """
+    with open(path, 'rb') as f:
+        magic, offset, height, width, capacity, dtype, first, count = RAW_HEADER.unpack(f.read(RAW_HEADER.size))
+    if magic != RAW_MAGIC:
+        raise ValueError('%s is not a FLIR-Multicam raw chunk file' % path)
+    dtype = np.dtype(dtype.rstrip(b'\0').decode())
+    header = {'height': height, 'width': width, 'capacity': capacity, 'dtype': dtype,
+              'first_frame': first, 'count': count}
+    times = np.memmap(path, dtype='<i8', mode=mode, offset=RAW_HEADER.size, shape=(capacity,))
+    frames = np.memmap(path, dtype=dtype, mode=mode, offset=offset, shape=(capacity, height, width))
+    return header, times, frames
+
+
+# Streams raw frames into one long-lived ffmpeg process per camera, over stdin.
+# Writer threads can finish frames out of order, so frames are put back in order before they
+# reach the pipe. A frame that never arrives (dropped) is skipped once max_pending later frames
+# are waiting. <name>_camN_t.npy records (frame idx, timestamp) for every frame in the video, in order.
+class VideoSink:
+    def __init__(self, basename, camnum, height, width, dtype, fps=30, codec='ffv1', crf=18,
+                 ffmpeg_path='ffmpeg', max_pending=64):
+        if codec not in VIDEO_CODECS:
+            raise ValueError('video_codec must be one of %s, got %r' % (VIDEO_CODECS, codec))
+        self.basename = basename + '_cam' + str(camnum)
+        self.shape = (int(height), int(width))
+        self.max_pending = max_pending
+        in_fmt = 'gray' if np.dtype(dtype).itemsize == 1 else 'gray16le'
+        cmd = [ffmpeg_path, '-y', '-loglevel', 'warning',
+               '-f', 'rawvideo', '-pix_fmt', in_fmt, '-s', '%ix%i' % (width, height), '-r', str(fps),
+               '-i', '-']
+        if codec == 'ffv1':
+            cmd += ['-c:v', 'ffv1', '-level', '3', '-g', '1']
+        else:
+            cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', str(crf),
+                    '-pix_fmt', 'yuv420p' if in_fmt == 'gray' else 'yuv420p10le']
+        cmd.append(self.basename + '.mkv')
+        self._log = open(self.basename + '_ffmpeg.log', 'wb')
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._log)
+        self._next = 0
+        self._pending = {}
+        self._written = []
+        self._lock = threading.Lock()
+
+    def _pipe(self, frame, idx, timestamp):
+        self.proc.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+        self._written.append((idx, timestamp))
+        self._next = idx + 1
+
+    def write(self, frame, idx, timestamp):
+        with self._lock:
+            if idx != self._next:
+                # Out of order: keep a copy, as the caller reuses the buffer once we return
+                self._pending[idx] = (frame.copy(), timestamp)
+                if len(self._pending) <= self.max_pending:
+                    return
+                self._next = min(self._pending)
+            else:
+                self._pipe(frame, idx, timestamp)
+            while self._next in self._pending:
+                frame, timestamp = self._pending.pop(self._next)
+                self._pipe(frame, self._next, timestamp)
+
+    def close(self):
+        with self._lock:
+            for idx in sorted(self._pending):
+                frame, timestamp = self._pending.pop(idx)
+                self._pipe(frame, idx, timestamp)
+            self.proc.stdin.close()
+            self.proc.wait()
+            self._log.close()
+            np.save(self.basename + '_t.npy', np.asarray(self._written, dtype=np.int64).reshape(-1, 2))
+        if self.proc.returncode != 0:
+            print('ffmpeg exited with code %i for %s, see %s_ffmpeg.log' % (self.proc.returncode, self.basename,
+                                                                          self.basename))
+
+
+def check_sink(output_format, **options):
+    """
+    Raise FileNotFoundError if a sink of this format couldn't be made, before any camera is started
+    """
+    if output_format == 'video':
+        ffmpeg_path = options.get('ffmpeg_path', 'ffmpeg')
+        if shutil.which(ffmpeg_path) is None:
+            raise FileNotFoundError('ffmpeg not found: %s (set ffmpeg_path)' % ffmpeg_path)
+
+
+def make_sink(output_format, basename, camnum, num_images, height, width, pixel_format, dtype, **options):
+    if output_format == 'jpg':
+        return JpegSink(basename, camnum, num_images, height, width, pixel_format,
+                        options.get('camera_backend', 'spinnaker'), options.get('jpg_pad'))
+    elif output_format in ('raw', 'npy_chunks'):
+        return ChunkSink(basename, camnum, num_images, height, width, dtype,
+                         options.get('frames_per_chunk', 1000), output_format)
+    elif output_format == 'video':
+        return VideoSink(basename, camnum, height, width, dtype, fps=options.get('video_fps', 30),
+                         codec=options.get('video_codec', 'ffv1'), crf=options.get('video_crf', 18),
+                         ffmpeg_path=options.get('ffmpeg_path', 'ffmpeg'))
+    raise ValueError('output_format must be one of %s, got %r' % (OUTPUT_FORMATS, output_format))
@@ -0,0 +1,200 @@
+import numpy as np
+
+# An interval this many frame periods long (or longer) means at least one frame went missing.
+# Relative to the period, so it works the same at 30 fps and at 1000 fps. A long interval that is
+# immediately followed by one shorter than half a period is a late frame, not a drop.
+DROP_THRESHOLD = 1.5
+
+
+def interframe_stats(times_ns, expected_period_ns=None):
+    """
+    Frame timing statistics for one camera, from per-frame timestamps in ns.
+    If expected_period_ns is not given, the median interval is used as the frame period.
+    Intervals are in ms. rate is None if the timestamps don't advance (e.g. a stalled camera
+    repeating one timestamp), and no drops are counted without a frame period.
+    """
+    t = np.asarray(times_ns, dtype=np.int64)
+    if t.size < 2:
+        return None
+    dt = np.diff(t) * 1e-6
+    period = expected_period_ns * 1e-6 if expected_period_ns else float(np.median(dt))
+    devs = dt - period
+    largest = int(np.argmax(np.abs(devs)))
+    # Number of frame periods each interval spans, minus the one frame that did arrive:
+    # >0 for a gap, -1 for an interval under half a period
+    if period > 0:
+        missed = np.rint(dt / period).astype(np.int64) - 1
+        late = np.flatnonzero((missed[:-1] > 0) & (missed[1:] < 0))
+        missed[late] -= 1
+        np.clip(missed, 0, None, out=missed)
+    else:
+        missed = np.zeros(dt.size, dtype=np.int64)
+    span = t[-1] - t[0]
+    return {
+        'num_frames': int(t.size),
+        'rate': (t.size - 1) / (span * 1e-9) if span > 0 else None,
+        'period': period,
+        'mean': float(dt.mean()),
+        'std': float(dt.std()),
+        'min': float(dt.min()),
+        'max': float(dt.max()),
+        'largest_dev': float(devs[largest]),
+        'largest_dev_idx': largest,
+        'over_0_1ms': int(np.count_nonzero(devs > 0.1)),
+        'over_1ms': int(np.count_nonzero(devs > 1)),
+        'drop_events': int(np.count_nonzero(missed)),
+        'dropped': int(missed.sum()),
+        'dropped_idx': np.flatnonzero(missed),
+        'intervals': dt,
+    }
+
+
+def cross_camera_stats(times_list, frame_ids_list=None):
+    """
+    How well frames line up across cameras. Frames are matched by frame ID (relative to each
+    camera's first frame) if given, otherwise by index, which assumes no drops.
+    Returns the per-frame spread (latest - earliest camera) and each camera's mean offset from
+    camera 0, in ms.
+    """
+    if len(times_list) < 2 or min(len(t) for t in times_list) == 0:
+        return None
+    if frame_ids_list is not None:
+        rel = [np.asarray(ids, dtype=np.int64) - ids[0] for ids in frame_ids_list]
+        common = rel[0]
+        for r in rel[1:]:
+            common = np.intersect1d(common, r, assume_unique=True)
+        T = np.stack([np.asarray(t, dtype=np.int64)[np.searchsorted(r, common)] for t, r in zip(times_list, rel)])
+    else:
+        n = min(len(t) for t in times_list)
+        T = np.stack([np.asarray(t[:n], dtype=np.int64) for t in times_list])
+    if T.shape[1] == 0:
+        return None
+    spread = (T.max(axis=0) - T.min(axis=0)) * 1e-6
+    offsets = (T - T[0]) * 1e-6
+    worst = int(np.argmax(spread))
+    return {
+        'num_frames': T.shape[1],
+        'spread_mean': float(spread.mean()),
+        'spread_max': float(spread[worst]),
+        'spread_max_idx': worst,
+        'offset_mean': offsets.mean(axis=1),
+        'offset_std': offsets.std(axis=1),
+    }
+
+
+class OnlineTiming:
+    """
+    Running interframe statistics, updated in O(1) per frame so they can be read mid-run:
+    mean/variance (Welford), min/max, a fixed-width histogram and a dropped frame count.
+    Without an expected period, the period starts as the median of the first `warmup` intervals
+    (no drops are counted before then) and is then tracked as the mean of intervals that don't look
+    like drops.
+    """
+    def __init__(self, expected_period_ns=None, bin_width_ms=0.1, num_bins=1000, warmup=32):
+        self.expected_period = expected_period_ns * 1e-6 if expected_period_ns else None
+        self.bin_width = bin_width_ms
+        self.hist = np.zeros(num_bins, dtype=np.int64)  # last bin also holds everything longer
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.last_interval = None
+        self.dropped = 0
+        self._last_dropped = 0
+        self._period_sum = 0.0
+        self._period_n = 0
+        self._warmup = [] if not self.expected_period else None
+        self._warmup_size = warmup
+        self._last = None
+
+    @property
+    def period(self):
+        if self.expected_period:
+            return self.expected_period
+        return self._period_sum / self._period_n if self._period_n else None
+
+    @property
+    def std(self):
+        return (self._m2 / self.count) ** 0.5 if self.count else 0.0
+
+    def update(self, t_ns):
+        last, self._last = self._last, t_ns
+        if last is None:
+            return
+        dt = (t_ns - last) * 1e-6
+        self.last_interval = dt
+        self.count += 1
+        delta = dt - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (dt - self.mean)
+        if dt < self.min:
+            self.min = dt
+        if dt > self.max:
+            self.max = dt
+        self.hist[min(int(dt / self.bin_width), self.hist.size - 1)] += 1
+        period = self.period
+        if period is None:
+            self._warmup.append(dt)
+            if len(self._warmup) == self._warmup_size:
+                self._period_sum = float(np.median(self._warmup))
+                self._period_n = 1
+        elif dt >= DROP_THRESHOLD * period:
+            self._last_dropped = int(round(dt / period)) - 1
+            self.dropped += self._last_dropped
+        else:
+            if self._last_dropped and dt < 0.5 * period:
+                self.dropped -= 1  # previous frame was late, not preceded by a drop
+            elif not self.expected_period:
+                self._period_sum += dt
+                self._period_n += 1
+            self._last_dropped = 0
+
+    def snapshot(self):
+        return {'intervals': self.count, 'mean': self.mean, 'std': self.std, 'min': self.min, 'max': self.max,
+                'last': self.last_interval, 'period': self.period, 'dropped': self.dropped}
+
+
+def frame_id_drops(frame_ids):
+    """
+    Exact dropped frame accounting from gaps in the camera's frame IDs
+    """
+    ids = np.asarray(frame_ids, dtype=np.int64)
+    if ids.size < 2:
+        return {'dropped': 0, 'drop_events': 0, 'dropped_idx': np.zeros(0, dtype=np.int64)}
+    gaps = np.diff(ids) - 1
+    idx = np.flatnonzero(gaps > 0)
+    return {'dropped': int(gaps[idx].sum()), 'drop_events': int(idx.size), 'dropped_idx': idx}
+
+
+class ClockModel:
+    """
+    Linear map from a camera's clock to host time (offset + drift), fitted over a run from the
+    camera timestamp and host arrival time of each frame. Host times include transfer and scheduling
+    latency, so residual_ms is mostly host-side jitter.
+    """
+    def __init__(self, cam_ns, host_ns):
+        cam = np.asarray(cam_ns, dtype=np.int64)
+        host = np.asarray(host_ns, dtype=np.int64)
+        self.cam0 = int(cam[0])
+        self.host0 = int(host[0])
+        x = (cam - self.cam0).astype(np.float64)
+        y = (host - self.host0).astype(np.float64)
+        if x.size > 1 and x[-1] != x[0]:
+            self.slope, self.intercept = np.polyfit(x, y, 1)
+        else:
+            self.slope, self.intercept = 1.0, float(y.mean()) if y.size else 0.0
+        self.residual_ms = float((y - (self.intercept + self.slope * x)).std() * 1e-6)
+
+    @property
+    def drift_ppm(self):
+        return (self.slope - 1) * 1e6
+
+    @property
+    def offset_ns(self):
+        """host time minus camera time, at the first frame"""
+        return self.host0 + self.intercept - self.cam0
+
+    def to_host(self, cam_ns):
+        cam = np.asarray(cam_ns, dtype=np.int64)
+        return self.host0 + self.intercept + self.slope * (cam - self.cam0)
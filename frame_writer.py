@@ -0,0 +1,149 @@
+import queue
+import threading
+
+# What to do when a camera's write queue is full:
+#   block       - capture thread waits for a free slot (backpressure)
+#   drop_newest - the incoming frame is discarded
+#   drop_oldest - the oldest queued frame is discarded to make room
+DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+# Worker thread for the writer pool. Each worker services every camera queue, so a
+# burst on one camera can use all of the workers.
+class WriterThread(threading.Thread):
+    def __init__(self, pool, idx):
+        threading.Thread.__init__(self, name='writer-%i' % idx, daemon=True)
+        self.pool = pool
+
+    def run(self):
+        while True:
+            self.pool._pending.acquire()
+            job = self.pool._next_job()
+            if job is None:
+                if self.pool._stopping:
+                    return
+                # Slot was freed by drop_oldest, nothing to write
+                continue
+            camnum, item = job
+            try:
+                self.pool.write_fn(item)
+                self.pool._count(self.pool._written, camnum)
+            except Exception as ex:
+                print('Error writing frame for cam%i: %s' % (camnum, ex))
+                self.pool._count(self.pool._failed, camnum)
+            finally:
+                self.pool._queues[camnum].task_done()
+
+
+class WriterPool:
+    """
+    Fixed pool of writer threads fed by one bounded queue per camera. Replaces
+    starting a new thread for every frame.
+    """
+    def __init__(self, write_fn, num_workers=4, queue_size=256, drop_policy='block', on_drop=None):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError('drop_policy must be one of %s, got %r' % (DROP_POLICIES, drop_policy))
+        self.write_fn = write_fn
+        self.num_workers = int(num_workers)
+        self.queue_size = int(queue_size)
+        self.drop_policy = drop_policy
+        self.on_drop = on_drop
+        self._queues = {}
+        self._order = []
+        self._dropped = {}
+        self._written = {}
+        self._failed = {}
+        self._pending = threading.Semaphore(0)
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._stopping = False
+        self._workers = [WriterThread(self, k) for k in range(self.num_workers)]
+
+    def add_camera(self, camnum):
+        self._queues[camnum] = queue.Queue(maxsize=self.queue_size)
+        self._order.append(camnum)
+        self._dropped[camnum] = 0
+        self._written[camnum] = 0
+        self._failed[camnum] = 0
+
+    def start(self):
+        for w in self._workers:
+            w.start()
+
+    def submit(self, camnum, item):
+        """
+        Queue an item for writing. Returns False if the item was dropped.
+        """
+        q = self._queues[camnum]
+        if self.drop_policy == 'block':
+            q.put(item)
+        elif self.drop_policy == 'drop_newest':
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                self._drop(camnum, item)
+                return False
+        else:
+            while True:
+                try:
+                    q.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        old = q.get_nowait()
+                    except queue.Empty:
+                        continue
+                    q.task_done()
+                    self._drop(camnum, old)
+        self._pending.release()
+        return True
+
+    def _count(self, counter, camnum):
+        with self._lock:
+            counter[camnum] += 1
+
+    def _drop(self, camnum, item):
+        self._count(self._dropped, camnum)
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def _next_job(self):
+        # Round-robin over camera queues so no camera starves the others
+        with self._lock:
+            n = len(self._order)
+            for k in range(n):
+                camnum = self._order[(self._cursor + k) % n]
+                try:
+                    item = self._queues[camnum].get_nowait()
+                except queue.Empty:
+                    continue
+                self._cursor = (self._cursor + k + 1) % n
+                return camnum, item
+        return None
+
+    def depth(self, camnum):
+        return self._queues[camnum].qsize()
+
+    def depths(self):
+        return {camnum: q.qsize() for camnum, q in self._queues.items()}
+
+    def dropped(self, camnum):
+        return self._dropped[camnum]
+
+    def written(self, camnum):
+        return self._written[camnum]
+
+    def failed(self, camnum):
+        return self._failed[camnum]
+
+    def drain(self):
+        """
+        Block until every queued item is written, then stop the workers.
+        """
+        for q in self._queues.values():
+            q.join()
+        self._stopping = True
+        for _ in self._workers:
+            self._pending.release()
+        for w in self._workers:
+            w.join()
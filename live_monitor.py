@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+from colorama import just_fix_windows_console
+
+# Stream statistics nodes read for the SDK's own dropped frame counters
+SDK_DROP_NODES = ('StreamDroppedFrameCount', 'StreamLostFrameCount')
+
+
+def sdk_dropped_frames(cam):
+    """
+    Sum of the SDK stream drop counters that this camera supports, or None if it has none
+    """
+    total = None
+    for name in SDK_DROP_NODES:
+        try:
+            total = (total or 0) + int(cam.get_node(name, stream=True))
+        except Exception:
+            continue
+    return total
+
+
+# Rate-limited status display, redrawn in place every `interval` seconds rather than every frame.
+# One line per camera: frames, instantaneous fps, interframe jitter, writer queue depth, frame
+# pool occupancy and dropped frames (SDK stream counters / frame ID gaps / writer drops).
+class LiveMonitor(threading.Thread):
+    def __init__(self, captures, num_images, interval=0.25):
+        threading.Thread.__init__(self, name='monitor', daemon=True)
+        self.captures = captures
+        self.num_images = num_images
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._acq_started = False
+        self._lines = 0
+        self._last = [(0, time.perf_counter())] * len(captures)
+
+    def status_lines(self):
+        pad = len(str(self.num_images))
+        lines = []
+        now = time.perf_counter()
+        for k, t in enumerate(self.captures):
+            n = len(t.times)
+            last_n, last_t = self._last[k]
+            fps = (n - last_n) / (now - last_t) if now > last_t else 0.0
+            self._last[k] = (n, now)
+            timing = t.timing.snapshot()
+            sdk = sdk_dropped_frames(t.cam)
+            ids = t.frame_ids
+            gaps = int(ids[-1] - ids[0] + 1 - len(ids)) if len(ids) else 0
+            lines.append('cam%i %s/%i  %7.2f fps  jitter %6.3f ms  queue %4i  pool %3i/%-3i  dropped sdk %s / ids %i / writer %i' % (
+                t.camnum, str(n).zfill(pad), self.num_images, fps, timing['std'], t.writer.depth(t.camnum),
+                t.pool.in_use(), t.pool.count, '-' if sdk is None else sdk, gaps,
+                t.dropped))
+        return lines
+
+    def refresh(self):
+        if not self._acq_started:
+            if not any(len(t.times) for t in self.captures):
+                return
+            self._acq_started = True
+            self._last = [(len(t.times), time.perf_counter()) for t in self.captures]
+            sys.stdout.write('*** ACQUISITION STARTED ***\n\n')
+        lines = self.status_lines()
+        out = ''
+        if self._lines:
+            out += '\033[%iF' % self._lines  # move back up to redraw in place
+        out += ''.join('\033[2K' + line + '\n' for line in lines)
+        self._lines = len(lines)
+        sys.stdout.write(out)
+        sys.stdout.flush()
+
+    def run(self):
+        # use colorama to allow Windows systems to interpret ANSI cursor codes
+        just_fix_windows_console()
+        while not self._stop_event.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.refresh()
@@ -0,0 +1,113 @@
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from camera_backend import CameraError
+
+# GenICam nodes used by configure_cam and reset_trigger, in every trigger mode. TriggerSoftware is only
+# looked up for software triggering (software_trigger below), as not every camera has it.
+DEVICE_NODES = ('TriggerMode', 'TriggerSource', 'TriggerOverlap', 'AcquisitionMode', 'ExposureAuto',
+                'ExposureTime', 'Width', 'Height', 'PixelFormat')
+STREAM_NODES = ('StreamBufferCountMode', 'StreamBufferCountManual')
+
+
+def _node_property(name, stream=False):
+    return property(lambda self: self.cam.get_node(name, stream),
+                    lambda self, value: self.cam.set_node(name, value, stream),
+                    doc='%s node' % name)
+
+
+class CameraNodes:
+    """
+    Typed access to the nodes this code uses on one camera. Every node is looked up and checked
+    once when this is created (after cam.Init()), so a missing node fails here rather than mid-run,
+    and later reads/writes go through the camera's cached handles.
+    Enumerations take/return entry names, integer and float nodes numbers.
+    """
+    trigger_mode = _node_property('TriggerMode')
+    trigger_source = _node_property('TriggerSource')
+    trigger_overlap = _node_property('TriggerOverlap')
+    acquisition_mode = _node_property('AcquisitionMode')
+    exposure_auto = _node_property('ExposureAuto')
+    exposure_time = _node_property('ExposureTime')  # us
+    width = _node_property('Width')
+    height = _node_property('Height')
+    pixel_format = _node_property('PixelFormat')
+    buffer_count_mode = _node_property('StreamBufferCountMode', stream=True)
+    buffer_count = _node_property('StreamBufferCountManual', stream=True)
+
+    def __init__(self, cam, device_nodes=DEVICE_NODES, stream_nodes=STREAM_NODES):
+        self.cam = cam
+        missing = cam.resolve(device_nodes) + cam.resolve(stream_nodes, stream=True)
+        if missing:
+            raise CameraError('Camera is missing node(s): %s' % ', '.join(missing))
+
+    def software_trigger(self):
+        """
+        Callable firing TriggerSoftware; get it once the trigger source is set to Software. The node
+        is looked up and checked here, so only software-triggered cameras need to have it.
+        """
+        return self.cam.command('TriggerSoftware')
+
+    def buffer_count_max(self):
+        return self.cam.node_range('StreamBufferCountManual', stream=True)[1]
+
+
+def apply_parallel(cams, fn):
+    """
+    Run fn(cam, camnum) for every camera at once, one thread per camera. Node writes are mostly
+    waiting on the USB link, so N cameras take about as long as one. Returns the results in order.
+    """
+    if not cams:
+        return []
+    with ThreadPoolExecutor(max_workers=len(cams)) as pool:
+        return list(pool.map(fn, cams, range(len(cams))))
+
+
+class StartupTimes:
+    """
+    How long each camera setup step took (Init, each node write, BeginAcquisition, ...), per camera.
+    Steps are recorded from the per-camera setup threads; each camera only appends to its own list.
+    """
+    def __init__(self):
+        self.t0 = time.perf_counter_ns()
+        self.steps = {}  # camnum -> [(step, ns), ...] in the order they ran
+
+    def add(self, camnum, name, ns):
+        self.steps.setdefault(camnum, []).append((name, ns))
+
+    @contextmanager
+    def step(self, camnum, name):
+        t = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(camnum, name, time.perf_counter_ns() - t)
+
+    def elapsed_ms(self):
+        return (time.perf_counter_ns() - self.t0) * 1e-6
+
+    def summary(self):
+        """
+        [(step, mean ms, max ms, slowest camera), ...] across cameras, in the order steps first ran
+        """
+        per_step = {}
+        for camnum, steps in sorted(self.steps.items()):
+            for name, ns in steps:
+                per_step.setdefault(name, []).append((ns * 1e-6, camnum))
+        rows = []
+        for name, times in per_step.items():
+            slowest, camnum = max(times)
+            rows.append((name, sum(t for t, _ in times) / len(times), slowest, camnum))
+        return rows
+
+    def print_summary(self, detailed=False):
+        rows = self.summary()
+        print('Camera setup took %.1f ms for %i camera(s)' % (self.elapsed_ms(), len(self.steps)))
+        if not rows:
+            return
+        if detailed:
+            for name, mean, slowest, camnum in rows:
+                print('  %-26s %8.2f ms mean  %8.2f ms max (cam%i)' % (name, mean, slowest, camnum))
+        else:
+            name, mean, slowest, camnum = max(rows, key=lambda r: r[2])
+            print('Slowest setup step: %s, %.2f ms (cam%i)' % (name, slowest, camnum))
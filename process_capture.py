@@ -0,0 +1,321 @@
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from camera_backend import get_backend
+from capture_loop import capture_frames
+from camera_config import apply_config, restore_pacing
+from frame_pool import unpacked_format
+from frame_sinks import make_sink
+from frame_writer import WriterPool
+from node_cache import CameraNodes
+from timestamp_log import TimestampLog, load_timestamps
+from trigger_scheduler import TriggerScheduler
+
+PRIORITIES = ('normal', 'high', 'realtime')
+
+# ----------------------------------------------------------------------------------------------
+# Multi-process capture: every camera gets a capture process (camera -> shared frame pool) and a
+# writer process (shared frame pool -> disk), so no two cameras, and no camera and its writers,
+# share a GIL. The coordinating process configures the cameras first; the capture process opens
+# its camera again by serial number and only has to re-apply that configuration. Processes are
+# started with 'spawn', since the camera SDK can't be used across fork.
+# ----------------------------------------------------------------------------------------------
+
+
+def set_affinity_and_priority(cores=None, priority='normal'):
+    """
+    Pin the current process to the given CPU cores and raise its priority. Uses the os module on
+    Linux and psutil (if installed) elsewhere. Returns what couldn't be done, as messages.
+    """
+    problems = []
+    if cores:
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, cores)
+            except OSError as ex:
+                problems.append('pinning to cores %s failed: %s' % (cores, ex))
+        else:
+            try:
+                import psutil
+                psutil.Process().cpu_affinity(list(cores))
+            except ImportError:
+                problems.append('pinning to cores needs psutil on this platform')
+            except (OSError, psutil.Error) as ex:
+                problems.append('pinning to cores %s failed: %s' % (cores, ex))
+    if priority == 'normal':
+        return problems
+    if sys.platform == 'win32':
+        try:
+            import psutil
+            psutil.Process().nice(psutil.REALTIME_PRIORITY_CLASS if priority == 'realtime' else psutil.HIGH_PRIORITY_CLASS)
+        except ImportError:
+            problems.append('%s priority needs psutil on Windows' % priority)
+        except (OSError, psutil.Error) as ex:
+            problems.append('%s priority failed: %s' % (priority, ex))
+    elif priority == 'realtime' and hasattr(os, 'sched_setscheduler'):
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))
+        except OSError as ex:
+            problems.append('realtime priority failed (needs root or CAP_SYS_NICE): %s' % ex)
+    else:
+        try:
+            os.nice(-10)
+        except OSError as ex:
+            problems.append('high priority failed (needs root or CAP_SYS_NICE): %s' % ex)
+    return problems
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the current process in MB, or None where it can't be read (Windows
+    without psutil)
+    """
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2**20
+        except ImportError:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def assign_cores(num_cameras):
+    """
+    One core of its own per capture process, leaving the first core to the OS; writer processes
+    share the remaining cores. Returns ([cores of each capture process], writer cores), or no
+    pinning at all if there aren't enough cores.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    usable = cores[1:]
+    if len(usable) <= num_cameras:
+        return [None] * num_cameras, None
+    return [[core] for core in usable[:num_cameras]], usable[num_cameras:]
+
+
+def capture_camera(job, pool, ready, armed, t0, results):
+    """
+    Capture process of one camera: frames go into the shared pool, timestamps into the camera's
+    TimestampLog. Waits at `ready` once the camera is set up and starts acquiring at `armed` (a
+    primary camera starts after the others). Software-triggered cameras fire on a schedule starting
+    at t0, which the coordinator sets between the two barriers.
+    """
+    result = {'camnum': job['camnum'], 'captured': 0, 'exhausted': 0, 'missing': 0, 'error': None,
+              'problems': set_affinity_and_priority(job['cores'], job['priority'])}
+    backend = get_backend(job['backend'], job['backend_options'])
+    cam = None
+    log = None
+    try:
+        cam = next(c for c in backend.get_cameras() if str(c.serial_number()) == job['serial'])
+        cam.Init()
+        # Normally nothing is written here, since the camera keeps what the coordinator set; the
+        # stream (buffer) settings are per process though
+        snapshot = job['snapshot']
+        apply_config(cam, [(name, value, False) for name, value in snapshot['device'].items()], backend.errors)
+        apply_config(cam, [(name, value, True) for name, value in snapshot['stream'].items()], backend.errors)
+        scheduler = None
+        if job['role'] == 'software':
+            scheduler = TriggerScheduler(job['framerate'], job['num_images'], spin_ms=job['spin_ms'],
+                                         errors=backend.errors)
+            scheduler.add_trigger(CameraNodes(cam).software_trigger())
+        log = TimestampLog(job['log_path'], job['num_images'])
+
+        ready.wait()
+        primary = job['role'] == 'primary'
+        if not primary:
+            cam.BeginAcquisition()
+        armed.wait()
+        if primary:
+            cam.BeginAcquisition()
+        timeout = None
+        if scheduler is not None:
+            scheduler.t0_ns = t0.value
+            scheduler.start()
+            timeout = 1 + 10 / job['framerate'] + job['exp_time']
+
+        result['missing'] = capture_frames(cam, job['num_images'], log, pool,
+                                           lambda slot, i, t_frame: pool.filled.put((slot, i, t_frame)),
+                                           backend.errors, block=job['drop_policy'] == 'block', timeout=timeout,
+                                           scheduler=scheduler)
+
+        cam.EndAcquisition()
+        log.close()
+        log.export(job['timestamp_export'], 't' + str(job['camnum']))
+        if scheduler is not None:
+            scheduler.stop()
+            result['trigger_lateness_us'] = scheduler.lateness_stats()
+            result['missed_triggers'] = scheduler.missed[0]
+    except BaseException as ex:
+        result['error'] = '%s: %s' % (type(ex).__name__, ex)
+        ready.abort()  # don't leave the other cameras waiting for this one
+        armed.abort()
+    finally:
+        pool.filled.put(None)  # tells the writer process there is nothing more
+        if log is not None:
+            result['captured'] = log.count
+        result['exhausted'] = pool.exhausted
+        if cam is not None:
+            try:
+                CameraNodes(cam).trigger_mode = 'Off'
+                restore_pacing(cam, job['pacing_before'], backend.errors)
+                cam.DeInit()
+            except backend.errors as ex:
+                result['problems'].append('resetting the camera failed: %s' % ex)
+            del cam
+        backend.release()
+        result['peak_rss_mb'] = peak_rss_mb()
+        results.put(('capture', result))
+
+
+def write_camera(job, pool, results):
+    """
+    Writer process of one camera: takes filled slots from the shared pool, writes them with a pool
+    of writer threads and hands the slots back
+    """
+    result = {'camnum': job['camnum'], 'written': 0, 'failed': 0, 'error': None,
+              'problems': set_affinity_and_priority(job['writer_cores'])}
+    camnum = job['camnum']
+    write_return = np.full(job['num_images'], -1, dtype=np.int64)
+    item = ()
+    try:
+        sink = make_sink(job['output_format'], job['basename'], camnum, job['num_images'], pool.shape[0],
+                         pool.shape[1], unpacked_format(job['pixel_format']), pool.dtype, **job['sink_options'])
+
+        def write(item):
+            slot, idx, timestamp = item
+            try:
+                sink.write(pool.buffers[slot], idx, timestamp)
+                write_return[idx] = time.perf_counter_ns() - timestamp
+            finally:
+                pool.release(slot)
+
+        writer = WriterPool(write, num_workers=job['writer_threads'], queue_size=pool.count)
+        writer.add_camera(camnum)
+        writer.start()
+        while True:
+            item = pool.filled.get()
+            if item is None:
+                break
+            writer.submit(camnum, item)
+        writer.drain()
+        sink.close()
+        result['written'] = writer.written(camnum)
+        result['failed'] = writer.failed(camnum)
+    except BaseException as ex:
+        result['error'] = '%s: %s' % (type(ex).__name__, ex)
+        # keep handing slots back, so the capture process doesn't wait for them forever
+        while item is not None:
+            item = pool.filled.get()
+            if item is not None:
+                pool.release(item[0])
+    result['write_return'] = write_return
+    result['peak_rss_mb'] = peak_rss_mb()
+    results.put(('writer', result))
+
+
+def run_capture_processes(jobs, pools, ctx, start_delay=0.5, join_timeout=10):
+    """
+    Start the capture and writer processes of every camera, start acquisition on all of them
+    together and wait until they are done. Returns {camnum: {'capture': ..., 'writer': ...}}.
+    """
+    n = len(jobs)
+    ready = ctx.Barrier(n + 1)
+    armed = ctx.Barrier(n + 1)
+    t0 = ctx.Value('q', 0)
+    results = ctx.Queue()
+    procs = []
+    for job, pool in zip(jobs, pools):
+        procs.append(ctx.Process(target=write_camera, args=(job, pool, results), name='writer%i' % job['camnum']))
+        procs.append(ctx.Process(target=capture_camera, args=(job, pool, ready, armed, t0, results),
+                                 name='capture%i' % job['camnum']))
+    for p in procs:
+        p.start()
+    captures = {job['camnum']: p for job, p in zip(jobs, procs[1::2])}
+
+    # A capture process that dies (segfault in the SDK, OOM kill, ...) never reaches the barriers;
+    # break them, so the other cameras and this process don't wait for it forever
+    armed_or_broken = threading.Event()
+
+    def watch_start():
+        while not armed_or_broken.wait(0.5):
+            if any(p.exitcode is not None for p in captures.values()):
+                ready.abort()
+                armed.abort()
+                return
+
+    watcher = threading.Thread(target=watch_start, daemon=True)
+    watcher.start()
+    try:
+        ready.wait()
+        t0.value = time.perf_counter_ns() + int(start_delay * 1e9)
+        armed.wait()
+        print('*** ACQUISITION STARTED ***\n')
+    except threading.BrokenBarrierError:
+        print('A camera process failed before acquisition started')
+    armed_or_broken.set()
+
+    collected = {job['camnum']: {} for job in jobs}
+    received = 0
+    # every process reports once; stop early if one died without reporting
+    while received < len(procs):
+        try:
+            kind, result = results.get(timeout=1)
+        except queue.Empty:
+            received += reap_captures(captures, pools, collected)
+            if not any(p.is_alive() for p in procs):
+                break
+            continue
+        if kind not in collected[result['camnum']]:
+            received += 1
+        collected[result['camnum']][kind] = result
+    for p in procs:
+        p.join(join_timeout)
+        if p.is_alive():
+            print('%s process did not finish, terminating it' % p.name)
+            p.terminate()
+            p.join()
+    return collected
+
+
+def reap_captures(captures, pools, collected):
+    """
+    Capture processes that were killed (nonzero exit code) without reporting: report the camera as
+    failed, and tell its writer process there is nothing more, as the capture process would have.
+    Returns the number of cameras reported.
+    """
+    reaped = 0
+    for (camnum, p), pool in zip(captures.items(), pools):
+        if p.exitcode not in (None, 0) and 'capture' not in collected[camnum]:
+            collected[camnum]['capture'] = {'camnum': camnum, 'captured': 0, 'exhausted': 0, 'missing': 0,
+                                            'problems': [],
+                                            'error': 'capture process died (exit code %s)' % p.exitcode}
+            pool.filled.put(None)
+            reaped += 1
+    return reaped
+
+
+class CaptureResult:
+    """
+    One camera's outcome from the capture and writer processes, with the same attributes as a
+    ThreadCapture that the timing and run reports use
+    """
+    def __init__(self, camnum, log_path, capture, writer):
+        # a capture process that was killed early may not have made its log
+        data = load_timestamps(log_path) if os.path.exists(log_path) else np.zeros((0, 3), dtype=np.int64)
+        self.camnum = camnum
+        self.times = data[:, 0]
+        self.cam_times = data[:, 1]
+        self.frame_ids = data[:, 2]
+        self.capture = capture
+        self.writer = writer
+        self.write_return = writer.get('write_return', np.zeros(0, dtype=np.int64))
+        self.dropped = capture.get('exhausted', 0)
+        self.failed = writer.get('failed', 0)
@@ -0,0 +1,146 @@
+import threading
+import time
+import numpy as np
+
+
+def open_serial(port, baud=115200, timeout=0.1):
+    """
+    Open a serial port, or a FakeSerial if port is 'fake'. Raises OSError (serial.SerialException)
+    if the port isn't available, and ImportError without pyserial.
+    """
+    if port == 'fake':
+        return FakeSerial(timeout=timeout)
+    import serial
+    return serial.Serial(port, baud, timeout=timeout)
+
+
+# Reads a serial port on its own thread, so nothing else ever waits on it. Every line goes into a
+# preallocated ring buffer of fixed-width byte strings (longer lines are cut to line_width), stamped
+# with the host time (clock(), in ns) at which its read returned. Lines are only parsed at the end,
+# all at once (parse_lines). If more than `capacity` lines arrive, the oldest are overwritten and
+# counted in `overrun`.
+class SerialReader(threading.Thread):
+    def __init__(self, port, capacity=2**20, line_width=32, clock=time.time_ns):
+        threading.Thread.__init__(self, name='serial-reader', daemon=True)
+        self.port = port
+        self.clock = clock
+        self.capacity = int(capacity)
+        self.lines = np.zeros(self.capacity, dtype='S%i' % line_width)
+        self.times = np.zeros(self.capacity, dtype=np.int64)
+        self.count = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        pending = b''
+        first = True
+        while not self._stop_event.is_set():
+            data = self.port.read(max(1, self.port.in_waiting))
+            if not data:
+                continue
+            t = self.clock()
+            lines = (pending + data).split(b'\n')
+            pending = lines.pop()
+            if first and lines:
+                # the first line is usually cut off, since the port was already sending
+                lines.pop(0)
+                first = False
+            for line in lines:
+                k = self.count % self.capacity
+                self.lines[k] = line.rstrip(b'\r')
+                self.times[k] = t
+                self.count += 1
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    @property
+    def overrun(self):
+        return max(0, self.count - self.capacity)
+
+    def latest(self):
+        """
+        (host time, line) of the last line received, or None
+        """
+        if not self.count:
+            return None
+        k = (self.count - 1) % self.capacity
+        return self.times[k], self.lines[k]
+
+    def data(self):
+        """
+        Host times and lines still in the buffer, oldest first
+        """
+        if self.count <= self.capacity:
+            return self.times[:self.count], self.lines[:self.count]
+        k = self.count % self.capacity
+        return np.roll(self.times, -k), np.roll(self.lines, -k)
+
+
+def parse_lines(lines, num_fields=None):
+    """
+    Parse lines of space-separated integers (e.g. b'12 -3 40') into an int64 array of num_fields
+    columns, all at once. Lines that don't hold num_fields integers become zeros. num_fields defaults
+    to the most common field count.
+    """
+    lines = np.char.strip(np.asarray(lines, dtype='S'))
+    if lines.size == 0:
+        return np.zeros((0, num_fields or 0), dtype=np.int64)
+    fields = np.char.count(lines, b' ') + 1
+    if num_fields is None:
+        num_fields = int(np.bincount(fields).argmax())
+    # only digits, with single spaces between fields and a minus sign at most at the start of a field
+    unsigned = np.char.replace(np.char.add(b' ', lines), b' -', b' ')
+    ok = ((fields == num_fields) & np.char.isdigit(np.char.replace(unsigned, b' ', b''))
+          & (np.char.find(unsigned, b'  ') < 0) & ~np.char.endswith(unsigned, b' '))
+    lines = np.where(ok, lines, b' '.join([b'0'] * num_fields))
+    return np.array(b' '.join(lines.tolist()).split()).astype(np.int64).reshape(-1, num_fields)
+
+
+# Stands in for the Arduino's serial port without hardware. Sends 'ms position velocity' lines at
+# `rate` lines per second, like the rotary encoder, with an occasional corrupted line (garbage_prob).
+class FakeSerial:
+    def __init__(self, rate=1000, timeout=0.1, garbage_prob=0.001, seed=None):
+        self.rate = rate
+        self.timeout = timeout
+        self.garbage_prob = garbage_prob
+        self.rng = np.random.default_rng(seed)
+        self.t0 = time.perf_counter()
+        self._sent = 0
+        self._buffer = b''
+        self.position = 0
+
+    def _generate(self):
+        due = int((time.perf_counter() - self.t0) * self.rate)
+        lines = []
+        for k in range(self._sent, due):
+            velocity = int(self.rng.integers(-3, 4))
+            self.position += velocity
+            if self.rng.random() < self.garbage_prob:
+                lines.append(b'\xff\xfe 1\r\n')
+            else:
+                lines.append(b'%i %i %i\r\n' % (k * 1000 // self.rate, self.position, velocity))
+        self._sent = max(self._sent, due)
+        self._buffer += b''.join(lines)
+
+    @property
+    def in_waiting(self):
+        self._generate()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        deadline = time.perf_counter() + self.timeout
+        self._generate()
+        while len(self._buffer) < size and time.perf_counter() < deadline:
+            time.sleep(min(1 / self.rate, self.timeout))
+            self._generate()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def reset_input_buffer(self):
+        self._generate()
+        self._buffer = b''
+
+    def close(self):
+        pass
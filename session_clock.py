@@ -0,0 +1,135 @@
+import time
+import numpy as np
+from frame_timing import ClockModel
+
+
+class SessionClock:
+    """
+    One time source for every stream of a session (camera frames, DAQ blocks, serial lines, stim
+    events). Times are ns on the monotonic perf_counter_ns clock, offset to the wall clock at the
+    start of the session. They read like time.time_ns(), but never jump with clock adjustments,
+    and they all share the same origin.
+    """
+    def __init__(self):
+        self.perf0 = time.perf_counter_ns()
+        self.wall0 = time.time_ns()
+        self.events = {}
+
+    def now(self):
+        return self.wall0 + time.perf_counter_ns() - self.perf0
+
+    def seconds(self):
+        """
+        Session time now, in s since the clock was created
+        """
+        return (time.perf_counter_ns() - self.perf0) * 1e-9
+
+    def mark(self, name):
+        """
+        Record the time of a one-off event, such as the start of the stim output
+        """
+        self.events[name] = self.now()
+        return self.events[name]
+
+
+class AlignmentIndex:
+    """
+    Session time (s since the SessionClock started) of every sample of every stream, built after a
+    run so streams can be joined with searchsorted instead of by hand. Streams with their own sample
+    clock are fitted against their host stamps (ClockModel), which removes host-side jitter:
+      - add_times:   one host time per sample (serial lines)
+      - add_clocked: device timestamp and host time per sample (camera frames)
+      - add_sampled: a fixed-rate stream stamped once per block (DAQ), stored as t0 + k * period
+    """
+    def __init__(self, wall0):
+        self.wall0 = int(wall0)
+        self.streams = {}  # name -> session times, one per sample
+        self.linear = {}   # name -> (t0, period, count)
+        self.events = {}   # name -> session time
+
+    def _session(self, host_ns):
+        return (np.asarray(host_ns, dtype=np.int64) - self.wall0) * 1e-9
+
+    def _fitted(self, model, device_ns):
+        # kept relative to the first sample, as ns since the epoch don't fit a float64 exactly
+        device = np.asarray(device_ns, dtype=np.int64) - model.cam0
+        return ((model.host0 - self.wall0) + model.intercept + model.slope * device) * 1e-9
+
+    def add_times(self, name, host_ns):
+        self.streams[name] = self._session(host_ns)
+
+    def add_clocked(self, name, device_ns, host_ns):
+        if len(device_ns) < 2:
+            self.add_times(name, host_ns)
+            return
+        self.streams[name] = self._fitted(ClockModel(device_ns, host_ns), device_ns)
+
+    def add_sampled(self, name, block_ends, host_ns, fs, count):
+        """
+        block_ends: samples recorded when each host stamp was taken; count: samples in the stream
+        """
+        ends = np.asarray(block_ends, dtype=np.int64)
+        if ends.size < 2:
+            return
+        model = ClockModel(ends * int(1e9) // int(fs), host_ns)
+        self.linear[name] = (float(self._fitted(model, 0)), float(model.slope / fs), int(count))
+
+    def add_events(self, events):
+        self.events.update({name: float(self._session(t)) for name, t in events.items()})
+
+    def times(self, name):
+        if name in self.linear:
+            t0, period, count = self.linear[name]
+            return t0 + period * np.arange(count)
+        return self.streams[name]
+
+    def index_at(self, name, t):
+        """
+        Index of the latest sample of stream `name` at or before session time(s) t, -1 before the first
+        """
+        t = np.asarray(t, dtype=np.float64)
+        if name in self.linear:
+            t0, period, count = self.linear[name]
+            k = np.floor((t - t0) / period).astype(np.int64)
+            return np.where(k < 0, -1, np.minimum(k, count - 1))
+        return np.searchsorted(self.streams[name], t, side='right') - 1
+
+    def nearest(self, name, t):
+        """
+        Index of the sample of stream `name` closest to session time(s) t
+        """
+        t = np.asarray(t, dtype=np.float64)
+        if name in self.linear:
+            t0, period, count = self.linear[name]
+            return np.clip(np.rint((t - t0) / period).astype(np.int64), 0, count - 1)
+        times = self.streams[name]
+        k = np.clip(np.searchsorted(times, t), 1, len(times) - 1)
+        return np.where(np.abs(times[k - 1] - t) <= np.abs(times[k] - t), k - 1, k)
+
+    def join(self, name, other):
+        """
+        For every sample of `name`, the index of the latest sample of `other` at or before it
+        """
+        return self.index_at(other, self.times(name))
+
+    def save(self, path):
+        arrays = {'wall0': np.int64(self.wall0)}
+        arrays.update({'stream_' + name: t for name, t in self.streams.items()})
+        arrays.update({'linear_' + name: np.array(v, dtype=np.float64) for name, v in self.linear.items()})
+        arrays.update({'event_' + name: np.float64(t) for name, t in self.events.items()})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            index = cls(int(f['wall0']))
+            for key in f.files:
+                kind, _, name = key.partition('_')
+                if kind == 'stream':
+                    index.streams[name] = f[key]
+                elif kind == 'linear':
+                    t0, period, count = f[key]
+                    index.linear[name] = (float(t0), float(period), int(count))
+                elif kind == 'event':
+                    index.events[name] = float(f[key])
+        return index
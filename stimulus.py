@@ -0,0 +1,103 @@
+import numpy as np
+
+TABLE_HEADER = 'onset_s,offset_s,amplitude'
+
+
+class StimSchedule:
+    """
+    A stim waveform as a table of intervals during which it is on (above threshold), with onset and
+    offset in s from the start of the stim and the peak amplitude of each. Lookups are made with a
+    cursor into the table, so a run of queries at increasing times (as from a capture loop) costs
+    O(1) each, whatever the length of the waveform; going back in time falls back to a binary search.
+    """
+    def __init__(self, onsets, offsets, amplitudes, duration):
+        self.onsets = np.asarray(onsets, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.float64)
+        self.amplitudes = np.asarray(amplitudes, dtype=np.float64)
+        self.duration = float(duration)
+        self._cursor = 0
+        self._last_t = -np.inf
+
+    @classmethod
+    def from_waveform(cls, wave, fs, threshold=0):
+        """
+        Sample k of the waveform covers k/fs to (k+1)/fs
+        """
+        wave = np.asarray(wave).ravel()
+        on = np.concatenate(([False], wave > threshold, [False]))
+        edges = np.flatnonzero(on[1:] != on[:-1])
+        starts, ends = edges[0::2], edges[1::2]
+        amplitudes = np.maximum.reduceat(wave, starts) if starts.size else np.zeros(0)
+        return cls(starts / fs, ends / fs, amplitudes, wave.size / fs)
+
+    def __len__(self):
+        return self.onsets.size
+
+    def _advance(self, t):
+        # index of the first interval that hasn't ended by t
+        if t < self._last_t:
+            self._cursor = int(np.searchsorted(self.offsets, t, side='right'))
+        else:
+            k = self._cursor
+            while k < self.offsets.size and self.offsets[k] <= t:
+                k += 1
+            self._cursor = k
+        self._last_t = t
+        return self._cursor
+
+    def interval_at(self, t):
+        """
+        Index of the interval the stim is in at time t (s), or -1 if it is off
+        """
+        k = self._advance(t)
+        return k if k < self.onsets.size and self.onsets[k] <= t else -1
+
+    def state_at(self, t):
+        return self.interval_at(t) >= 0
+
+    def next_transition(self, t):
+        """
+        (time, True for on / False for off) of the first change after t, or None if there is none
+        """
+        k = self._advance(t)
+        if k == self.onsets.size:
+            return None
+        if self.onsets[k] > t:
+            return float(self.onsets[k]), True
+        return float(self.offsets[k]), False
+
+    def trains(self, max_gap):
+        """
+        The same schedule with intervals less than max_gap (s) apart merged, e.g. the pulses of a
+        pulse train into one interval per train
+        """
+        if not len(self):
+            return self
+        split = np.flatnonzero(self.onsets[1:] - self.offsets[:-1] >= max_gap) + 1
+        starts = np.concatenate(([0], split))
+        ends = np.concatenate((split, [len(self)])) - 1
+        return StimSchedule(self.onsets[starts], self.offsets[ends], np.maximum.reduceat(self.amplitudes, starts),
+                            self.duration)
+
+    def table(self):
+        return np.column_stack((self.onsets, self.offsets, self.amplitudes))
+
+    def save(self, path):
+        """
+        Write the interval table as csv: onset_s, offset_s, amplitude
+        """
+        np.savetxt(path, self.table(), fmt='%.6f', delimiter=',', header=TABLE_HEADER, comments='')
+
+
+def load_stim(path, fs):
+    """
+    The DAQout waveform of a stim .mat file (see stimfiles/stimmaker.m) and its StimSchedule
+    """
+    import scipy.io as sio
+    wave = np.squeeze(sio.loadmat(path)['DAQout'])
+    return wave, StimSchedule.from_waveform(wave, fs)
+
+
+def load_table(path):
+    data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    return StimSchedule(data[:, 0], data[:, 1], data[:, 2], data[-1, 1] if len(data) else 0)
@@ -0,0 +1,71 @@
+import numpy as np
+
+COLUMNS = ('host', 'camera', 'frame_id')
+
+
+class TimestampLog:
+    """
+    Per-camera frame timestamps in a preallocated int64 .npy file, one row per frame with columns
+    host time (ns), camera timestamp (ns) and camera frame ID. Rows are filled in place and the file
+    is memory-mapped, so whatever was recorded reaches the file even if the run crashes (the OS writes
+    the pages back); rows never reached stay -1. It is only flushed (msync) on close, never from the
+    capture thread that records into it.
+    """
+    def __init__(self, path, num_images):
+        self.path = path
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=np.int64, shape=(int(num_images), len(COLUMNS)))
+        self.data[:] = -1
+        self._rows = self.data.view(np.ndarray)  # plain view of the same memory, cheaper to index per frame
+        self.count = 0
+
+    def record(self, host, camera=-1, frame_id=-1):
+        self._rows[self.count] = (host, camera, frame_id)
+        self.count += 1
+
+    @property
+    def host(self):
+        return self._rows[:self.count, 0]
+
+    @property
+    def camera(self):
+        return self._rows[:self.count, 1]
+
+    @property
+    def frame_id(self):
+        return self._rows[:self.count, 2]
+
+    def close(self):
+        self.data.flush()
+
+    def to_txt(self, path):
+        """
+        Host times, one per line with a trailing comma (the original _t<n>.txt format)
+        """
+        with open(path, 'a') as f:
+            f.write(''.join('%i,\n' % t for t in self.host.tolist()))
+
+    def to_mat(self, path, name, scale=1e-9):
+        """
+        Host times as a MATLAB variable (seconds by default, as saved by FLIR_SPRA.py)
+        """
+        import scipy.io as sio
+        sio.savemat(path, {name: self.host * scale})
+
+    def export(self, fmt, name):
+        """
+        Save the host times next to the log as well, as <log>.txt or <log>.mat (variable `name`),
+        for fmt 'txt' or 'mat'
+        """
+        base = self.path[:-len('.npy')]
+        if fmt == 'txt':
+            self.to_txt(base + '.txt')
+        elif fmt == 'mat':
+            self.to_mat(base + '.mat', name)
+
+
+def load_timestamps(path):
+    """
+    Read a timestamp log, dropping rows that were never filled
+    """
+    data = np.load(path, mmap_mode='r')
+    return np.asarray(data[data[:, 0] != -1])
@@ -0,0 +1,72 @@
+import threading
+import time
+import numpy as np
+
+
+def wait_until(deadline_ns, spin_ns):
+    """
+    Sleep until shortly before the deadline, then spin on the clock for the rest. time.sleep alone
+    can overshoot by a millisecond or more; spinning alone would burn a core all run.
+    """
+    remaining = deadline_ns - time.perf_counter_ns()
+    if remaining > spin_ns:
+        time.sleep((remaining - spin_ns) * 1e-9)
+    while time.perf_counter_ns() < deadline_ns:
+        pass
+
+
+# Fires the software trigger of every camera from one thread, against absolute deadlines
+# t0 + k/framerate. Being late for one tick doesn't push back the following ones, so the rate
+# doesn't drift over long runs, and all cameras are triggered together on every tick.
+# Schedulers in separate processes stay in step when given the same t0_ns (perf_counter_ns is
+# system-wide).
+class TriggerScheduler(threading.Thread):
+    def __init__(self, framerate, num_ticks, spin_ms=1.0, start_delay=0.1, errors=(Exception,), t0_ns=None):
+        threading.Thread.__init__(self, name='trigger-scheduler', daemon=True)
+        self.t0_ns = t0_ns
+        self.period_ns = 1e9 / framerate
+        self.num_ticks = int(num_ticks)
+        self.spin_ns = int(spin_ms * 1e6)
+        self.start_delay_ns = int(start_delay * 1e9)
+        self.errors = errors
+        self.triggers = []
+        self.missed = []
+        self.lateness = np.zeros(self.num_ticks, dtype=np.int64)  # ns past each deadline
+        self.ticks = 0
+        self.done = threading.Event()
+        self._stop_event = threading.Event()
+
+    def add_trigger(self, trigger):
+        self.triggers.append(trigger)
+        self.missed.append(0)
+
+    def run(self):
+        try:
+            t0 = self.t0_ns if self.t0_ns is not None else time.perf_counter_ns() + self.start_delay_ns
+            for k in range(self.num_ticks):
+                if self._stop_event.is_set():
+                    break
+                deadline = t0 + int(k * self.period_ns)
+                wait_until(deadline, self.spin_ns)
+                self.lateness[k] = time.perf_counter_ns() - deadline
+                for c, trigger in enumerate(self.triggers):
+                    try:
+                        trigger()
+                    except self.errors:
+                        self.missed[c] += 1
+                self.ticks = k + 1
+        finally:
+            self.done.set()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def lateness_stats(self):
+        """
+        Lateness of the trigger ticks in us: p50, p99 and max
+        """
+        late = self.lateness[:self.ticks] * 1e-3
+        if late.size == 0:
+            return None
+        return {'p50': float(np.percentile(late, 50)), 'p99': float(np.percentile(late, 99)),
+                'max': float(late.max())}
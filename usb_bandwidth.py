@@ -0,0 +1,87 @@
+from frame_pool import pixel_format_dtype
+
+# Bits per pixel on the wire, for formats where it isn't the size of the unpacked dtype
+PACKED_BITS = {'Mono10p': 10, 'Mono12p': 12}
+
+
+def bits_per_pixel(pixel_format):
+    return PACKED_BITS.get(pixel_format, 8 * pixel_format_dtype(pixel_format)().itemsize)
+
+
+def required_throughput(width, height, pixel_format, fps):
+    """
+    Image data a camera sends per second, in bytes/s
+    """
+    return width * height * bits_per_pixel(pixel_format) / 8 * fps
+
+
+def plan_throughput(cameras, budget, headroom=1.1):
+    """
+    Split each USB controller's budget (bytes/s) between the cameras on it. cameras is a list of dicts
+    with 'controller', 'required' (bytes/s, or None if the frame rate isn't known), 'link_speed' and
+    'range' (min, max, increment) of DeviceLinkThroughputLimit.
+    Every camera gets what it needs times headroom, and spare budget is shared out in proportion to
+    need. If a controller is over budget, its budget is shared in proportion to need instead.
+    Cameras whose need isn't known (no frame rate) get no limit (None), so they aren't capped below
+    what they may need.
+    Returns the limit for each camera and a list of problems (empty if everything fits).
+    """
+    limits = [None] * len(cameras)
+    problems = []
+    for controller in sorted({c['controller'] for c in cameras}, key=str):
+        group = [k for k, c in enumerate(cameras) if c['controller'] == controller and c['required'] is not None]
+        if not group:
+            continue
+        need = {k: cameras[k]['required'] * headroom for k in group}
+        total = sum(need.values())
+        if total > budget:
+            problems.append('USB controller %s: cameras need %.1f MB/s, budget is %.1f MB/s' % (
+                controller, total * 1e-6, budget * 1e-6))
+            share = {k: budget * need[k] / total for k in group}
+        else:
+            share = {k: need[k] + (budget - total) * need[k] / total if total else budget / len(group)
+                     for k in group}
+        for k in group:
+            lo, hi, inc = cameras[k]['range']
+            top = min(hi, cameras[k]['link_speed'] or hi)
+            if need[k] > top:
+                problems.append('cam%i needs %.1f MB/s, more than its link allows (%.1f MB/s)' % (
+                    k, need[k] * 1e-6, top * 1e-6))
+            limit = min(max(share[k], lo), top)
+            if inc:
+                limit = lo + (limit - lo) // inc * inc
+            limits[k] = int(limit)
+    return limits, problems
+
+
+def allocate_bandwidth(cams, controllers, fps, budget, headroom, errors):
+    """
+    Set DeviceLinkThroughputLimit on every camera (configured, not acquiring) from plan_throughput,
+    and print what each camera needs and gets. fps is None if the frame rate isn't known.
+    Returns the list of problems; empty if every camera's throughput fits.
+    """
+    cameras = []
+    for cam, controller in zip(cams, controllers):
+        width, height, pixel_format = cam.get_node('Width'), cam.get_node('Height'), cam.get_node('PixelFormat')
+        try:
+            link_speed = cam.get_node('DeviceLinkSpeed')
+        except errors:
+            link_speed = None
+        cameras.append({
+            'controller': controller,
+            'required': required_throughput(width, height, pixel_format, fps) if fps else None,
+            'link_speed': link_speed,
+            'range': cam.node_range('DeviceLinkThroughputLimit'),
+        })
+    limits, problems = plan_throughput(cameras, budget, headroom)
+    for k, (cam, c, limit) in enumerate(zip(cams, cameras, limits)):
+        if limit is None:
+            print('cam%i: USB controller %s, needs unknown, limit left as is' % (k, c['controller']))
+            continue
+        if not cam.resolve(['DeviceLinkThroughputLimitMode']):
+            cam.set_node('DeviceLinkThroughputLimitMode', 'On')
+        cam.set_node('DeviceLinkThroughputLimit', limit)
+        print('cam%i: USB controller %s, needs %s, limit set to %.1f MB/s' % (
+            k, c['controller'], '%.1f MB/s' % (c['required'] * 1e-6) if c['required'] is not None else 'unknown',
+            limit * 1e-6))
+    return problems